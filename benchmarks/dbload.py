@@ -0,0 +1,168 @@
+"""Measure concurrent ingest and read throughput with the default and the tuned SQLite settings.
+
+Run from the repository root:
+
+    python benchmarks/dbload.py --seconds 10 --writers 4 --readers 16
+
+For every profile a threaded WSGI server (see ``loadtest.py``) runs against a copy of
+the same seeded database. Writers post new chats while readers fetch chats from the
+API, for ``--seconds`` seconds. The ``default`` profile is SQLite as Django configures
+it: a rollback journal, where a committing writer blocks every reader, and a new
+connection per request. The ``tuned`` profile uses ``sqlite_database`` with
+``SQLITE_PRAGMAS`` and connections kept open for 600 seconds.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from loadtest import PYTHONPATH, start_server, wait_until_ready
+
+PROFILES = ("default", "tuned")
+
+
+def seed(chats: int) -> tuple[str, list[int]]:
+    """Create the load test user and ``chats`` chats. Returns the API key and the chat ids."""
+    from django.contrib.auth import get_user_model
+    from synthetic import make_chat
+
+    from chatsnipserver.models import Chat, CodeFragment
+    from chatsnipserver.services import build_code_fragment
+
+    user = get_user_model().objects.create(username="loadtest")
+    ids = []
+    for index in range(chats):
+        payload = make_chat(turns=4, code_blocks=4, images=0)
+        chat = Chat.objects.create(
+            unique_identifier=f"seed-{index}",
+            name=f"Chat {index}",
+            user=user,
+            json_data=payload["content"],
+            markdown=payload["markdown"],
+            images_downloaded=True,
+        )
+        CodeFragment.objects.bulk_create(
+            build_code_fragment(chat, element["filename"], element["content"], element["language"]) for element in payload["content"] if "language" in element
+        )
+        ids.append(chat.pk)
+    return str(user.chatsnipprofile.api_key), ids
+
+
+async def run_load(base_url: str, api_key: str, chat_ids: list[int], profile: str, args) -> dict:
+    """Run ``args.writers`` posting and ``args.readers`` reading clients for ``args.seconds`` seconds."""
+    import httpx
+    from synthetic import make_chat
+
+    latencies = {"write": [], "read": []}
+    errors = {"write": 0, "read": 0}
+    deadline = time.monotonic() + args.seconds
+    headers = {"X-Api-Key": api_key}
+
+    async def request(kind, send):
+        started = time.perf_counter()
+        try:
+            response = await send()
+        except httpx.TransportError:
+            errors[kind] += 1
+            return
+        latencies[kind].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors[kind] += 1
+
+    async def writer(client, index):
+        count = 0
+        while time.monotonic() < deadline:
+            payload = {"chatId": f"{profile}-{index}-{count}", "chatName": "Load test", **make_chat(turns=4, code_blocks=4, images=0)}
+            await request("write", lambda: client.post(f"{base_url}/api/chats/", json=payload, headers=headers))
+            count += 1
+
+    async def reader(client):
+        rng = random.Random()
+        while time.monotonic() < deadline:
+            url = f"{base_url}/api/chats/{rng.choice(chat_ids)}/" if rng.random() < 0.8 else f"{base_url}/api/chats/"
+            await request("read", lambda: client.get(url, headers=headers))
+
+    limits = httpx.Limits(max_connections=args.writers + args.readers)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(writer(client, index) for index in range(args.writers)), *(reader(client) for _ in range(args.readers)))
+        elapsed = time.perf_counter() - started
+
+    result = {}
+    for kind, values in latencies.items():
+        values.sort()
+        result[kind] = {
+            "requests": len(values),
+            "errors": errors[kind],
+            "throughput": len(values) / elapsed,
+            "p50": statistics.median(values) if values else 0,
+            "p95": values[int(len(values) * 0.95) - 1] if values else 0,
+        }
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--profile", choices=[*PROFILES, "both"], default="both")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of every run")
+    parser.add_argument("--writers", type=int, default=4, help="clients posting chats")
+    parser.add_argument("--readers", type=int, default=16, help="clients reading chats")
+    parser.add_argument("--chats", type=int, default=200, help="chats in the database before the run")
+    parser.add_argument("--threads", type=int, default=20, help="request threads of the WSGI server")
+    parser.add_argument("--port", type=int, default=8775, help="port of the first server, the others use the next ports")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.TemporaryDirectory()
+    template = os.path.join(workdir.name, "template.sqlite3")
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": "loadtest_settings",
+        "PYTHONPATH": os.pathsep.join([*PYTHONPATH, os.environ.get("PYTHONPATH", "")]),
+        "CHATSNIP_LOADTEST_DATABASE": template,
+        "CHATSNIP_LOADTEST_MEDIA_ROOT": os.path.join(workdir.name, "media"),
+        "CHATSNIP_LOADTEST_SQLITE_PROFILE": "default",
+    }
+    os.environ.update(env)
+
+    import django
+    from django.core.management import call_command
+    from django.db import connection
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+    api_key, chat_ids = seed(args.chats)
+    connection.close()
+
+    results = {}
+    for port, profile in enumerate(PROFILES if args.profile == "both" else (args.profile,), start=args.port):
+        database = os.path.join(workdir.name, f"{profile}.sqlite3")
+        shutil.copy(template, database)
+        server = start_server("wsgi-sync", port, args.threads, {**env, "CHATSNIP_LOADTEST_DATABASE": database, "CHATSNIP_LOADTEST_SQLITE_PROFILE": profile})
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            asyncio.run(wait_until_ready(f"{base_url}/api/chats/"))
+            results[profile] = asyncio.run(run_load(base_url, api_key, chat_ids, profile, args))
+        finally:
+            server.terminate()
+            server.wait()
+        for kind, result in results[profile].items():
+            print(
+                f"{profile:>7} {kind}: {result['requests']} requests, {result['errors']} errors, "
+                f"{result['throughput']:.1f} req/s, p50 {result['p50'] * 1000:.0f}ms, p95 {result['p95'] * 1000:.0f}ms"
+            )
+
+    workdir.cleanup()
+    if len(results) == 2:
+        for kind in ("write", "read"):
+            print(f"tuned {kind} throughput: x{results['tuned'][kind]['throughput'] / results['default'][kind]['throughput']:.2f} of default")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""Compare chat ingest throughput under WSGI and ASGI with slow image servers.
+
+Run from the repository root:
+
+    python benchmarks/loadtest.py --requests 100 --concurrency 20 --image-delay 0.5
+
+Each request posts a chat with ``--images`` images served by a local stub server
+that waits ``--image-delay`` seconds before answering. The WSGI server handles
+requests on a pool of ``--threads`` threads, like a threaded gunicorn worker. The
+ASGI server is uvicorn with a single event loop. Every server runs in a subprocess
+against the same throwaway SQLite database.
+
+Three setups are compared: ``wsgi-sync`` ingests with the synchronous viewset
+(``CHATSNIP_ASYNC_INGEST = False``), ``wsgi`` runs the async ingest view on the
+WSGI server, and ``asgi`` runs it under uvicorn.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+ROOT = Path(__file__).resolve().parent.parent
+PYTHONPATH = [str(ROOT / "benchmarks"), str(ROOT / "testsite"), str(ROOT / "src")]
+sys.path[:0] = PYTHONPATH
+
+
+class PooledWSGIServer(ThreadingMixIn, WSGIServer):
+    """WSGI server handling requests on a fixed pool of threads."""
+
+    threads = 8
+    request_queue_size = 1024
+
+    def process_request(self, request, client_address):
+        if not hasattr(self, "pool"):
+            self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_wsgi(port: int, threads: int) -> None:
+    from django.core.wsgi import get_wsgi_application
+
+    PooledWSGIServer.threads = threads
+    make_server("127.0.0.1", port, get_wsgi_application(), server_class=PooledWSGIServer, handler_class=QuietHandler).serve_forever()
+
+
+SERVERS = ("wsgi-sync", "wsgi", "asgi")
+
+
+def start_server(kind: str, port: int, threads: int, env: dict) -> subprocess.Popen:
+    env = {
+        **env,
+        "CHATSNIP_LOADTEST_ASYNC_INGEST": "0" if kind == "wsgi-sync" else "1",
+        # Persistent connections pile up under ASGI, where every request runs in a new thread.
+        "CHATSNIP_LOADTEST_CONN_MAX_AGE": "0" if kind == "asgi" else "600",
+    }
+    if kind == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "testsite.asgi:application", "--port", str(port), "--log-level", "warning", "--no-access-log"]
+    else:
+        command = [sys.executable, __file__, "--serve-wsgi", "--port", str(port), "--threads", str(threads)]
+    return subprocess.Popen(command, env=env)
+
+
+async def wait_until_ready(url: str, timeout: float = 30) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def run_load(url: str, api_key: str, image_server_url: str, kind: str, args) -> dict:
+    """Post ``args.requests`` chats with at most ``args.concurrency`` requests in flight."""
+    import httpx
+    from synthetic import make_chat
+
+    limit = asyncio.Semaphore(args.concurrency)
+    latencies, errors = [], 0
+
+    async def post(client, index):
+        nonlocal errors
+        payload = make_chat(turns=4, code_blocks=4, images=args.images, image_base_url=f"{image_server_url}/{kind}/{index}")
+        async with limit:
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, json={"chatId": f"{kind}-{index}", "chatName": "Load test", **payload}, headers={"X-Api-Key": api_key})
+            except httpx.TransportError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    async with httpx.AsyncClient(timeout=600, limits=httpx.Limits(max_connections=args.concurrency)) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(post(client, index) for index in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": args.requests,
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": args.requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--server", choices=[*SERVERS, "all"], default="all")
+    parser.add_argument("--requests", type=int, default=100, help="number of chats to post")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight at the same time")
+    parser.add_argument("--images", type=int, default=4, help="images per chat")
+    parser.add_argument("--image-delay", type=float, default=0.5, help="seconds the image server waits before answering")
+    parser.add_argument("--threads", type=int, default=8, help="request threads of the WSGI server")
+    parser.add_argument("--port", type=int, default=8765, help="port of the first server, the others use the next ports")
+    parser.add_argument("--serve-wsgi", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve_wsgi:
+        serve_wsgi(args.port, args.threads)
+        return 0
+
+    workdir = tempfile.TemporaryDirectory()
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": "loadtest_settings",
+        "PYTHONPATH": os.pathsep.join([*PYTHONPATH, os.environ.get("PYTHONPATH", "")]),
+        "CHATSNIP_LOADTEST_DATABASE": os.path.join(workdir.name, "db.sqlite3"),
+        "CHATSNIP_LOADTEST_MEDIA_ROOT": os.path.join(workdir.name, "media"),
+    }
+    os.environ.update(env)
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+    from django.contrib.auth import get_user_model
+    from synthetic import ImageServer
+
+    api_key = str(get_user_model().objects.create(username="loadtest").chatsnipprofile.api_key)
+
+    results = {}
+    with ImageServer(delay=args.image_delay) as image_server:
+        for port, kind in enumerate(SERVERS if args.server == "all" else (args.server,), start=args.port):
+            server = start_server(kind, port, args.threads, env)
+            try:
+                url = f"http://127.0.0.1:{port}/api/chats/"
+                asyncio.run(wait_until_ready(url))
+                results[kind] = asyncio.run(run_load(url, api_key, image_server.url, kind, args))
+            finally:
+                server.terminate()
+                server.wait()
+            result = results[kind]
+            print(
+                f"{kind:>9}: {result['requests']} requests, {result['errors']} errors in {result['seconds']:.1f}s, "
+                f"{result['throughput']:.2f} req/s, p50 {result['p50']:.2f}s, p95 {result['p95']:.2f}s"
+            )
+
+    workdir.cleanup()
+    if "wsgi-sync" in results:
+        for kind in results.keys() - {"wsgi-sync"}:
+            print(f"{kind} throughput: x{results[kind]['throughput'] / results['wsgi-sync']['throughput']:.2f} of wsgi-sync")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+"""Settings for ``loadtest.py`` and ``dbload.py``: the test site with a throwaway database and media directory."""
+
+import os
+
+from chatsnipserver.database import SQLITE_PRAGMAS, sqlite_database
+from testsite.settings import *  # noqa: F401, F403
+
+DEBUG = False
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+if os.environ.get("CHATSNIP_LOADTEST_SQLITE_PROFILE") == "default":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ["CHATSNIP_LOADTEST_DATABASE"],
+            "OPTIONS": {"timeout": 60},
+        }
+    }
+    CHATSNIP_SQLITE_PRAGMAS = None
+else:
+    DATABASES = {"default": sqlite_database(os.environ["CHATSNIP_LOADTEST_DATABASE"], conn_max_age=int(os.environ.get("CHATSNIP_LOADTEST_CONN_MAX_AGE", "0")))}
+    CHATSNIP_SQLITE_PRAGMAS = SQLITE_PRAGMAS
+MEDIA_ROOT = os.environ["CHATSNIP_LOADTEST_MEDIA_ROOT"]
+CHATSNIP_RATE_LIMIT = "1000000/s"
+CHATSNIP_SLOW_REQUEST_SECONDS = 3600
+CHATSNIP_ASYNC_INGEST = os.environ.get("CHATSNIP_LOADTEST_ASYNC_INGEST", "1") == "1"
@@ -0,0 +1,253 @@
+"""Benchmarks for the ChatSnipServer ingest and render hot paths.
+
+Run from the repository root:
+
+    python benchmarks/run.py --save benchmarks/baseline.json
+    python benchmarks/run.py --compare benchmarks/baseline.json
+
+The benchmarks run against a throwaway test database and media directory, with
+images served by a local stub HTTP server. ``--compare`` exits with status 1 when
+a benchmark's median time exceeds the baseline by more than ``--threshold``.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "benchmarks"), str(ROOT / "testsite"), str(ROOT / "src")]
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "testsite.settings")
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """Register a benchmark.
+
+    The decorated function receives the runner context and returns a callable
+    performing one timed iteration.
+    """
+
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+def measure(func, repeat: int) -> dict:
+    """Time ``repeat`` calls of ``func`` after one warm-up call."""
+    func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return {
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Return a description of every benchmark slower than its baseline median by more than ``threshold``."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["median"] / baseline[name]["median"]
+        marker = "REGRESSION" if ratio > 1 + threshold else "ok"
+        print(f"{name:<45} {baseline[name]['median'] * 1000:10.3f}ms -> {result['median'] * 1000:10.3f}ms  x{ratio:5.2f}  {marker}")
+        if marker != "ok":
+            regressions.append(f"{name}: x{ratio:.2f}")
+    return regressions
+
+
+class Context:
+    """Shared state for the benchmarks: a user, an API client and the image server URL."""
+
+    def __init__(self, image_server_url: str, scale: int):
+        from django.contrib.auth import get_user_model
+        from rest_framework.test import APIClient
+
+        self.image_server_url = image_server_url
+        self.scale = scale
+        self.user = get_user_model().objects.create(username="benchmark")
+        self.client = APIClient(HTTP_X_API_KEY=str(self.user.chatsnipprofile.api_key))
+        self.counter = 0
+
+    def next_identifier(self) -> str:
+        self.counter += 1
+        return f"benchmark-{self.counter}"
+
+    def create_chat(self, fragments: int):
+        from chatsnipserver.models import Chat, CodeFragment
+        from synthetic import code_block
+
+        chat = Chat.objects.create(unique_identifier=self.next_identifier(), name="Benchmark", json_data=[], user=self.user)
+        for index in range(fragments):
+            language, filename, source = code_block(index)
+            CodeFragment.objects.create(chat=chat, filename=filename, programming_language=language, source_code=source)
+        return chat
+
+
+@benchmark("ingest.create")
+def ingest_create(context: Context):
+    from synthetic import make_chat
+
+    payload = make_chat(turns=10 * context.scale, code_blocks=10 * context.scale, images=2 * context.scale, image_base_url=context.image_server_url)
+
+    def run():
+        response = context.client.post("/api/chats/", {"chatId": context.next_identifier(), "chatName": "Benchmark", **payload}, format="json")
+        assert response.status_code == 200, response.content
+
+    return run
+
+
+@benchmark("services.parse_source_code_fragments")
+def parse_fragments(context: Context):
+    from chatsnipserver.services import parse_source_code_fragments
+    from synthetic import make_chat
+
+    markdown = make_chat(turns=10 * context.scale, code_blocks=20 * context.scale, images=0)["markdown"]
+    return lambda: parse_source_code_fragments(markdown)
+
+
+def duplicate_check(history: int):
+    def setup(context: Context):
+        from chatsnipserver.services import check_duplicate_code_fragment
+
+        chat = context.create_chat(history * context.scale)
+        return lambda: check_duplicate_code_fragment(chat, "print('not a duplicate')", "app/repository_0.py")
+
+    return setup
+
+
+for history in (10, 100, 1000):
+    benchmark(f"services.check_duplicate_code_fragment[{history}]")(duplicate_check(history))
+
+
+@benchmark("services.generate_checksum")
+def checksum_1mb(context: Context):
+    from chatsnipserver.services import generate_checksum
+    from synthetic import code_block
+
+    source = "\n".join(code_block(index)[2] for index in range(2000))
+    size = 1_000_000 * context.scale
+    source = (source * (size // len(source) + 1))[:size]
+    return lambda: generate_checksum(source)
+
+
+@benchmark("services.generate_json_checksum")
+def json_checksum_1mb(context: Context):
+    from chatsnipserver.services import generate_json_checksum
+    from synthetic import make_chat
+
+    content = make_chat(turns=200, code_blocks=200, images=0)["content"]
+    while len(json.dumps(content)) < 1_000_000 * context.scale:
+        content = content + content
+    return lambda: generate_json_checksum(content)
+
+
+@benchmark("services.compose_chat_view")
+def compose_chat(context: Context):
+    from chatsnipserver.services import compose_chat_view
+
+    chat = context.create_chat(200 * context.scale)
+    return lambda: compose_chat_view(chat)
+
+
+@benchmark("autotag.autotag_chats")
+def autotag_batch(context: Context):
+    from chatsnipserver.autotag import autotag_chats
+    from chatsnipserver.models import Chat
+    from synthetic import make_chat
+
+    payload = make_chat(turns=6, code_blocks=6, images=0)
+    chats = [context.create_chat(6) for _ in range(50 * context.scale)]
+    for chat in chats:
+        chat.json_data = payload["content"]
+    Chat.objects.bulk_update(chats, ["json_data"])
+    return lambda: autotag_chats(chats)
+
+
+@benchmark("templatetags.markdown")
+def markdown_filter(context: Context):
+    from chatsnipserver.templatetags.markdown_extras import markdown_format
+    from synthetic import make_chat
+
+    markdown = make_chat(turns=20 * context.scale, code_blocks=20 * context.scale, images=5)["markdown"]
+    return lambda: markdown_format(markdown)
+
+
+@benchmark("templatetags.highlight")
+def highlight_filter(context: Context):
+    from chatsnipserver.templatetags.markdown_extras import highlight_code
+    from synthetic import code_block
+
+    source = "\n".join(code_block(0)[2] for _ in range(20 * context.scale))
+    return lambda: highlight_code(source, "python")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-k", dest="filter", default="", help="only run benchmarks whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5, help="timed iterations per benchmark")
+    parser.add_argument("--scale", type=int, default=1, help="multiplier for the synthetic data sizes")
+    parser.add_argument("--save", type=Path, help="write the results as JSON to this file")
+    parser.add_argument("--compare", type=Path, help="compare the results with this JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before a regression is flagged")
+    args = parser.parse_args(argv)
+
+    media_root = tempfile.TemporaryDirectory()
+    settings.MEDIA_ROOT = media_root.name
+    settings.CHATSNIP_RATE_LIMIT = "1000000/s"
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    from synthetic import ImageServer
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+    results = {}
+    with ImageServer() as image_server:
+        context = Context(image_server.url, args.scale)
+        for name, setup in BENCHMARKS.items():
+            if args.filter not in name:
+                continue
+            results[name] = measure(setup(context), args.repeat)
+            print(f"{name:<45} median {results[name]['median'] * 1000:10.3f}ms  min {results[name]['min'] * 1000:10.3f}ms")
+
+    media_root.cleanup()
+
+    if args.save:
+        document = {"python": platform.python_version(), "machine": platform.machine(), "scale": args.scale, "results": results}
+        args.save.write_text(json.dumps(document, indent=2))
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if baseline.get("scale") != args.scale:
+            print(f"Baseline was recorded with --scale {baseline.get('scale')}, not {args.scale}.")
+            return 2
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
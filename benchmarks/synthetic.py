@@ -0,0 +1,121 @@
+"""Synthetic chat payloads and a local image server for the benchmarks."""
+
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from PIL import Image
+
+PYTHON_BLOCK = '''class Repository{index}:
+    """Store and look up records by key."""
+
+    def __init__(self):
+        self.records = {{}}
+
+    def add(self, key, value):
+        self.records[key] = value
+        return value
+
+    def find(self, key, default=None):
+        return self.records.get(key, default)
+'''
+
+JAVASCRIPT_BLOCK = """function render{index}(items) {{
+    const list = document.createElement('ul');
+    for (const item of items) {{
+        const entry = document.createElement('li');
+        entry.textContent = item.name;
+        list.appendChild(entry);
+    }}
+    return list;
+}}
+"""
+
+
+def code_block(index: int) -> tuple[str, str, str]:
+    """Return the language, filename and source code of the ``index``-th synthetic block."""
+    if index % 2:
+        return "javascript", f"static/render_{index % 7}.js", JAVASCRIPT_BLOCK.format(index=index)
+    return "python", f"app/repository_{index % 5}.py", PYTHON_BLOCK.format(index=index)
+
+
+def make_chat(turns: int, code_blocks: int, images: int, image_base_url: str = "http://127.0.0.1") -> dict:
+    """Build a chat payload as posted by the ChatSnip extension.
+
+    Args:
+        turns (int): The number of user/assistant message pairs.
+        code_blocks (int): The number of code blocks spread over the assistant messages.
+        images (int): The number of images, served from ``image_base_url``.
+        image_base_url (str): The base URL of the image server.
+
+    Returns:
+        dict: The ``content`` and ``markdown`` of the chat.
+    """
+    content = []
+    markdown = []
+    for turn in range(turns):
+        question = f"How do I implement part {turn} of the storage layer? " * 3
+        answer = f"Part {turn} stores records in a dictionary keyed by their identifier. " * 5
+        content += [{"content": question}, {"content": answer}]
+        markdown += [f"**user:** {question}", f"**assistant:** {answer}"]
+        for index in range(turn * code_blocks // turns, (turn + 1) * code_blocks // turns):
+            language, filename, source = code_block(index)
+            content.append({"language": language, "filename": filename, "content": source})
+            markdown.append(f"```{language}\n# filename: {filename}\n{source}```")
+        for index in range(turn * images // turns, (turn + 1) * images // turns):
+            src = f"{image_base_url}/image_{index}.png"
+            content.append({"src": src, "content": f"Diagram {index}"})
+            markdown.append(f"![Diagram {index}]({src})")
+    return {"content": content, "markdown": "\n\n".join(markdown)}
+
+
+@lru_cache(maxsize=None)
+def png_image(index: int, size: int = 256) -> bytes:
+    """Return a distinct PNG image for ``index``."""
+    image = Image.new("RGB", (size, size), ((index * 37) % 256, (index * 91) % 256, (index * 53) % 256))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        name = self.path.rsplit("/", 1)[-1]
+        body = png_image(int(name.removeprefix("image_").removesuffix(".png")))
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ImageServer:
+    """Serve synthetic PNG images from a background thread on a free local port.
+
+    ``delay`` seconds are spent before answering each request, to simulate slow image hosts.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _ImageHandler)
+        self.server.daemon_threads = True
+        self.server.delay = delay
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
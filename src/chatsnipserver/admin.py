@@ -1,22 +1,112 @@
+from django.conf import settings
 from django.contrib import admin
-from django.utils.html import mark_safe
+from django.core.paginator import Paginator
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.utils.functional import cached_property
+from django.utils.html import format_html, mark_safe
 from .forms import ChatForm
 
-from .models import Chat, ChatImage, ChatSnipProfile, CodeFragment
+from .database import estimated_row_count
+from .images import get_thumbnail_width, get_variant_formats
+from .models import Chat, ChatImage, ChatImageVariant, ChatSnipProfile, CodeFragment, QuarantinedImage, UserDailyStat
 
+# Unfiltered lists of tables with more rows than this show the estimate of the database instead of counting the rows.
+DEFAULT_ADMIN_ESTIMATED_COUNT_MIN = 10_000
+
+
+class EstimatedCountPaginator(Paginator):
+    """A paginator that takes the number of rows of an unfiltered list from the statistics of the database.
+
+    ``COUNT(*)`` reads the whole table, which takes seconds on tables with millions of
+    rows. Filtered lists and small tables are still counted.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= getattr(settings, "CHATSNIP_ADMIN_ESTIMATED_COUNT_MIN", DEFAULT_ADMIN_ESTIMATED_COUNT_MIN):
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Admin options for tables with millions of rows.
+
+    The list is paginated with estimated counts, and ``search_fields`` are lookups
+    that the whole search term is matched with, each of which should be answered by an
+    index, instead of ``icontains`` on every word. ``list_defer`` names the large
+    columns that the list doesn't show.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_defer = ()
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return queryset.defer(*self.list_defer) if self.list_defer else queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        search_fields = self.get_search_fields(request)
+        if not search_term or not search_fields:
+            return queryset, False
+        condition = Q()
+        for lookup in search_fields:
+            condition |= Q(**{lookup: search_term})
+        return queryset.filter(condition), False
+
+
+class RollupListFilter(admin.SimpleListFilter):
+    """Filter by the values of a field as counted in the daily statistics, instead of selecting the distinct values of the table."""
+
+    metric = None
+
+    def lookups(self, request, model_admin):
+        keys = (
+            UserDailyStat.objects.filter(metric=self.metric).exclude(key="").values_list("key").annotate(Sum("count")).filter(count__sum__gt=0).order_by("key")
+        )
+        return [(key, key) for key, _ in keys]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.parameter_name: self.value()})
+        return queryset
+
+
+class ChatbotFilter(RollupListFilter):
+    title = "chatbot"
+    parameter_name = "chatbot"
+    metric = UserDailyStat.CHATBOT
+
+
+class LLMModelFilter(RollupListFilter):
+    title = "LLM model"
+    parameter_name = "llm_model"
+    metric = UserDailyStat.LLM_MODEL
+
+
+class LanguageFilter(RollupListFilter):
+    title = "programming language"
+    parameter_name = "programming_language"
+    metric = UserDailyStat.LANGUAGE
 
 
 @admin.register(Chat)
-class ChatAdmin(admin.ModelAdmin):
+class ChatAdmin(LargeTableAdmin):
     form = ChatForm
-    list_display = ("name", "unique_identifier", "user", "timestamp", "checksum")
-    search_fields = ("name", "unique_identifier", "user__username", "content")
-    list_filter = ("timestamp", "tags", "user")
+    list_display = ("name", "unique_identifier", "user", "chatbot", "llm_model", "timestamp", "checksum")
+    list_select_related = ("user",)
+    list_defer = ("json_data", "markdown")
+    search_fields = ("unique_identifier", "name__startswith", "user__username")
+    list_filter = ("timestamp", ChatbotFilter, LLMModelFilter)
     readonly_fields = ("checksum", "timestamp")
 
 
 @admin.register(CodeFragment)
-class CodeFragmentAdmin(admin.ModelAdmin):
+class CodeFragmentAdmin(LargeTableAdmin):
     list_display = (
         "filename",
         "programming_language",
@@ -25,15 +115,20 @@ class CodeFragmentAdmin(admin.ModelAdmin):
         "checksum",
         "selected",
     )
-    search_fields = ("filename", "programming_language", "chat__name", "source_code")
-    list_filter = ("timestamp", "programming_language", "chat", "selected")
+    list_select_related = ("chat",)
+    list_defer = ("source_code", "chat__json_data", "chat__markdown")
+    search_fields = ("filename__startswith", "checksum", "chat__unique_identifier")
+    list_filter = ("timestamp", LanguageFilter, "selected")
     readonly_fields = ("checksum", "timestamp")
+    autocomplete_fields = ("chat",)
 
 
 @admin.register(ChatSnipProfile)
 class ChatSnipProfileAdmin(admin.ModelAdmin):
     list_display = ("user", "api_key")
+    list_select_related = ("user",)
     search_fields = ("user__username", "api_key")
+    autocomplete_fields = ("user",)
 
 
 def blacklist_images(modeladmin, request, queryset):
@@ -44,14 +139,46 @@ blacklist_images.short_description = "Blacklists selected images"
 
 
 @admin.register(ChatImage)
-class ChatImageAdmin(admin.ModelAdmin):
-    list_display = ("title", "image_tag", "checksum", "blacklisted")
+class ChatImageAdmin(LargeTableAdmin):
+    list_display = ("title", "image_tag", "width", "height", "checksum", "blacklisted")
     list_filter = ("blacklisted",)
+    list_defer = ("description",)
+    search_fields = ("checksum", "chat__unique_identifier")
+    autocomplete_fields = ("chat",)
     actions = [blacklist_images]
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        formats = get_variant_formats()
+        if not formats:
+            return queryset
+        thumbnails = ChatImageVariant.objects.filter(checksum=OuterRef("checksum"), width=get_thumbnail_width(), format=formats[0])
+        return queryset.annotate(thumbnail=Subquery(thumbnails.values("image")[:1]))
+
     def image_tag(self, obj):
+        if getattr(obj, "thumbnail", None):
+            url = ChatImageVariant._meta.get_field("image").storage.url(obj.thumbnail)
+            return mark_safe(f'<img src="{url}" width="150" loading="lazy" />')
+        # Without a thumbnail, link to the original instead of loading it in a list of many images.
         if obj.image:
-            return mark_safe(f'<img src="{obj.image.url}" width="150" height="150" />')
+            return format_html('<a href="{}" target="_blank">View</a>', obj.image.url)
         return "No Image"
 
     image_tag.short_description = "Image"
+
+
+@admin.register(ChatImageVariant)
+class ChatImageVariantAdmin(LargeTableAdmin):
+    list_display = ("checksum", "width", "height", "format")
+    search_fields = ("checksum",)
+
+
+@admin.register(QuarantinedImage)
+class QuarantinedImageAdmin(LargeTableAdmin):
+    list_display = ("source_url", "reason", "content_type", "chat", "timestamp")
+    list_select_related = ("chat",)
+    list_defer = ("chat__json_data", "chat__markdown")
+    search_fields = ("chat__unique_identifier",)
+    list_filter = ("timestamp",)
+    readonly_fields = ("checksum", "timestamp")
+    autocomplete_fields = ("chat",)
@@ -0,0 +1,191 @@
+import hashlib
+import posixpath
+import zipfile
+from typing import AsyncIterator, Iterator
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, QuerySet, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import CodeFragment
+
+DEFAULT_ZIP_CACHE_MAX_BYTES = 5 * 1024 * 1024
+ZIP_CACHE_TIMEOUT = 60 * 60
+ITERATOR_CHUNK_SIZE = 200
+
+
+class _ZipBuffer:
+    """A write-only stream collecting the output of ``zipfile`` until it is drained.
+
+    Without ``seek`` and ``tell``, ``zipfile`` writes the sizes and checksums after
+    every file instead of going back to its header, so nothing has to stay in memory.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def stream_zip(files) -> Iterator[bytes]:
+    """
+    Write a zip file while iterating, one file at a time.
+
+    Args:
+        files (Iterable[tuple[str, datetime, str]]): The path, modification time and text of every file.
+
+    Yields:
+        bytes: The next part of the zip file.
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for path, modified, text in files:
+            if timezone.is_aware(modified):
+                modified = timezone.localtime(modified)
+            info = zipfile.ZipInfo(path, date_time=max(modified.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            with archive.open(info, mode="w") as entry:
+                entry.write(text.encode("utf-8"))
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def selected_fragments_of_chats(chats: QuerySet) -> QuerySet:
+    """
+    Select one code fragment per chat and filename, like ``selected_code_fragments`` does for one chat.
+
+    Args:
+        chats (QuerySet): The chats.
+
+    Returns:
+        QuerySet: The selected code fragments, by chat and filename.
+    """
+    return (
+        CodeFragment.objects.filter(chat__in=chats)
+        .annotate(
+            version_rank=Window(
+                RowNumber(),
+                partition_by=[F("chat_id"), F("filename")],
+                order_by=[F("selected").desc(), F("timestamp").desc(), F("id").desc()],
+            )
+        )
+        .filter(version_rank=1)
+        .order_by("chat_id", "filename")
+    )
+
+
+def archive_path(filename: str | None, fragment_id: int) -> str:
+    """Turn the filename of a code fragment into a relative path that stays inside the archive."""
+    parts = [part for part in (filename or "").replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return posixpath.join(*parts) if parts else f"untitled_{fragment_id}"
+
+
+class SourceArchive:
+    """A zip of the selected version of every file of one or more chats.
+
+    The archive is identified by a digest of the chats' timestamps and the ids and
+    checksums of the selected fragments, which is computed without loading any source
+    code. The digest serves as ETag, and archives up to ``CHATSNIP_ZIP_CACHE_MAX_BYTES``
+    (default 5 MB) are cached under it, so repeated downloads don't rebuild the zip.
+    With ``folders``, the files of each chat are stored in a folder named after the chat.
+    """
+
+    def __init__(self, chats: QuerySet, folders: bool = False):
+        self.chats = chats
+        self.folders = folders
+        self._paths = None
+        self._digest = None
+
+    def _load(self):
+        hasher = hashlib.sha256()
+        paths, used = {}, set()
+        for fragment_id, chat_id, chat_name, timestamp, filename, checksum in selected_fragments_of_chats(self.chats).values_list(
+            "id", "chat_id", "chat__name", "chat__timestamp", "filename", "checksum"
+        ):
+            path = archive_path(filename, fragment_id)
+            if self.folders:
+                path = f"{slugify(chat_name) or 'chat'}-{chat_id}/{path}"
+            if path in used:
+                stem, extension = posixpath.splitext(path)
+                path = f"{stem}_{fragment_id}{extension}"
+            used.add(path)
+            paths[fragment_id] = path
+            hasher.update(f"{fragment_id}:{checksum}:{timestamp.isoformat()}:{path}\n".encode())
+        self._paths, self._digest = paths, hasher.hexdigest()
+
+    @property
+    def paths(self) -> dict[int, str]:
+        """The path in the archive of every selected code fragment, by fragment id."""
+        if self._paths is None:
+            self._load()
+        return self._paths
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            self._load()
+        return self._digest
+
+    @property
+    def cache_key(self) -> str:
+        return f"chatsnip:source-zip:{self.digest}"
+
+    def cached(self) -> bytes | None:
+        """Get the archive from the cache, if it was built before."""
+        return cache.get(self.cache_key)
+
+    def stream(self) -> Iterator[bytes]:
+        """
+        Build the archive while streaming it, reading the source code in chunks from the database.
+
+        Yields:
+            bytes: The next part of the zip file.
+        """
+        paths = self.paths
+        fragments = selected_fragments_of_chats(self.chats).values_list("id", "timestamp", "source_code").iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+        limit = getattr(settings, "CHATSNIP_ZIP_CACHE_MAX_BYTES", DEFAULT_ZIP_CACHE_MAX_BYTES)
+        kept, size = [], 0
+        files = ((paths[fragment_id], timestamp, source_code) for fragment_id, timestamp, source_code in fragments if fragment_id in paths)
+        for chunk in stream_zip(files):
+            size += len(chunk)
+            if size <= limit:
+                kept.append(chunk)
+            yield chunk
+        if size <= limit:
+            cache.set(self.cache_key, b"".join(kept), ZIP_CACHE_TIMEOUT)
+
+    async def astream(self) -> AsyncIterator[bytes]:
+        """
+        Stream the archive to an ASGI server, building every part with ``stream`` in the thread of the database connection.
+
+        ``StreamingHttpResponse`` would otherwise collect all of a synchronous iterator
+        in memory before sending it from an async handler.
+
+        Yields:
+            bytes: The next part of the zip file.
+        """
+        chunks = self.stream()
+        try:
+            while (chunk := await sync_to_async(next)(chunks, None)) is not None:
+                yield chunk
+        finally:
+            await sync_to_async(chunks.close)()
+
+
+def archive_filename(name: str) -> str:
+    """Get the name of a downloaded archive."""
+    return f"{slugify(name) or 'sources'}.zip"
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import authentication, exceptions
+
+from .models import ChatSnipProfile
+
+API_KEY_HEADER = "HTTP_X_API_KEY"
+API_KEY_KEYWORD = "Api-Key"
+
+
+class ApiKeyOwner(NamedTuple):
+    """The profile and user an API key belongs to, as plain values that requests can share."""
+
+    profile_id: int
+    user_id: int
+    username: str
+    is_active: bool
+
+
+class ApiKeyCache:
+    """Thread-safe LRU cache mapping hashed API keys to their owners, with a TTL.
+
+    The cache is local to the process. Entries are dropped when they expire or when
+    the profile or user is saved or deleted; other processes keep a stale entry for
+    at most ``ttl`` seconds.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key_hash: str) -> ApiKeyOwner | None:
+        with self._lock:
+            entry = self._entries.get(key_hash)
+            if entry is None:
+                return None
+            expires, owner = entry
+            if expires < time.monotonic():
+                del self._entries[key_hash]
+                return None
+            self._entries.move_to_end(key_hash)
+            return owner
+
+    def set(self, key_hash: str, owner: ApiKeyOwner) -> None:
+        with self._lock:
+            self._entries[key_hash] = (time.monotonic() + self.ttl, owner)
+            self._entries.move_to_end(key_hash)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key_hash: str) -> None:
+        with self._lock:
+            self._entries.pop(key_hash, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for key_hash in [key_hash for key_hash, (_, owner) in self._entries.items() if owner.user_id == user_id]:
+                del self._entries[key_hash]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+api_key_cache = ApiKeyCache(
+    maxsize=getattr(settings, "CHATSNIP_API_KEY_CACHE_SIZE", 1024),
+    ttl=getattr(settings, "CHATSNIP_API_KEY_CACHE_TTL", 300),
+)
+
+
+def get_api_key(request, body: bool = True) -> str | None:
+    """Extract the API key from the request.
+
+    The key is read from the ``X-Api-Key`` header, an ``Authorization: Api-Key <key>``
+    header or, for older extension versions, the ``apiKey`` field of the request body.
+
+    Args:
+        request (Request): The incoming DRF request.
+        body (bool, optional): Whether to look in the request body. Defaults to True.
+
+    Returns:
+        str | None: The API key, or None if the request does not carry one.
+    """
+    if api_key := request.META.get(API_KEY_HEADER):
+        return api_key
+    auth = authentication.get_authorization_header(request).split()
+    if len(auth) == 2 and auth[0].lower() == API_KEY_KEYWORD.lower().encode():
+        return auth[1].decode("latin-1")
+    if not body:
+        return None
+    return request.data.get("apiKey") or None
+
+
+def _from_values(model, values: dict):
+    """Build a model instance as if it was loaded from the database, with the fields not in ``values`` deferred."""
+    field_names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db(DEFAULT_DB_ALIAS, field_names, [values[name] for name in field_names])
+
+
+def get_profile_for_api_key(api_key: str) -> ChatSnipProfile | None:
+    """Look up the profile owning the API key, using the local cache first.
+
+    The cache only holds the ids, username and active flag, so every call gets
+    its own profile and user instances. Other fields are loaded when they are used.
+
+    Args:
+        api_key (str): The API key sent by the client.
+
+    Returns:
+        ChatSnipProfile | None: The profile with its user, or None if the key is unknown.
+    """
+    User = get_user_model()
+    key_hash = ChatSnipProfile.hash_api_key(api_key)
+    owner = api_key_cache.get(key_hash)
+    if owner is None:
+        row = ChatSnipProfile.objects.filter(api_key_hash=key_hash).values_list("pk", "user_id", f"user__{User.USERNAME_FIELD}", "user__is_active").first()
+        if row is None:
+            return None
+        owner = ApiKeyOwner(*row)
+        api_key_cache.set(key_hash, owner)
+    user = _from_values(User, {User._meta.pk.attname: owner.user_id, User.USERNAME_FIELD: owner.username, "is_active": owner.is_active})
+    profile = _from_values(ChatSnipProfile, {"id": owner.profile_id, "user_id": owner.user_id, "api_key_hash": key_hash})
+    profile.user = user
+    return profile
+
+
+class ApiKeyAuthentication(authentication.BaseAuthentication):
+    """Authenticate ChatSnip extension requests by the user's API key."""
+
+    # Whether the key may be sent in the request body.
+    body_api_key = True
+
+    def authenticate(self, request):
+        api_key = get_api_key(request, self.body_api_key)
+        if not api_key:
+            return None
+        profile = get_profile_for_api_key(api_key)
+        if profile is None or not profile.user.is_active:
+            raise exceptions.AuthenticationFailed("Invalid API key.")
+        return profile.user, profile
+
+
+class ApiKeyHeaderAuthentication(ApiKeyAuthentication):
+    """Authenticate by an API key sent in the headers only, leaving the request body unread."""
+
+    body_api_key = False
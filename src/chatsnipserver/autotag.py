@@ -0,0 +1,333 @@
+import logging
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower, Substr
+from taggit.models import Tag
+
+from .models import Chat, CodeFragment, TaggedChat
+from .tags import adjust_tag_counts
+
+logger = logging.getLogger(__name__)
+
+# Stored with every chat that has been tagged. Increase it when the rules change, so
+# ``manage.py autotag_chats`` tags the existing chats again.
+AUTOTAG_VERSION = 1
+
+MAX_SOURCE_CHARS = 20_000
+MAX_TEXT_CHARS = 200_000
+DEFAULT_MAX_TAGS = 8
+DEFAULT_MIN_KEYWORD_MENTIONS = 2
+
+LANGUAGE_TAGS = {
+    "py": "python",
+    "python": "python",
+    "python3": "python",
+    "js": "javascript",
+    "jsx": "javascript",
+    "javascript": "javascript",
+    "ts": "typescript",
+    "tsx": "typescript",
+    "typescript": "typescript",
+    "c": "c",
+    "c++": "cpp",
+    "cpp": "cpp",
+    "c#": "csharp",
+    "cs": "csharp",
+    "csharp": "csharp",
+    "go": "go",
+    "golang": "go",
+    "rs": "rust",
+    "rust": "rust",
+    "java": "java",
+    "kotlin": "kotlin",
+    "swift": "swift",
+    "rb": "ruby",
+    "ruby": "ruby",
+    "php": "php",
+    "sh": "shell",
+    "bash": "shell",
+    "shell": "shell",
+    "zsh": "shell",
+    "powershell": "powershell",
+    "sql": "sql",
+    "html": "html",
+    "css": "css",
+    "scss": "css",
+    "yaml": "yaml",
+    "yml": "yaml",
+    "dockerfile": "docker",
+    "r": "r",
+    "lua": "lua",
+    "dart": "dart",
+    "scala": "scala",
+    "haskell": "haskell",
+    "elixir": "elixir",
+}
+
+# Matched against the filename of every code fragment.
+FILENAME_RULES = [
+    (re.compile(rule, re.IGNORECASE), tags)
+    for rule, tags in (
+        (r"(^|/)(manage|wsgi|asgi)\.py$", ("django",)),
+        (r"(^|/)(requirements[\w.-]*\.txt|pyproject\.toml|setup\.py)$", ("python",)),
+        (r"(^|/)package\.json$", ("node",)),
+        (r"(^|/)tsconfig\.json$", ("typescript",)),
+        (r"(^|/)(Dockerfile|docker-compose\.ya?ml|compose\.ya?ml)$", ("docker",)),
+        (r"(^|/)Cargo\.toml$", ("rust",)),
+        (r"(^|/)go\.mod$", ("go",)),
+        (r"(^|/)(pom\.xml|build\.gradle(\.kts)?)$", ("java",)),
+        (r"(^|/)\.github/workflows/", ("github-actions",)),
+        (r"\.(tsx|jsx)$", ("react",)),
+        (r"\.vue$", ("vue",)),
+        (r"\.svelte$", ("svelte",)),
+        (r"\.tf$", ("terraform",)),
+        (r"\.ipynb$", ("jupyter",)),
+    )
+]
+
+# Matched at the start of every line of the source code of the code fragments, in a single pass.
+CONTENT_RULES = {
+    "django": r"(?:from|import)\s+django\b",
+    "flask": r"(?:from|import)\s+flask\b",
+    "fastapi": r"(?:from|import)\s+fastapi\b",
+    "sqlalchemy": r"(?:from|import)\s+sqlalchemy\b",
+    "pydantic": r"(?:from|import)\s+pydantic\b",
+    "pandas": r"(?:from|import)\s+pandas\b",
+    "numpy": r"(?:from|import)\s+numpy\b",
+    "pytorch": r"(?:from|import)\s+torch\b",
+    "tensorflow": r"(?:from|import)\s+tensorflow\b",
+    "scikit-learn": r"(?:from|import)\s+sklearn\b",
+    "pytest": r"import\s+pytest\b|@pytest\.",
+    "asyncio": r"import\s+asyncio\b|async\s+def\s",
+    "pillow": r"from\s+PIL\b",
+    "react": r"""import\b.*\bfrom\s+['"]react['"]|(?:const|let|var)\b.*\brequire\(\s*['"]react['"]\s*\)""",
+    "vue": r"""import\b.*\bfrom\s+['"]vue['"]""",
+    "express": r"""import\b.*\bfrom\s+['"]express['"]|(?:const|let|var)\b.*\brequire\(\s*['"]express['"]\s*\)""",
+    "sql": r"(?i:SELECT\s.+\sFROM\s|CREATE\s+TABLE\s|INSERT\s+INTO\s)",
+}
+# One anchor for every rule, so the alternatives are only tried at the start of a line.
+_CONTENT_PATTERN = re.compile(
+    r"^[ \t]*(?:" + "|".join(f"(?P<rule{index}>{rule})" for index, rule in enumerate(CONTENT_RULES.values())) + ")",
+    re.MULTILINE,
+)
+_CONTENT_TAGS = {f"rule{index}": tag for index, tag in enumerate(CONTENT_RULES)}
+
+# Matched against the lower case text of the chat.
+KEYWORD_TAGS = {
+    "django": "django",
+    "flask": "flask",
+    "fastapi": "fastapi",
+    "react": "react",
+    "next.js": "nextjs",
+    "nextjs": "nextjs",
+    "vue": "vue",
+    "svelte": "svelte",
+    "angular": "angular",
+    "node.js": "node",
+    "nodejs": "node",
+    "docker": "docker",
+    "kubernetes": "kubernetes",
+    "k8s": "kubernetes",
+    "terraform": "terraform",
+    "postgres": "postgresql",
+    "postgresql": "postgresql",
+    "mysql": "mysql",
+    "sqlite": "sqlite",
+    "redis": "redis",
+    "celery": "celery",
+    "graphql": "graphql",
+    "pandas": "pandas",
+    "numpy": "numpy",
+    "pytorch": "pytorch",
+    "tensorflow": "tensorflow",
+    "tailwind": "tailwind",
+    "nginx": "nginx",
+    "aws": "aws",
+    "regex": "regex",
+}
+_KEYWORD_PATTERN = re.compile(r"(?<![\w.])(" + "|".join(re.escape(keyword) for keyword in sorted(KEYWORD_TAGS, key=len, reverse=True)) + r")(?![\w])")
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chatsnip-autotag")
+
+
+def derive_tags(text: str, fragments) -> list[str]:
+    """
+    Derive the tags of a chat from its code fragments and its text.
+
+    Every match adds to the score of a tag: the fragment languages weigh most, then
+    frameworks recognized from the filenames and the source code. Keywords in the
+    text only count when they are mentioned at least ``CHATSNIP_AUTOTAG_MIN_MENTIONS`` times.
+
+    Args:
+        text (str): The text of the chat. Only the first ``MAX_TEXT_CHARS`` characters are read.
+        fragments (Iterable[tuple[str, str, str]]): The filename, language and source code of every code fragment.
+
+    Returns:
+        list[str]: At most ``CHATSNIP_AUTOTAG_MAX_TAGS`` tag names, most relevant first.
+    """
+    found = Counter()
+    for filename, language, source in fragments:
+        if tag := LANGUAGE_TAGS.get((language or "").strip().lower()):
+            found[tag] += 3
+        for rule, tags in FILENAME_RULES:
+            if filename and rule.search(filename):
+                found.update(dict.fromkeys(tags, 2))
+        for match in _CONTENT_PATTERN.finditer(source[:MAX_SOURCE_CHARS]):
+            found[_CONTENT_TAGS[match.lastgroup]] += 2
+
+    min_mentions = getattr(settings, "CHATSNIP_AUTOTAG_MIN_MENTIONS", DEFAULT_MIN_KEYWORD_MENTIONS)
+    mentions = Counter(KEYWORD_TAGS[match.group(1)] for match in _KEYWORD_PATTERN.finditer(text[:MAX_TEXT_CHARS].lower()))
+    for tag, count in mentions.items():
+        if count >= min_mentions:
+            found[tag] += count
+
+    max_tags = getattr(settings, "CHATSNIP_AUTOTAG_MAX_TAGS", DEFAULT_MAX_TAGS)
+    return [tag for tag, _ in sorted(found.items(), key=lambda item: (-item[1], item[0]))[:max_tags]]
+
+
+def chat_text(chat: Chat) -> str:
+    """Get the text of the messages of a chat, without its code blocks and images."""
+    if isinstance(chat.json_data, list):
+        return "\n".join(
+            element["content"]
+            for element in chat.json_data
+            if isinstance(element, dict) and isinstance(element.get("content"), str) and "language" not in element and "src" not in element
+        )
+    return chat.markdown or ""
+
+
+def get_tags(names) -> dict[str, Tag]:
+    """
+    Get the tags with the names, creating the missing ones.
+
+    Existing tags are matched case-insensitively by name, or by slug, so the
+    derived names reuse the tags the users already created.
+
+    Args:
+        names (Iterable[str]): The lower case tag names, which are also their slugs.
+
+    Returns:
+        dict[str, Tag]: The tag of every name.
+    """
+    names = set(names)
+    if not names:
+        return {}
+
+    def lookup():
+        tags = {}
+        for tag in Tag.objects.annotate(lower_name=Lower("name")).filter(Q(lower_name__in=names) | Q(slug__in=names)):
+            tags.setdefault(tag.lower_name if tag.lower_name in names else tag.slug, tag)
+        return tags
+
+    tags = lookup()
+    if missing := names - tags.keys():
+        Tag.objects.bulk_create([Tag(name=name, slug=name) for name in missing], ignore_conflicts=True)
+        tags = lookup()
+    return tags
+
+
+@transaction.atomic
+def apply_tags(tags_by_chat: dict[Chat, list[str]]) -> int:
+    """
+    Add derived tags to chats, with a fixed number of queries for the whole batch.
+
+    The tags the chats already have are kept. Only names that were never derived for a
+    chat are added, so a derived tag the user removed stays removed when the chat is
+    tagged again after a new ingest or a new ``AUTOTAG_VERSION``. The chats are locked
+    while they are tagged, so concurrent runs don't count the same tags twice. The tag
+    counts of the owners are updated, but the chat timestamps are not, so tagging
+    doesn't reorder the chat list.
+
+    Args:
+        tags_by_chat (dict[Chat, list[str]]): The tag names of every chat.
+
+    Returns:
+        int: The number of tags added.
+    """
+    chats = list(tags_by_chat)
+    derived = dict(Chat.objects.select_for_update().filter(pk__in=[chat.pk for chat in chats]).order_by("pk").values_list("pk", "autotag_tags"))
+    tags = get_tags(name for names in tags_by_chat.values() for name in names)
+    existing = set(TaggedChat.objects.filter(content_object__in=chats).values_list("content_object_id", "tag_id"))
+
+    added = defaultdict(Counter)
+    tagged_chats, tagged = [], []
+    for chat, names in tags_by_chat.items():
+        if chat.pk not in derived:
+            # Deleted since it was loaded.
+            continue
+        previous = set(derived[chat.pk] or ())
+        for tag_id in {tags[name].pk for name in set(names) - previous if name in tags}:
+            if (chat.pk, tag_id) not in existing:
+                tagged_chats.append(TaggedChat(content_object=chat, tag_id=tag_id, user_id=chat.user_id))
+                added[chat.user_id][tag_id] += 1
+        chat.autotag_tags = sorted(previous | set(names))
+        chat.autotag_version = AUTOTAG_VERSION
+        tagged.append(chat)
+    TaggedChat.objects.bulk_create(tagged_chats, ignore_conflicts=True)
+
+    for user_id, counts in added.items():
+        by_delta = defaultdict(set)
+        for tag_id, delta in counts.items():
+            by_delta[delta].add(tag_id)
+        for delta, tag_ids in by_delta.items():
+            adjust_tag_counts(user_id, tag_ids, delta)
+
+    Chat.objects.bulk_update(tagged, ["autotag_tags", "autotag_version"])
+    return len(tagged_chats)
+
+
+def autotag_chats(chats) -> int:
+    """
+    Derive and add the tags of a batch of chats.
+
+    The source code of the fragments is read truncated to ``MAX_SOURCE_CHARS``, in one
+    query for the whole batch.
+
+    Args:
+        chats (Iterable[Chat]): The chats.
+
+    Returns:
+        int: The number of tags added.
+    """
+    chats = list(chats)
+    if not chats:
+        return 0
+    fragments = defaultdict(list)
+    for chat_id, *fragment in CodeFragment.objects.filter(chat__in=chats).values_list(
+        "chat_id", "filename", "programming_language", Substr("source_code", 1, MAX_SOURCE_CHARS)
+    ):
+        fragments[chat_id].append(fragment)
+    return apply_tags({chat: derive_tags(chat_text(chat), fragments[chat.pk]) for chat in chats})
+
+
+def _autotag_in_background(chat_id: int) -> None:
+    try:
+        autotag_chats(Chat.objects.filter(pk=chat_id))
+    except Exception:
+        logger.exception("Tagging chat %s failed.", chat_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_autotag(chat: Chat) -> None:
+    """
+    Tag a chat off the request path after it was ingested.
+
+    The work is queued once the current transaction commits. Set
+    ``CHATSNIP_AUTOTAG_INLINE = True`` to tag the chat immediately, or
+    ``CHATSNIP_AUTOTAG = False`` to only tag chats with ``manage.py autotag_chats``.
+
+    Args:
+        chat (Chat): The saved chat.
+    """
+    if not getattr(settings, "CHATSNIP_AUTOTAG", True):
+        return
+    if getattr(settings, "CHATSNIP_AUTOTAG_INLINE", False):
+        autotag_chats([chat])
+        return
+    transaction.on_commit(lambda: _executor.submit(_autotag_in_background, chat.pk))
@@ -0,0 +1,77 @@
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+
+from .models import Chat
+
+
+def chat_validators(chat_id: int, queryset=None) -> tuple[str, object] | None:
+    """
+    Get the ETag and last modified time of a chat with a single indexed lookup.
+
+    The ETag combines the checksum of the chat content with its timestamp, which is
+    also updated when code fragments of the chat change.
+
+    Args:
+        chat_id (int): The id of the chat.
+        queryset (QuerySet, optional): The chats to look in. Defaults to all chats.
+
+    Returns:
+        tuple[str, datetime] | None: The ETag and the last modified time, or None if there is no such chat.
+    """
+    queryset = Chat.objects.all() if queryset is None else queryset
+    values = queryset.filter(pk=chat_id).values_list("checksum", "timestamp").first()
+    if values is None:
+        return None
+    checksum, timestamp = values
+    return f"{checksum}.{int(timestamp.timestamp() * 1_000_000)}", timestamp
+
+
+def chat_list_validators(queryset, extra: str = "") -> tuple[str, object] | None:
+    """
+    Get the ETag and last modified time of a list of chats with a single aggregate query.
+
+    Args:
+        queryset (QuerySet): The chats in the list.
+        extra (str, optional): A version of other content on the page, added to the ETag.
+
+    Returns:
+        tuple[str, datetime] | None: The ETag and the last modified time, or None if the list is empty.
+    """
+    values = queryset.order_by().aggregate(count=Count("id"), latest=Max("timestamp"), max_id=Max("id"))
+    if not values["count"]:
+        return None
+    latest = values["latest"]
+    etag = f"{values['count']}.{values['max_id']}.{int(latest.timestamp() * 1_000_000)}"
+    return f"{etag}.{extra}" if extra else etag, latest
+
+
+def conditional_response(request, validators, render):
+    """
+    Answer a conditional GET from the validators, rendering the response only when needed.
+
+    Returns 304 Not Modified when the client's If-None-Match or If-Modified-Since
+    matches, without calling ``render``. Responses carry the ETag and Last-Modified
+    headers and must be revalidated by the client before reuse.
+
+    Args:
+        request (HttpRequest): The request.
+        validators (tuple[str, datetime] | None): The ETag and last modified time, or None to skip the check.
+        render (Callable[[], HttpResponse]): Builds the full response.
+
+    Returns:
+        HttpResponse: The 304 or full response.
+    """
+    if validators is None or request.method not in ("GET", "HEAD"):
+        return render()
+    etag, last_modified = validators
+    etag = quote_etag(etag)
+    last_modified = int(last_modified.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = render()
+    if response.status_code in (200, 304):
+        response.headers.setdefault("ETag", etag)
+        response.headers.setdefault("Last-Modified", http_date(last_modified))
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
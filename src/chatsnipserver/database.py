@@ -0,0 +1,109 @@
+import logging
+import re
+
+import django
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Tuning for SQLite in production, applied to every new connection when
+# ``CHATSNIP_SQLITE_PRAGMAS = SQLITE_PRAGMAS``:
+# - WAL lets readers continue while a writer commits, instead of blocking on the database lock.
+# - synchronous=NORMAL only syncs the WAL at checkpoints. A power loss can lose the last
+#   transactions, but never corrupts the database.
+# - busy_timeout makes a writer wait for the lock instead of failing with "database is locked".
+# - mmap_size and cache_size keep more of the database in memory between queries.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+}
+
+_PRAGMA_NAME = re.compile(r"^[a-z_]+$")
+_PRAGMA_VALUE = re.compile(r"^-?\w+$")
+
+
+def sqlite_database(name, conn_max_age: int = 0, **options) -> dict:
+    """
+    Build a ``DATABASES`` entry for SQLite in production.
+
+    Under WSGI, pass ``conn_max_age`` to keep connections open for that many seconds, so
+    the pragmas are only applied once per connection instead of once per request. Keep it
+    at 0 under ASGI, where every request runs in a new thread and persistent connections
+    are never reused but pile up, as Django's documentation warns. Transactions take the write lock
+    when they begin (``transaction_mode = "IMMEDIATE"``, Django 5.1 and later), so a
+    transaction that starts reading and then writes waits for ``busy_timeout`` instead of
+    failing when another connection is writing.
+
+    Args:
+        name: The path of the database file.
+        conn_max_age (int, optional): Seconds to keep a connection open. Defaults to 0, a connection per request.
+        **options: Additional ``OPTIONS`` for the connection.
+
+    Returns:
+        dict: The database settings.
+    """
+    if django.VERSION >= (5, 1):
+        options.setdefault("transaction_mode", "IMMEDIATE")
+    return {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": name,
+        "CONN_MAX_AGE": conn_max_age,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": options,
+    }
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply ``CHATSNIP_SQLITE_PRAGMAS`` to a new SQLite connection."""
+    pragmas = getattr(settings, "CHATSNIP_SQLITE_PRAGMAS", None)
+    if connection.vendor != "sqlite" or not pragmas:
+        return
+
+    # Executed on the DB-API connection, so the pragmas don't count against query budgets.
+    for name, value in pragmas.items():
+        if not _PRAGMA_NAME.match(name) or not _PRAGMA_VALUE.match(str(value)):
+            raise ValueError(f"Invalid SQLite pragma: {name} = {value!r}")
+        connection.connection.execute(f"PRAGMA {name} = {value}")
+    logger.debug("Configured SQLite connection %s with %s", connection.alias, pragmas)
+
+
+def estimated_row_count(model, using: str = "default") -> int | None:
+    """
+    Estimate the number of rows of a model's table from the statistics of the database, without counting them.
+
+    PostgreSQL and MySQL keep the estimate up to date on their own. SQLite only has
+    one after ``ANALYZE``.
+
+    Args:
+        model: The model.
+        using (str, optional): The database alias. Defaults to ``"default"``.
+
+    Returns:
+        int | None: The estimated number of rows, or None if the database has no estimate.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == "postgresql":
+        sql, params = "SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)", [connection.ops.quote_name(table)]
+    elif connection.vendor == "mysql":
+        sql, params = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s", [table]
+    elif connection.vendor == "sqlite":
+        # The first number of every index's statistics is the number of rows it covers.
+        sql, params = "SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = %s", [table]
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    except DatabaseError:
+        # SQLite has no sqlite_stat1 table before the first ANALYZE. Failed statements don't abort its transactions.
+        return None
+    # PostgreSQL reports -1 for tables that were never vacuumed or analyzed.
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
@@ -0,0 +1,195 @@
+from bisect import bisect_left
+from collections import Counter
+from difflib import SequenceMatcher
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.html import escape
+
+from .instrumentation import instrument
+from .models import CodeFragment
+
+DIFF_MODES = ("unified", "split")
+DIFF_CACHE_TIMEOUT = 60 * 60 * 24
+DIFF_CONTEXT_LINES = 3
+# Regions without unique lines are matched with difflib, whose time grows with the
+# product of their lengths. Larger regions are shown as replaced.
+SEQUENCE_MATCHER_MAX_CELLS = 250_000
+
+
+def _unique_anchors(a: list[str], b: list[str], alo: int, ahi: int, blo: int, bhi: int) -> list[tuple[int, int]]:
+    """Find the longest run of lines that appear exactly once in both ranges, in the same order."""
+    count_a = Counter(a[alo:ahi])
+    count_b = Counter(b[blo:bhi])
+    index_b = {b[j]: j for j in range(blo, bhi) if count_b[b[j]] == 1}
+    pairs = [(i, index_b[a[i]]) for i in range(alo, ahi) if count_a[a[i]] == 1 and a[i] in index_b]
+
+    # Patience sorting: the longest increasing subsequence of the positions in ``b``.
+    tails, tail_indexes, previous = [], [], [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        pile = bisect_left(tails, j)
+        if pile == len(tails):
+            tails.append(j)
+            tail_indexes.append(index)
+        else:
+            tails[pile] = j
+            tail_indexes[pile] = index
+        previous[index] = tail_indexes[pile - 1] if pile else None
+
+    anchors = []
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    return anchors[::-1]
+
+
+def _matching_lines(a: list[str], b: list[str]) -> list[tuple[int, int]]:
+    """Match the lines of ``a`` and ``b`` with the patience algorithm."""
+    matches = []
+    regions = [(0, len(a), 0, len(b))]
+    while regions:
+        alo, ahi, blo, bhi = regions.pop()
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo, blo = alo + 1, blo + 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi, bhi = ahi - 1, bhi - 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+
+        if anchors := _unique_anchors(a, b, alo, ahi, blo, bhi):
+            for i, j in anchors:
+                matches.append((i, j))
+                regions.append((alo, i, blo, j))
+                alo, blo = i + 1, j + 1
+            regions.append((alo, ahi, blo, bhi))
+        elif (ahi - alo) * (bhi - blo) <= SEQUENCE_MATCHER_MAX_CELLS:
+            matcher = SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for i, j, size in matcher.get_matching_blocks():
+                matches.extend((alo + i + offset, blo + j + offset) for offset in range(size))
+    matches.sort()
+    return matches
+
+
+def diff_opcodes(a: list[str], b: list[str]) -> list[tuple[str, int, int, int, int]]:
+    """
+    Diff two lists of lines with the patience algorithm.
+
+    Lines that appear once in both versions anchor the diff, and the regions between
+    them are diffed recursively. The time grows about linearly with the length of
+    the files, where ``difflib`` on whole files is quadratic in the worst case.
+
+    Args:
+        a (list[str]): The old lines.
+        b (list[str]): The new lines.
+
+    Returns:
+        list[tuple[str, int, int, int, int]]: The opcodes, like ``SequenceMatcher.get_opcodes``.
+    """
+    opcodes = []
+    i = j = 0
+    for match_i, match_j in [*_matching_lines(a, b), (len(a), len(b))]:
+        if i < match_i or j < match_j:
+            tag = "replace" if i < match_i and j < match_j else "delete" if i < match_i else "insert"
+            opcodes.append((tag, i, match_i, j, match_j))
+        if match_i < len(a):
+            if opcodes and opcodes[-1][0] == "equal":
+                opcodes[-1] = ("equal", opcodes[-1][1], match_i + 1, opcodes[-1][3], match_j + 1)
+            else:
+                opcodes.append(("equal", match_i, match_i + 1, match_j, match_j + 1))
+        i, j = match_i + 1, match_j + 1
+    return opcodes
+
+
+def grouped_opcodes(a: list[str], b: list[str], context: int = DIFF_CONTEXT_LINES) -> list[list[tuple[str, int, int, int, int]]]:
+    """Group the opcodes of a diff into hunks with ``context`` unchanged lines around the changes."""
+    matcher = SequenceMatcher(None, a, b)
+    matcher.opcodes = diff_opcodes(a, b)
+    return [group for group in matcher.get_grouped_opcodes(context) if any(tag != "equal" for tag, *_ in group)]
+
+
+def _row(kind: str, *cells) -> str:
+    return f'<tr class="diff-{kind}">' + "".join(f'<td class="{css}">{escape(text)}</td>' for css, text in cells) + "</tr>"
+
+
+def render_diff(old: str, new: str, mode: str = "unified") -> dict:
+    """
+    Render the diff of two versions of a file as an HTML table.
+
+    Args:
+        old (str): The old version.
+        new (str): The new version.
+        mode (str, optional): ``"unified"`` for one column, or ``"split"`` for the versions side by side.
+
+    Returns:
+        dict: The ``html`` of the diff and the number of ``added`` and ``removed`` lines.
+    """
+    a, b = old.splitlines(), new.splitlines()
+    rows, added, removed = [], 0, 0
+    columns = 3 if mode == "unified" else 4
+    for group in grouped_opcodes(a, b):
+        first, last = group[0], group[-1]
+        header = f"@@ -{first[1] + 1},{last[2] - first[1]} +{first[3] + 1},{last[4] - first[3]} @@"
+        rows.append(f'<tr class="diff-hunk"><td colspan="{columns}">{header}</td></tr>')
+        for tag, i1, i2, j1, j2 in group:
+            removed += i2 - i1 if tag != "equal" else 0
+            added += j2 - j1 if tag != "equal" else 0
+            if mode == "unified":
+                if tag == "equal":
+                    rows += [_row("equal", ("diff-ln", i + 1), ("diff-ln", j + 1), ("diff-code", " " + a[i])) for i, j in zip(range(i1, i2), range(j1, j2))]
+                    continue
+                rows += [_row("delete", ("diff-ln", i + 1), ("diff-ln", ""), ("diff-code", "-" + a[i])) for i in range(i1, i2)]
+                rows += [_row("insert", ("diff-ln", ""), ("diff-ln", j + 1), ("diff-code", "+" + b[j])) for j in range(j1, j2)]
+            else:
+                for offset in range(max(i2 - i1, j2 - j1)):
+                    i, j = i1 + offset, j1 + offset
+                    left = (("diff-ln", i + 1), ("diff-code", a[i])) if i < i2 else (("diff-ln", ""), ("diff-code diff-empty", ""))
+                    right = (("diff-ln", j + 1), ("diff-code", b[j])) if j < j2 else (("diff-ln", ""), ("diff-code diff-empty", ""))
+                    rows.append(_row(tag, *left, *right))
+    if not rows:
+        rows.append(f'<tr class="diff-equal"><td colspan="{columns}">No changes.</td></tr>')
+    return {"html": f'<table class="diff diff-{mode}">{"".join(rows)}</table>', "added": added, "removed": removed}
+
+
+def previous_version(fragment: CodeFragment) -> CodeFragment | None:
+    """Get the version of the same file in the same chat that came before a code fragment."""
+    return (
+        CodeFragment.objects.filter(chat_id=fragment.chat_id, filename=fragment.filename)
+        .filter(Q(timestamp__lt=fragment.timestamp) | Q(timestamp=fragment.timestamp, id__lt=fragment.id))
+        .order_by("-timestamp", "-id")
+        .only("id", "checksum")
+        .first()
+    )
+
+
+@instrument
+def get_fragment_diff(fragment_id: int, user, mode: str = "unified") -> dict | None:
+    """
+    Get the diff between a code fragment and the previous version of its file, cached by the checksum pair.
+
+    The source code is only loaded from the database when the diff is not cached.
+    The fragment ids are part of the cache key because the checksums ignore whitespace.
+
+    Args:
+        fragment_id (int): The id of the code fragment.
+        user (User): The user owning the chat of the fragment.
+        mode (str, optional): ``"unified"`` or ``"split"``.
+
+    Returns:
+        dict | None: The rendered diff and the id of the ``previous`` version, or None if the user has no such fragment.
+    """
+    fragment = CodeFragment.objects.filter(pk=fragment_id, chat__user=user).only("id", "chat_id", "filename", "timestamp", "checksum").first()
+    if fragment is None:
+        return None
+    previous = previous_version(fragment)
+    if previous is None:
+        return {"previous": None, "html": "", "added": 0, "removed": 0}
+
+    cache_key = f"chatsnip:diff:{mode}:{previous.id}.{previous.checksum}:{fragment.id}.{fragment.checksum}"
+    if (diff := cache.get(cache_key)) is None:
+        sources = dict(CodeFragment.objects.filter(pk__in=[previous.id, fragment.id]).values_list("id", "source_code"))
+        diff = render_diff(sources[previous.id], sources[fragment.id], mode)
+        cache.set(cache_key, diff, DIFF_CACHE_TIMEOUT)
+    return {"previous": previous.id, **diff}
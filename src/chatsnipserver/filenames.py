@@ -0,0 +1,191 @@
+import re
+from difflib import SequenceMatcher
+
+LANGUAGE_FILE_EXTENSIONS = {
+    "python": ".py",
+    "py": ".py",
+    "python3": ".py",
+    "javascript": ".js",
+    "js": ".js",
+    "jsx": ".jsx",
+    "typescript": ".ts",
+    "ts": ".ts",
+    "tsx": ".tsx",
+    "java": ".java",
+    "c++": ".cpp",
+    "cpp": ".cpp",
+    "c#": ".cs",
+    "csharp": ".cs",
+    "cs": ".cs",
+    "kotlin": ".kt",
+    "go": ".go",
+    "golang": ".go",
+    "rust": ".rs",
+    "rs": ".rs",
+    "php": ".php",
+    "swift": ".swift",
+    "c": ".c",
+    "ruby": ".rb",
+    "rb": ".rb",
+    "scala": ".scala",
+    "dart": ".dart",
+    "lua": ".lua",
+    "r": ".r",
+    "bash": ".sh",
+    "sh": ".sh",
+    "shell": ".sh",
+    "zsh": ".sh",
+    "powershell": ".ps1",
+    "sql": ".sql",
+    "json": ".json",
+    "html": ".html",
+    "css": ".css",
+    "scss": ".scss",
+    "xml": ".xml",
+    "yaml": ".yaml",
+    "yml": ".yaml",
+    "toml": ".toml",
+    "ini": ".ini",
+    "markdown": ".md",
+    "md": ".md",
+    "dockerfile": ".dockerfile",
+    "makefile": ".mk",
+    "text": ".txt",
+    "plaintext": ".txt",
+}
+DEFAULT_FILE_EXTENSION = ".txt"
+# Only the first lines are searched for a filename comment.
+HEADER_LINES = 3
+SIMILARITY_THRESHOLD = 0.6
+
+_PATH = r"([\w.-]+(?:/[\w.-]+)*\.[A-Za-z][\w]{0,7})"
+_HEADER_PATTERNS = [
+    # "# filename: app/main.py", "// File: index.js", "<!-- path: index.html -->"
+    re.compile(r"^\s*(?:#|//|--|;|/\*+|<!--|\*)\s*(?:file(?:name)?|path)\s*[:=]\s*" + _PATH, re.IGNORECASE),
+    # "// src/app.js", "/* styles.css */", "<!-- index.html -->"
+    re.compile(r"^\s*(?:#|//|--|/\*+|<!--)\s*" + _PATH + r"\s*(?:\*/|-->)?\s*$"),
+]
+
+# The first top-level definition names the file, classes before functions.
+# ``True`` keeps the case of the name, as Java and C# require, ``False`` turns it into snake case.
+_DEFINITION_PATTERNS = {
+    ".py": ([r"^class\s+(\w+)", r"^(?:async\s+)?def\s+(\w+)"], False),
+    ".rb": ([r"^class\s+([A-Z]\w*)", r"^module\s+([A-Z]\w*)"], False),
+    ".rs": ([r"^(?:pub\s+)?(?:struct|enum|trait)\s+(\w+)", r"^(?:pub\s+)?fn\s+(\w+)"], False),
+    ".go": ([r"^package\s+(\w+)"], False),
+    ".java": ([r"^(?:public\s+)?(?:(?:abstract|final|sealed)\s+)*(?:class|interface|enum|record)\s+(\w+)"], True),
+    ".kt": ([r"^(?:(?:public|internal|data|sealed|abstract|open)\s+)*(?:class|interface|object)\s+(\w+)"], True),
+    ".cs": ([r"^\s*(?:(?:public|internal|static|sealed|abstract|partial)\s+)*(?:class|interface|struct|record|enum)\s+(\w+)"], True),
+    ".swift": ([r"^(?:(?:public|final|open)\s+)*(?:class|struct|protocol|enum)\s+(\w+)"], True),
+    ".php": ([r"^(?:(?:abstract|final)\s+)*(?:class|interface|trait)\s+(\w+)"], True),
+    ".js": ([r"^(?:export\s+(?:default\s+)?)?class\s+(\w+)", r"^(?:export\s+(?:default\s+)?)?(?:async\s+)?function\s*\*?\s*(\w+)"], True),
+    ".ts": ([r"^(?:export\s+(?:default\s+)?)?(?:abstract\s+)?class\s+(\w+)", r"^(?:export\s+(?:default\s+)?)?(?:async\s+)?function\s*\*?\s*(\w+)"], True),
+    ".c": ([r"^(?:int|void)\s+(main)\s*\("], True),
+    ".cpp": ([r"^(?:int|void)\s+(main)\s*\("], True),
+}
+_DEFINITION_PATTERNS[".jsx"] = _DEFINITION_PATTERNS[".js"]
+_DEFINITION_PATTERNS[".tsx"] = _DEFINITION_PATTERNS[".ts"]
+_DEFINITION_PATTERNS = {
+    extension: ([re.compile(pattern, re.MULTILINE) for pattern in patterns], keep_case) for extension, (patterns, keep_case) in _DEFINITION_PATTERNS.items()
+}
+
+
+def file_extension(language: str | None) -> str:
+    """Get the file extension for a programming language, ``.txt`` if it is unknown."""
+    return LANGUAGE_FILE_EXTENSIONS.get((language or "").strip().lower(), DEFAULT_FILE_EXTENSION)
+
+
+def _snake_case(name: str) -> str:
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])", "_", name).lower()
+
+
+def header_filename(content: str) -> str | None:
+    """
+    Find the filename in a comment on the first lines of a code block, like ``# filename: app.py`` or ``// src/index.js``.
+
+    Args:
+        content (str): The code block.
+
+    Returns:
+        str | None: The filename, or None if there is no such comment.
+    """
+    for line in (content or "").lstrip("\n").split("\n", HEADER_LINES)[:HEADER_LINES]:
+        for pattern in _HEADER_PATTERNS:
+            if match := pattern.match(line):
+                return match.group(1).lstrip("./") or None
+    return None
+
+
+def definition_filename(content: str, language: str | None = "") -> str | None:
+    """
+    Name a code block after its first top-level class, or failing that its first function, following the conventions of its language.
+
+    Args:
+        content (str): The code block.
+        language (str, optional): The programming language of the code block.
+
+    Returns:
+        str | None: The filename, or None if the language is not known or nothing is defined.
+    """
+    extension = file_extension(language)
+    patterns, keep_case = _DEFINITION_PATTERNS.get(extension, ((), True))
+    for pattern in patterns:
+        if match := pattern.search(content or ""):
+            name = match.group(1)
+            return f"{name if keep_case else _snake_case(name)}{extension}"
+    return None
+
+
+def untitled_filename(checksum: str, language: str | None = "") -> str:
+    """Name a code block that nothing names, by its checksum so the same code always gets the same name."""
+    return f"untitled_{checksum[:8]}{file_extension(language)}"
+
+
+def similar_filename(content: str, candidates: dict[str, str], threshold: float = SIMILARITY_THRESHOLD) -> str | None:
+    """
+    Find the file that a code block is most likely a version of.
+
+    The lines of the code block are compared with the latest version of every
+    candidate, with the cheap upper bounds of ``SequenceMatcher`` ruling out most
+    candidates before the real ratio is computed.
+
+    Args:
+        content (str): The code block.
+        candidates (dict[str, str]): The latest source code of every file, by filename.
+        threshold (float, optional): The similarity ratio required for a match. Defaults to 0.6.
+
+    Returns:
+        str | None: The filename of the most similar file, or None if none is similar enough.
+    """
+    lines = [line.strip() for line in (content or "").splitlines() if line.strip()]
+    if not lines:
+        return None
+    matcher = SequenceMatcher(None, autojunk=False)
+    matcher.set_seq2(lines)
+    best, best_ratio = None, threshold
+    for filename, source_code in candidates.items():
+        matcher.set_seq1([line.strip() for line in source_code.splitlines() if line.strip()])
+        if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+            continue
+        if (ratio := matcher.ratio()) >= best_ratio:
+            best, best_ratio = filename, ratio
+    return best
+
+
+def name_untitled(source_code: str, checksum: str, language: str | None, candidates: dict[str, str]) -> str:
+    """
+    Name a code block without a filename or filename comment.
+
+    It joins the most similar file of the chat, so that versions of untitled code are
+    grouped, or is named after its first definition, or after its checksum.
+
+    Args:
+        source_code (str): The cleaned code block.
+        checksum (str): The checksum of the code block.
+        language (str | None): The programming language of the code block.
+        candidates (dict[str, str]): The latest source code of the files of the chat in the same language, by filename.
+
+    Returns:
+        str: The filename.
+    """
+    return similar_filename(source_code, candidates) or definition_filename(source_code, language) or untitled_filename(checksum, language)
@@ -1,4 +1,8 @@
+import datetime
+
 from django import forms
+from django.conf import settings
+from django.utils import timezone
 
 from .models import ChatSnipProfile, Chat
 from aceshigh.widgets import AceEditorWidget
@@ -19,4 +23,45 @@ class ChatForm(forms.ModelForm):
         widgets = {
             'json_data': AceEditorWidget(mode='json'),
             'markdown': AceEditorWidget(mode='markdown'),
-        }
\ No newline at end of file
+        }
+
+class ChatFilterForm(forms.Form):
+    """Filter the chats of a user by chatbot, LLM model and date range.
+
+    Every filter matches a composite index of ``Chat``: the dates are turned into a
+    range of timestamps instead of comparing the date of every timestamp.
+    """
+
+    chatbot = forms.CharField(required=False, max_length=100)
+    llm_model = forms.CharField(required=False, max_length=100, label="LLM model")
+    since = forms.DateField(required=False, widget=forms.DateInput(attrs={"type": "date"}))
+    until = forms.DateField(required=False, widget=forms.DateInput(attrs={"type": "date"}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        since, until = cleaned_data.get("since"), cleaned_data.get("until")
+        if since and until and since > until:
+            raise forms.ValidationError("The start date must not be after the end date.")
+        return cleaned_data
+
+    def filter(self, queryset):
+        """Filter the chats by the valid, non-empty fields."""
+        data = self.cleaned_data if self.is_valid() else {}
+        if data.get("chatbot"):
+            queryset = queryset.filter(chatbot=data["chatbot"])
+        if data.get("llm_model"):
+            queryset = queryset.filter(llm_model=data["llm_model"])
+        if data.get("since"):
+            queryset = queryset.filter(timestamp__gte=start_of_day(data["since"]))
+        if data.get("until"):
+            queryset = queryset.filter(timestamp__lt=start_of_day(data["until"] + datetime.timedelta(days=1)))
+        return queryset
+
+    def has_filters(self) -> bool:
+        return self.is_valid() and any(self.cleaned_data.values())
+
+
+def start_of_day(day: datetime.date) -> datetime.datetime:
+    """Get the start of a day in the current time zone."""
+    start = datetime.datetime.combine(day, datetime.time.min)
+    return timezone.make_aware(start) if settings.USE_TZ else start
@@ -0,0 +1,400 @@
+import logging
+import os
+import re
+import struct
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from typing import IO, NamedTuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, connections, transaction
+from PIL import Image, ImageOps, features
+
+from .models import ChatImage, ChatImageVariant
+from .storage import chat_image_url, image_variant_url
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VARIANT_WIDTHS = (150, 320, 640, 1280)
+DEFAULT_VARIANT_FORMATS = ("webp",)
+PILLOW_FORMATS = {"webp": "WEBP", "avif": "AVIF", "jpeg": "JPEG"}
+
+SNIFF_BYTES = 64 * 1024
+MAX_HEADER_BYTES = 1024 * 1024
+# Checked in order, AVIF files usually also list the generic mif1 brand.
+ISOBMFF_BRANDS = {
+    b"avif": (".avif", "image/avif"),
+    b"avis": (".avif", "image/avif"),
+    b"heic": (".heic", "image/heic"),
+    b"heix": (".heic", "image/heic"),
+    b"hevc": (".heic", "image/heic-sequence"),
+    b"hevx": (".heic", "image/heic-sequence"),
+    b"heim": (".heic", "image/heic"),
+    b"heis": (".heic", "image/heic"),
+    b"mif1": (".heif", "image/heif"),
+    b"msf1": (".heif", "image/heif-sequence"),
+}
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+UNSAFE_SVG = re.compile(rb"<script|<foreignObject|javascript:|\son[a-z]+\s*=", re.IGNORECASE)
+
+_process_pool = None
+_coordinator = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chatsnip-image-variants")
+
+
+class ImageInfo(NamedTuple):
+    """The type and dimensions of an image, as read from its header."""
+
+    extension: str
+    content_type: str
+    width: int | None = None
+    height: int | None = None
+
+
+class InvalidImage(ValueError):
+    """Raised when downloaded content is not an image that can be stored safely."""
+
+
+def sniff_image(data: bytes) -> ImageInfo | None:
+    """
+    Identify an image and read its dimensions from the header, without decoding it.
+
+    Recognizes JPEG, PNG, GIF, WebP, BMP, SVG and the ISO base media formats
+    (AVIF, HEIC and HEIF). The dimensions are None when they are not in ``data``,
+    e.g. when only the first bytes of a JPEG are given.
+
+    Args:
+        data (bytes): The file, or at least its first bytes.
+
+    Returns:
+        ImageInfo | None: The image type and dimensions, or None if the format is not recognized.
+    """
+    if data.startswith(b"\xff\xd8\xff"):
+        return ImageInfo(".jpg", "image/jpeg", *_jpeg_size(data))
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        size = struct.unpack(">II", data[16:24]) if data[12:16] == b"IHDR" and len(data) >= 24 else (None, None)
+        return ImageInfo(".png", "image/png", *size)
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        size = struct.unpack("<HH", data[6:10]) if len(data) >= 10 else (None, None)
+        return ImageInfo(".gif", "image/gif", *size)
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ImageInfo(".webp", "image/webp", *_webp_size(data))
+    if data[:2] == b"BM" and len(data) >= 26:
+        return ImageInfo(".bmp", "image/bmp", *_bmp_size(data))
+    if data[4:8] == b"ftyp":
+        return _sniff_isobmff(data)
+    return _sniff_svg(data)
+
+
+def _jpeg_size(data: bytes) -> tuple[int | None, int | None]:
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            break
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            offset += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+            return width, height
+        if marker == 0xDA:
+            break
+        offset += 2 + struct.unpack(">H", data[offset + 2 : offset + 4])[0]
+    return None, None
+
+
+def _webp_size(data: bytes) -> tuple[int | None, int | None]:
+    chunk = data[12:16]
+    if chunk == b"VP8 " and data[23:26] == b"\x9d\x01\x2a" and len(data) >= 30:
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and data[20:21] == b"\x2f" and len(data) >= 25:
+        bits = struct.unpack("<I", data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None, None
+
+
+def _bmp_size(data: bytes) -> tuple[int, int]:
+    if struct.unpack("<I", data[14:18])[0] == 12:
+        return struct.unpack("<HH", data[18:22])
+    width, height = struct.unpack("<ii", data[18:26])
+    return abs(width), abs(height)
+
+
+def _boxes(data: bytes, start: int, end: int):
+    """Yield the type, payload offset and end offset of the ISO base media boxes in a range."""
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[offset : offset + 8])
+        payload = offset + 8
+        if size == 1 and offset + 16 <= end:
+            size = struct.unpack(">Q", data[offset + 8 : offset + 16])[0]
+            payload += 8
+        elif size == 0:
+            size = end - offset
+        if size < payload - offset:
+            return
+        yield kind, payload, min(offset + size, end)
+        offset += size
+
+
+def _child_box(data: bytes, kind: bytes, start: int, end: int) -> tuple[int, int] | None:
+    return next(((payload, box_end) for box_kind, payload, box_end in _boxes(data, start, end) if box_kind == kind), None)
+
+
+def _sniff_isobmff(data: bytes) -> ImageInfo | None:
+    size = struct.unpack(">I", data[:4])[0]
+    brands = [data[8:12], *(data[offset : offset + 4] for offset in range(16, min(size, len(data)), 4))]
+    brands = set(brands)
+    extension, content_type = next((value for brand, value in ISOBMFF_BRANDS.items() if brand in brands), (None, None))
+    if extension is None:
+        return None
+
+    # The dimensions are in meta > iprp > ipco > ispe. Thumbnails have their own,
+    # smaller ispe box, so the largest one belongs to the primary image.
+    width = height = None
+    if meta := _child_box(data, b"meta", 0, len(data)):
+        iprp = _child_box(data, b"iprp", meta[0] + 4, meta[1])
+        ipco = iprp and _child_box(data, b"ipco", *iprp)
+        for kind, payload, box_end in _boxes(data, *ipco) if ipco else ():
+            if kind == b"ispe" and box_end - payload >= 12:
+                ispe_width, ispe_height = struct.unpack(">II", data[payload + 4 : payload + 12])
+                if width is None or ispe_width * ispe_height > width * height:
+                    width, height = ispe_width, ispe_height
+    return ImageInfo(extension, content_type, width, height)
+
+
+def _sniff_svg(data: bytes) -> ImageInfo | None:
+    head = data[:4096].decode("utf-8", errors="ignore").lstrip("\ufeff \t\r\n")
+    if not head.startswith("<") or not (tag := re.search(r"<svg\b([^>]*)>", head, re.IGNORECASE)):
+        return None
+    attributes = {name.lower(): value for name, value in re.findall(r"([\w:-]+)\s*=\s*[\"']([^\"']*)[\"']", tag.group(1))}
+    width, height = _svg_length(attributes.get("width")), _svg_length(attributes.get("height"))
+    if (width is None or height is None) and (view_box := attributes.get("viewbox")):
+        values = re.split(r"[\s,]+", view_box.strip())
+        if len(values) == 4:
+            width, height = _svg_length(values[2]), _svg_length(values[3])
+    return ImageInfo(".svg", "image/svg+xml", width, height)
+
+
+def _svg_length(value: str | None) -> int | None:
+    if value and (match := re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(?:px)?\s*", value)):
+        return round(float(match.group(1)))
+    return None
+
+
+def validate_image(file: IO) -> ImageInfo:
+    """
+    Check that downloaded content is a complete image that can be stored and served safely.
+
+    Only the headers and trailers are inspected, the image is not decoded.
+
+    Args:
+        file (IO): The downloaded content, as a seekable binary file.
+
+    Returns:
+        ImageInfo: The image type and dimensions.
+
+    Raises:
+        InvalidImage: If the content is not a recognized image, is truncated, is larger than
+        ``CHATSNIP_IMAGE_MAX_PIXELS``, or is an SVG and ``CHATSNIP_IMAGE_ALLOW_SVG`` is not set or it has scripts.
+    """
+    size = file.seek(0, os.SEEK_END)
+    file.seek(0)
+    info = sniff_image(file.read(SNIFF_BYTES))
+    if info and info.extension == ".jpg" and info.width is None and size > SNIFF_BYTES:
+        # Large EXIF or ICC segments can push the frame header past the first read.
+        file.seek(0)
+        info = sniff_image(file.read(MAX_HEADER_BYTES))
+    file.seek(max(0, size - 1024))
+    tail = file.read()
+    file.seek(0)
+
+    if info is None:
+        raise InvalidImage("Unrecognized image format")
+    if info.extension == ".svg":
+        # SVG is a document that can run scripts in more ways than a pattern can rule out, and images are served from the site's origin.
+        if not getattr(settings, "CHATSNIP_IMAGE_ALLOW_SVG", False):
+            raise InvalidImage("SVG images are not accepted")
+        unsafe = UNSAFE_SVG.search(file.read())
+        file.seek(0)
+        if unsafe:
+            raise InvalidImage("SVG contains scripts")
+        return info
+    if not info.width or not info.height:
+        raise InvalidImage("Unreadable image dimensions")
+    if info.width * info.height > getattr(settings, "CHATSNIP_IMAGE_MAX_PIXELS", Image.MAX_IMAGE_PIXELS):
+        raise InvalidImage(f"Image is too large ({info.width}x{info.height})")
+    if (
+        (info.extension == ".png" and b"IEND" not in tail[-12:])
+        or (info.extension == ".jpg" and b"\xff\xd9" not in tail)
+        or (info.extension == ".gif" and not tail.rstrip(b"\x00").endswith(b"\x3b"))
+    ):
+        raise InvalidImage("Image is truncated")
+    return info
+
+
+def can_render(chat_image: ChatImage) -> bool:
+    """Return whether Pillow can decode the image, so variants can be generated for it."""
+    extension = chat_image.image.name.rsplit(".", 1)[-1].lower()
+    return extension in ("jpg", "jpeg", "png", "gif", "webp", "bmp") or (extension == "avif" and features.check("avif"))
+
+
+def get_variant_widths() -> tuple[int, ...]:
+    """Return the configured variant widths, which always include the thumbnail width."""
+    widths = set(getattr(settings, "CHATSNIP_IMAGE_VARIANT_WIDTHS", DEFAULT_VARIANT_WIDTHS))
+    widths.add(get_thumbnail_width())
+    return tuple(sorted(widths))
+
+
+def get_variant_formats() -> tuple[str, ...]:
+    """Return the configured variant formats that this Pillow build can encode."""
+    formats = getattr(settings, "CHATSNIP_IMAGE_VARIANT_FORMATS", DEFAULT_VARIANT_FORMATS)
+    return tuple(name for name in formats if name in PILLOW_FORMATS and (name == "jpeg" or features.check(name)))
+
+
+def get_thumbnail_width() -> int:
+    return getattr(settings, "CHATSNIP_IMAGE_THUMBNAIL_WIDTH", 150)
+
+
+def render_variants(data: bytes, targets: list[tuple[int, str]], quality: int = 80) -> list[tuple[int, int, str, bytes]]:
+    """Resize and re-encode an image. Runs in a worker process, so it must not touch Django.
+
+    Widths at or above the width of the original are skipped, images are never upscaled.
+
+    Args:
+        data (bytes): The original image.
+        targets (list[tuple[int, str]]): The widths and formats to render.
+        quality (int): The encoder quality.
+
+    Returns:
+        list[tuple[int, int, str, bytes]]: The width, height, format and encoded bytes of every rendered variant.
+    """
+    with Image.open(BytesIO(data)) as original:
+        original = ImageOps.exif_transpose(original)
+        rendered = []
+        for width, name in targets:
+            if width >= original.width:
+                continue
+            height = max(1, round(original.height * width / original.width))
+            variant = original.resize((width, height), Image.Resampling.LANCZOS)
+            if name == "jpeg" and variant.mode not in ("RGB", "L"):
+                variant = variant.convert("RGB")
+            elif variant.mode not in ("RGB", "RGBA", "L", "LA"):
+                variant = variant.convert("RGBA")
+            buffer = BytesIO()
+            variant.save(buffer, format=PILLOW_FORMATS[name], quality=quality)
+            rendered.append((width, height, name, buffer.getvalue()))
+        return rendered
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=getattr(settings, "CHATSNIP_IMAGE_WORKERS", None))
+    return _process_pool
+
+
+def generate_image_variants(chat_image: ChatImage, executor=None) -> list[ChatImageVariant]:
+    """
+    Generate the missing variants of a chat image.
+
+    Variants that already exist for the checksum of the image are reused.
+
+    Args:
+        chat_image (ChatImage): The image to generate variants for.
+        executor (Executor, optional): Runs the decoding and encoding. Defaults to the current process.
+
+    Returns:
+        list[ChatImageVariant]: The newly created variants.
+    """
+    if not chat_image.image or not chat_image.checksum or not can_render(chat_image):
+        return []
+    existing = set(ChatImageVariant.objects.filter(checksum=chat_image.checksum).values_list("width", "format"))
+    targets = [(width, name) for width in get_variant_widths() for name in get_variant_formats() if (width, name) not in existing]
+    if not targets:
+        return []
+
+    with chat_image.image.open("rb") as file:
+        data = file.read()
+    quality = getattr(settings, "CHATSNIP_IMAGE_VARIANT_QUALITY", 80)
+    if executor is None:
+        rendered = render_variants(data, targets, quality)
+    else:
+        rendered = executor.submit(render_variants, data, targets, quality).result()
+
+    variants = []
+    for width, height, name, content in rendered:
+        variant = ChatImageVariant(checksum=chat_image.checksum, width=width, height=height, format=name)
+        variant.image.save(f"{chat_image.checksum}_{width}.{name}", ContentFile(content), save=False)
+        try:
+            with transaction.atomic():
+                variant.save()
+        except IntegrityError:
+            variant.image.delete(save=False)
+            continue
+        variants.append(variant)
+    return variants
+
+
+def _generate_in_background(chat_image_id: int) -> None:
+    try:
+        if chat_image := ChatImage.objects.filter(pk=chat_image_id).first():
+            generate_image_variants(chat_image, executor=get_process_pool())
+    except Exception:
+        logger.exception("Generating variants of chat image %s failed.", chat_image_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_image_variants(chat_image: ChatImage) -> None:
+    """
+    Generate the variants of a chat image off the request path.
+
+    The work is queued once the current transaction commits and the images are
+    decoded and encoded in a process pool. Set ``CHATSNIP_IMAGE_VARIANTS_INLINE = True``
+    to generate them immediately in the current process instead.
+
+    Args:
+        chat_image (ChatImage): The newly saved image.
+    """
+    if getattr(settings, "CHATSNIP_IMAGE_VARIANTS_INLINE", False):
+        generate_image_variants(chat_image)
+        return
+    transaction.on_commit(lambda: _coordinator.submit(_generate_in_background, chat_image.pk))
+
+
+def get_chat_image_attributes(chat) -> dict[str, dict[str, str]]:
+    """
+    Build the ``width``, ``height`` and ``srcset`` attributes of every image of a chat.
+
+    Only variants in the first configured format are used in the srcset. The original
+    image stays the ``src`` fallback.
+
+    Args:
+        chat (Chat): The chat object.
+
+    Returns:
+        dict[str, dict[str, str]]: The attributes of every image, keyed by the URL of the original image.
+    """
+    attributes, checksums = {}, {}
+    for image in ChatImage.objects.filter(chat=chat).only("image", "checksum", "width", "height"):
+        url = chat_image_url(image)
+        attributes[url] = {"width": str(image.width), "height": str(image.height)} if image.width and image.height else {}
+        if image.checksum:
+            checksums[image.checksum] = url
+
+    formats = get_variant_formats()
+    if checksums and formats:
+        srcsets = {}
+        for variant in ChatImageVariant.objects.filter(checksum__in=checksums, format=formats[0]).order_by("width"):
+            srcsets.setdefault(checksums[variant.checksum], []).append(f"{image_variant_url(variant)} {variant.width}w")
+        for url, srcset in srcsets.items():
+            attributes[url]["srcset"] = ", ".join(srcset)
+    return attributes
@@ -0,0 +1,183 @@
+import json
+import logging
+
+from django.db import transaction
+from rest_framework import status
+
+from .autotag import schedule_autotag
+from .models import Chat, CodeFragment, UserDailyStat
+from .services import (
+    build_new_code_fragments,
+    discard_downloaded_images,
+    generate_json_checksum,
+    get_or_create_chat,
+    get_pretty_date,
+    known_images,
+    save_downloaded_images,
+)
+from .stats import StatChanges, chat_day, record_stats
+from .storage import chat_image_url
+
+logger = logging.getLogger(__name__)
+
+
+class ChatIngest:
+    """Save a chat posted by the ChatSnip extension as a single unit of work.
+
+    Ingest runs in three steps so the image downloads in between can be done
+    synchronously or concurrently on an event loop:
+
+        ingest = ChatIngest(user, data)
+        if result := ingest.start():
+            return result
+        results = download_images(ingest.chat, ingest.images, ingest.known_images)
+        return ingest.finish(results)
+
+    ``start`` only reads from the database, including the images of the chat that are
+    already saved, blacklisted or quarantined, for all images at once. The downloads
+    write the image files to storage and stage their records. ``finish`` saves the chat, the images and the code
+    fragments in one transaction, and deletes the staged files again if it fails, so a
+    failed ingest leaves neither a half-saved chat nor unreferenced files behind. Once
+    it commits, the chat is tagged from its content (see ``autotag``).
+
+    ``start`` and ``finish`` return the response body and status code.
+    """
+
+    def __init__(self, user, data):
+        self.user = user
+        self.identifier = data.get("chatId")
+        self.json_data = data.get("content")
+        self.markdown = data.get("markdown", "")
+        self.chat_name = data.get("chatName", get_pretty_date())
+        self.chatbot = _metadata(data.get("chatbot"))
+        self.llm_model = _metadata(data.get("llmModel", data.get("llm_model")))
+        self.images = [element for element in self.json_data if "src" in element]
+        self.code_samples = [element for element in self.json_data if "language" in element]
+        self.chat = None
+        self.known_images = None
+        self.saved = []
+
+    def start(self) -> tuple[dict, int] | None:
+        """Look up the chat, or prepare a new one. Returns a response if the content is a duplicate."""
+        if chat := Chat.objects.filter(unique_identifier=self.identifier, user=self.user).first():
+            if chat.checksum == generate_json_checksum(self.json_data) and chat.images_downloaded:
+                logger.debug("Duplicate chat content.")
+                return {"status": "Duplicate content."}, status.HTTP_208_ALREADY_REPORTED
+        else:
+            chat = Chat(
+                unique_identifier=self.identifier,
+                name=self.chat_name,
+                user=self.user,
+                chatbot=self.chatbot,
+                llm_model=self.llm_model,
+                markdown=self.markdown,
+                json_data=self.json_data,
+                images_downloaded=not self.images,
+            )
+        self.chat = chat
+        self.known_images = known_images(chat, [image.get("src") for image in self.images])
+        return None
+
+    def finish(self, image_results: list[dict]) -> tuple[dict, int]:
+        """Save the chat, the downloaded images and the code fragments in one transaction.
+
+        Args:
+            image_results (list[dict]): The ``download_image`` result of every image, in the order of ``images``.
+        """
+        try:
+            with transaction.atomic():
+                return self._save(image_results)
+        except BaseException:
+            discard_downloaded_images(image_results)
+            raise
+
+    def _save(self, image_results: list[dict]) -> tuple[dict, int]:
+        chat = self.chat
+        chat_saved = chat.pk is None
+        stats = StatChanges()
+        update_fields = []
+        if chat_saved:
+            chat = self.chat = get_or_create_chat(
+                self.identifier,
+                self.chat_name,
+                self.user,
+                defaults={
+                    "markdown": chat.markdown,
+                    "json_data": chat.json_data,
+                    "images_downloaded": chat.images_downloaded,
+                    "chatbot": chat.chatbot,
+                    "llm_model": chat.llm_model,
+                },
+            )
+            self.saved.append("chat")
+        elif (self.chatbot and self.chatbot != chat.chatbot) or (self.llm_model and self.llm_model != chat.llm_model):
+            # New chats are counted when they are saved, on the day they are created, so the change goes on that day too.
+            changes = StatChanges().add_chat(chat, -1)
+            chat.chatbot, chat.llm_model = self.chatbot or chat.chatbot, self.llm_model or chat.llm_model
+            record_stats(chat.user_id, changes.add_chat(chat), chat_day(chat))
+            update_fields += ["chatbot", "llm_model"]
+
+        if self.images:
+            image_source_replacement, checksums, discarded, staged_results = {}, set(), [], []
+            for index, (image, result) in enumerate(zip(self.images, image_results)):
+                if not result.get("status") and result.get("status_code", 200) == 403:
+                    discard_downloaded_images([*discarded, *image_results[index:]])
+                    if update_fields:
+                        chat.save(update_fields=[*update_fields, "timestamp"])
+                    record_stats(chat.user_id, stats)
+                    return {"status": "Chat saved, but images could not be downloaded. Refresh page and try again."}, status.HTTP_200_OK
+
+                staged = result.get("image") or result.get("quarantined")
+                if staged is None:
+                    continue
+                staged.chat = chat
+                if "image" in result:
+                    if staged.checksum in checksums:
+                        # The same image appears twice in the chat, only the first one is kept.
+                        discarded.append(result)
+                        continue
+                    checksums.add(staged.checksum)
+                staged_results.append((image, result))
+            discard_downloaded_images(discarded)
+            save_downloaded_images([result for _, result in staged_results])
+            for image, result in staged_results:
+                if "image" in result:
+                    stats.add(UserDailyStat.IMAGES, "", 1, result["image"].size or 0)
+                    image_source_replacement[image.get("src")] = chat_image_url(result["image"])
+
+            self.saved.append("images")
+
+            if image_source_replacement:
+                serialized_json_data = json.dumps(chat.json_data)
+                for original_source, new_source in image_source_replacement.items():
+                    chat.markdown = (chat.markdown or "").replace(original_source, new_source)
+                    serialized_json_data = serialized_json_data.replace(original_source, new_source)
+                chat.json_data = json.loads(serialized_json_data)
+                update_fields += ["markdown", "json_data"]
+
+            if not chat.images_downloaded:
+                chat.images_downloaded = True
+                update_fields.append("images_downloaded")
+
+        if update_fields:
+            chat.save(update_fields=[*update_fields, "timestamp"])
+            chat_saved = True
+
+        if fragments := build_new_code_fragments(chat, self.code_samples):
+            CodeFragment.objects.bulk_create(fragments)
+            if not chat_saved:
+                fragments[0].touch_chat()
+            for fragment in fragments:
+                stats.add(UserDailyStat.LANGUAGE, fragment.programming_language)
+            self.saved.append("code")
+
+        record_stats(chat.user_id, stats)
+        schedule_autotag(chat)
+        return {"status": f"Process done. Saved {' & '.join(self.saved)}."}, status.HTTP_200_OK
+
+
+def _metadata(value) -> str | None:
+    """Clean a chatbot or model name from the payload."""
+    if not isinstance(value, str) or not value.strip():
+        return None
+    return value.strip()[:100]
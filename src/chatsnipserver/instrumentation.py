@@ -0,0 +1,258 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("chatsnipserver.slow_requests")
+
+REQUEST_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_current_metrics = ContextVar("chatsnip_request_metrics", default=None)
+
+
+class RequestMetrics:
+    """Timings and counters collected while handling a single request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.downloaded_bytes = 0
+        self.images = 0
+        self.functions = {}
+
+    def record_function(self, name: str, duration: float) -> None:
+        calls, total = self.functions.get(name, (0, 0.0))
+        self.functions[name] = (calls + 1, total + duration)
+
+    def breakdown(self) -> str:
+        """Describe where the request spent its time, for the slow-request log."""
+        parts = [
+            f"total={self.duration:.3f}s",
+            f"db={self.db_time:.3f}s/{self.db_queries}q",
+            f"downloaded={self.downloaded_bytes}B",
+            f"images={self.images}",
+        ]
+        parts += [f"{name}={total:.3f}s/{calls}x" for name, (calls, total) in sorted(self.functions.items())]
+        return " ".join(parts)
+
+
+class MetricsRegistry:
+    """Process-wide totals exposed in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = {}
+            self.request_buckets = {}
+            self.functions = {}
+            self.db_queries = 0
+            self.db_time = 0.0
+            self.downloaded_bytes = 0
+            self.images = 0
+
+    def record_request(self, view: str, metrics: RequestMetrics) -> None:
+        with self._lock:
+            count, total = self.requests.get(view, (0, 0.0))
+            self.requests[view] = (count + 1, total + metrics.duration)
+            buckets = self.request_buckets.setdefault(view, [0] * len(REQUEST_DURATION_BUCKETS))
+            for index, bound in enumerate(REQUEST_DURATION_BUCKETS):
+                if metrics.duration <= bound:
+                    buckets[index] += 1
+            self.db_queries += metrics.db_queries
+            self.db_time += metrics.db_time
+
+    def record_function(self, name: str, duration: float) -> None:
+        with self._lock:
+            calls, total = self.functions.get(name, (0, 0.0))
+            self.functions[name] = (calls + 1, total + duration)
+
+    def record_download(self, size: int) -> None:
+        with self._lock:
+            self.downloaded_bytes += size
+
+    def record_image(self) -> None:
+        with self._lock:
+            self.images += 1
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                "# TYPE chatsnip_request_duration_seconds histogram",
+            ]
+            for view, (count, total) in sorted(self.requests.items()):
+                for bound, value in zip(REQUEST_DURATION_BUCKETS, self.request_buckets[view]):
+                    lines.append(f'chatsnip_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {value}')
+                lines.append(f'chatsnip_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {count}')
+                lines.append(f'chatsnip_request_duration_seconds_sum{{view="{view}"}} {total}')
+                lines.append(f'chatsnip_request_duration_seconds_count{{view="{view}"}} {count}')
+            lines.append("# TYPE chatsnip_function_calls_total counter")
+            lines += [f'chatsnip_function_calls_total{{function="{name}"}} {calls}' for name, (calls, _) in sorted(self.functions.items())]
+            lines.append("# TYPE chatsnip_function_seconds_total counter")
+            lines += [f'chatsnip_function_seconds_total{{function="{name}"}} {total}' for name, (_, total) in sorted(self.functions.items())]
+            lines += [
+                "# TYPE chatsnip_db_queries_total counter",
+                f"chatsnip_db_queries_total {self.db_queries}",
+                "# TYPE chatsnip_db_seconds_total counter",
+                f"chatsnip_db_seconds_total {self.db_time}",
+                "# TYPE chatsnip_downloaded_bytes_total counter",
+                f"chatsnip_downloaded_bytes_total {self.downloaded_bytes}",
+                "# TYPE chatsnip_images_downloaded_total counter",
+                f"chatsnip_images_downloaded_total {self.images}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def instrument(func):
+    """Record the wall time of every call to ``func`` for the current request and the process.
+
+    Coroutine functions are timed until the coroutine completes.
+    """
+    name = func.__name__
+
+    if iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _record_function(name, time.perf_counter() - started)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record_function(name, time.perf_counter() - started)
+
+    return wrapper
+
+
+def _record_function(name: str, duration: float) -> None:
+    registry.record_function(name, duration)
+    if metrics := _current_metrics.get():
+        metrics.record_function(name, duration)
+
+
+def record_download(size: int) -> None:
+    """Record a completed download of ``size`` bytes."""
+    registry.record_download(size)
+    if metrics := _current_metrics.get():
+        metrics.downloaded_bytes += size
+
+
+def record_image() -> None:
+    """Record a downloaded image being stored."""
+    registry.record_image()
+    if metrics := _current_metrics.get():
+        metrics.images += 1
+
+
+class PerformanceMiddleware:
+    """Collect per-request timings and database usage, and log slow requests.
+
+    Requests slower than ``CHATSNIP_SLOW_REQUEST_SECONDS`` (default 1 second) are
+    logged to the ``chatsnipserver.slow_requests`` logger with a breakdown of
+    where the time went. Works in both sync and async middleware stacks.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_request_seconds = getattr(settings, "CHATSNIP_SLOW_REQUEST_SECONDS", 1.0)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        try:
+            with record_queries(_QueryRecorder(metrics)):
+                response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+            metrics.duration = time.perf_counter() - metrics.started
+        self.finish(request, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        try:
+            async with arecord_queries(_QueryRecorder(metrics)):
+                response = await self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+            metrics.duration = time.perf_counter() - metrics.started
+        self.finish(request, metrics)
+        return response
+
+    def finish(self, request, metrics: RequestMetrics) -> None:
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        registry.record_request(view, metrics)
+        if metrics.duration >= self.slow_request_seconds:
+            logger.warning("Slow request %s %s (%s): %s", request.method, request.path, view, metrics.breakdown())
+
+
+@contextmanager
+def record_queries(wrapper):
+    """Install an execute wrapper on every database connection of the current thread."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
+
+
+@asynccontextmanager
+async def arecord_queries(wrapper):
+    """Install an execute wrapper for an async request.
+
+    Database connections are per thread, and async views reach the database through
+    ``sync_to_async``, which runs every call of a request on the same thread. The
+    wrapper is installed on that thread's connections.
+    """
+    stack = ExitStack()
+    await sync_to_async(stack.enter_context)(record_queries(wrapper))
+    try:
+        yield
+    finally:
+        await sync_to_async(stack.close)()
+
+
+class _QueryRecorder:
+    """Execute wrapper counting queries and their time."""
+
+    def __init__(self, metrics: RequestMetrics):
+        self.metrics = metrics
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.metrics.db_queries += 1
+            self.metrics.db_time += time.perf_counter() - started
@@ -0,0 +1,46 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chatsnipserver.autotag import AUTOTAG_VERSION, autotag_chats
+from chatsnipserver.models import Chat
+
+
+class Command(BaseCommand):
+    help = (
+        "Tag the chats that were not tagged by the current tagging rules yet. "
+        "Every batch is committed on its own, so an interrupted run continues where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="chats tagged per transaction")
+        parser.add_argument("--limit", type=int, help="stop after this many chats")
+        parser.add_argument("--max-seconds", type=float, help="stop after the batch that exceeds this time")
+        parser.add_argument("--user", help="only tag the chats of the user with this username")
+
+    def handle(self, *args, **options):
+        chats = Chat.objects.filter(autotag_version__lt=AUTOTAG_VERSION).only("pk", "user_id", "json_data", "markdown", "autotag_tags").order_by("pk")
+        if options["user"]:
+            try:
+                chats = chats.filter(user=get_user_model().objects.get(username=options["user"]))
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user named {options['user']!r}.")
+
+        started = time.monotonic()
+        last_pk, processed, added = 0, 0, 0
+        while options["limit"] is None or processed < options["limit"]:
+            size = options["batch_size"] if options["limit"] is None else min(options["batch_size"], options["limit"] - processed)
+            batch = list(chats.filter(pk__gt=last_pk)[:size])
+            if not batch:
+                break
+            added += autotag_chats(batch)
+            processed += len(batch)
+            last_pk = batch[-1].pk
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"Tagged {processed} chats, {processed / elapsed:.0f} chats/s.")
+            if options["max_seconds"] is not None and elapsed >= options["max_seconds"]:
+                break
+
+        remaining = chats.count()
+        self.stdout.write(self.style.SUCCESS(f"Added {added} tags to {processed} chats, {remaining} chats left."))
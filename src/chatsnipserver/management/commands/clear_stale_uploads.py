@@ -0,0 +1,34 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chatsnipserver.models import ChatUpload
+from chatsnipserver.uploads import DEFAULT_UPLOAD_EXPIRY_HOURS, ChunkStore, upload_dir
+
+
+class Command(BaseCommand):
+    help = "Delete chunked chat uploads that were never finalized, and chunks left on disk without an upload."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=float,
+            default=getattr(settings, "CHATSNIP_UPLOAD_EXPIRY_HOURS", DEFAULT_UPLOAD_EXPIRY_HOURS),
+            help="delete uploads started more than this many hours ago",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        deleted, _ = ChatUpload.objects.filter(created__lt=cutoff).delete()
+        uploads = {str(pk) for pk in ChatUpload.objects.values_list("pk", flat=True)}
+        orphaned = 0
+        if os.path.isdir(upload_dir()):
+            for entry in os.scandir(upload_dir()):
+                # Directories of uploads started while this runs are younger than the cutoff.
+                if entry.is_dir() and entry.name not in uploads and entry.stat().st_mtime < cutoff.timestamp():
+                    ChunkStore(entry.name).delete()
+                    orphaned += 1
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} stale uploads and {orphaned} orphaned chunk directories."))
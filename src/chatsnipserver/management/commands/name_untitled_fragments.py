@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chatsnipserver.models import Chat
+from chatsnipserver.services import rename_untitled_fragments
+
+
+class Command(BaseCommand):
+    help = "Name the code fragments saved as untitled_<time> from their content, and group them with similar files of their chat."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="only rename the code fragments of the user with this username")
+
+    def handle(self, *args, **options):
+        chats = Chat.objects.all()
+        if options["user"]:
+            try:
+                user = get_user_model().objects.get(username=options["user"])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user named {options['user']!r}.")
+            chats = chats.filter(user=user)
+        renamed = rename_untitled_fragments(chats)
+        self.stdout.write(self.style.SUCCESS(f"Renamed {renamed} code fragments."))
@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chatsnipserver.models import ChatImage
+from chatsnipserver.stats import fill_image_sizes, rebuild_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily statistics of every user from their chats, code fragments and images."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="only rebuild the statistics of the user with this username")
+
+    def handle(self, *args, **options):
+        user = None
+        images = ChatImage.objects.all()
+        if options["user"]:
+            try:
+                user = get_user_model().objects.get(username=options["user"])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user named {options['user']!r}.")
+            images = images.filter(chat__user=user)
+        if filled := fill_image_sizes(images):
+            self.stdout.write(f"Stored the size of {filled} images.")
+        written = rebuild_stats(user)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} daily statistics."))
@@ -0,0 +1,21 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chatsnipserver.tags import rebuild_tag_counts
+
+
+class Command(BaseCommand):
+    help = "Recompute the number of chats of every user with every tag."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="only rebuild the counts of the user with this username")
+
+    def handle(self, *args, **options):
+        user = None
+        if options["user"]:
+            try:
+                user = get_user_model().objects.get(username=options["user"])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user named {options['user']!r}.")
+        written = rebuild_tag_counts(user)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} tag counts."))
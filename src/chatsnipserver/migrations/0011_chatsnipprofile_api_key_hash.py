@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-18 09:12
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_api_keys(apps, schema_editor):
+    ChatSnipProfile = apps.get_model("chatsnipserver", "ChatSnipProfile")
+    for profile in ChatSnipProfile.objects.all():
+        profile.api_key_hash = hashlib.sha256(str(profile.api_key).encode("utf-8")).hexdigest()
+        profile.save(update_fields=["api_key_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0010_alter_chat_tags"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatsnipprofile",
+            name="api_key_hash",
+            field=models.CharField(editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(hash_api_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:40
+
+import chatsnipserver.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0011_chatsnipprofile_api_key_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatImageVariant",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("checksum", models.CharField(max_length=64)),
+                ("width", models.PositiveIntegerField()),
+                ("height", models.PositiveIntegerField()),
+                ("format", models.CharField(max_length=10)),
+                ("image", models.FileField(upload_to=chatsnipserver.models.image_variant_upload_to)),
+            ],
+            options={
+                "verbose_name": "Chat Image Variant",
+                "verbose_name_plural": "Chat Image Variants",
+                "constraints": [models.UniqueConstraint(fields=("checksum", "width", "format"), name="unique_chat_image_variant")],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:05
+
+import chatsnipserver.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0012_chatimagevariant"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatimage",
+            name="width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="chatimage",
+            name="height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="QuarantinedImage",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("source_url", models.CharField(max_length=500)),
+                ("reason", models.CharField(max_length=255)),
+                ("content_type", models.CharField(blank=True, max_length=100)),
+                ("checksum", models.CharField(max_length=64)),
+                ("file", models.FileField(upload_to=chatsnipserver.models.quarantine_upload_to)),
+                ("timestamp", models.DateTimeField(auto_now_add=True)),
+                (
+                    "chat",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="quarantined_images", to="chatsnipserver.chat"),
+                ),
+            ],
+            options={
+                "verbose_name": "Quarantined Image",
+                "verbose_name_plural": "Quarantined Images",
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:53
+
+import chatsnipserver.models
+import chatsnipserver.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0013_chatimage_dimensions_quarantinedimage"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="chatimage",
+            name="image",
+            field=models.ImageField(storage=chatsnipserver.storage.image_storage, upload_to=chatsnipserver.models.chat_image_upload_to),
+        ),
+        migrations.AlterField(
+            model_name="chatimagevariant",
+            name="image",
+            field=models.FileField(storage=chatsnipserver.storage.image_storage, upload_to=chatsnipserver.models.image_variant_upload_to),
+        ),
+        migrations.AlterField(
+            model_name="quarantinedimage",
+            name="file",
+            field=models.FileField(storage=chatsnipserver.storage.image_storage, upload_to=chatsnipserver.models.quarantine_upload_to),
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:15
+
+import django.db.models.deletion
+import taggit.managers
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def copy_tags_to_tagged_chats(apps, schema_editor):
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    TaggedItem = apps.get_model("taggit", "TaggedItem")
+    Chat = apps.get_model("chatsnipserver", "Chat")
+    TaggedChat = apps.get_model("chatsnipserver", "TaggedChat")
+    UserTagCount = apps.get_model("chatsnipserver", "UserTagCount")
+
+    content_type = ContentType.objects.filter(app_label="chatsnipserver", model="chat").first()
+    if content_type is None:
+        return
+    tagged_items = TaggedItem.objects.filter(content_type=content_type)
+    owners = dict(Chat.objects.values_list("pk", "user_id"))
+    TaggedChat.objects.bulk_create(
+        (
+            TaggedChat(content_object_id=item.object_id, tag_id=item.tag_id, user_id=owners[item.object_id])
+            for item in tagged_items.iterator()
+            if item.object_id in owners
+        ),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    UserTagCount.objects.bulk_create(
+        UserTagCount(user_id=row["user_id"], tag_id=row["tag_id"], count=row["count"])
+        for row in TaggedChat.objects.values("user_id", "tag_id").annotate(count=Count("id"))
+    )
+    tagged_items.delete()
+
+
+def copy_tagged_chats_to_tags(apps, schema_editor):
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    TaggedItem = apps.get_model("taggit", "TaggedItem")
+    TaggedChat = apps.get_model("chatsnipserver", "TaggedChat")
+
+    content_type, _ = ContentType.objects.get_or_create(app_label="chatsnipserver", model="chat")
+    TaggedItem.objects.bulk_create(
+        (TaggedItem(content_type=content_type, object_id=item.content_object_id, tag_id=item.tag_id) for item in TaggedChat.objects.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0014_image_storage"),
+        ("taggit", "0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx"),
+        ("contenttypes", "0002_remove_content_type_name"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TaggedChat",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("content_object", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="tagged_items", to="chatsnipserver.chat")),
+                ("tag", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="%(app_label)s_%(class)s_items", to="taggit.tag")),
+                ("user", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="+", to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "verbose_name": "Tagged Chat",
+                "verbose_name_plural": "Tagged Chats",
+            },
+        ),
+        migrations.AlterField(
+            model_name="chat",
+            name="tags",
+            field=taggit.managers.TaggableManager(
+                blank=True, help_text="A comma-separated list of tags.", through="chatsnipserver.TaggedChat", to="taggit.Tag", verbose_name="Tags"
+            ),
+        ),
+        migrations.CreateModel(
+            name="UserTagCount",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("tag", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="+", to="taggit.tag")),
+                ("user", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="tag_counts", to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "verbose_name": "User Tag Count",
+                "verbose_name_plural": "User Tag Counts",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="taggedchat",
+            index=models.Index(fields=["user", "tag", "content_object"], name="tagged_chat_user_tag_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="taggedchat",
+            constraint=models.UniqueConstraint(fields=("content_object", "tag"), name="unique_tagged_chat"),
+        ),
+        migrations.AddIndex(
+            model_name="usertagcount",
+            index=models.Index(fields=["user", "-count"], name="user_tag_count_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="usertagcount",
+            constraint=models.UniqueConstraint(fields=("user", "tag"), name="unique_user_tag_count"),
+        ),
+        migrations.RunPython(copy_tags_to_tagged_chats, copy_tagged_chats_to_tags),
+    ]
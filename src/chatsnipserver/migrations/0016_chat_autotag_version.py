@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0015_tagged_chat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="autotag_version",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0016_chat_autotag_version"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatimage",
+            name="size",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="UserDailyStat",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("day", models.DateField()),
+                (
+                    "metric",
+                    models.CharField(
+                        choices=[("chatbot", "Chatbot"), ("llm_model", "LLM model"), ("language", "Language"), ("images", "Images")], max_length=20
+                    ),
+                ),
+                ("key", models.CharField(blank=True, default="", max_length=100)),
+                ("count", models.BigIntegerField(default=0)),
+                ("size", models.BigIntegerField(default=0)),
+                ("user", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="daily_stats", to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "verbose_name": "User Daily Stat",
+                "verbose_name_plural": "User Daily Stats",
+                "constraints": [models.UniqueConstraint(fields=("user", "day", "metric", "key"), name="unique_user_daily_stat")],
+            },
+        ),
+    ]
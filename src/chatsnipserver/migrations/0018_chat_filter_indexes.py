@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0017_user_daily_stats"),
+        ("taggit", "0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chat",
+            index=models.Index(fields=["user", "timestamp"], name="chat_user_timestamp_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="chat",
+            index=models.Index(fields=["user", "chatbot", "timestamp"], name="chat_user_chatbot_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="chat",
+            index=models.Index(fields=["user", "llm_model", "timestamp"], name="chat_user_llm_model_idx"),
+        ),
+    ]
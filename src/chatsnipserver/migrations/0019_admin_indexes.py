@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0018_chat_filter_indexes"),
+        ("taggit", "0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chat",
+            index=models.Index(fields=["timestamp", "id"], name="chat_timestamp_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="chat",
+            index=models.Index(fields=["name"], name="chat_name_idx", opclasses=["varchar_pattern_ops"]),
+        ),
+        migrations.AddIndex(
+            model_name="chatimage",
+            index=models.Index(fields=["checksum"], name="chat_image_checksum_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="codefragment",
+            index=models.Index(fields=["timestamp", "id"], name="code_fragment_timestamp_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="codefragment",
+            index=models.Index(fields=["filename"], name="code_fragment_filename_idx", opclasses=["varchar_pattern_ops"]),
+        ),
+        migrations.AddIndex(
+            model_name="codefragment",
+            index=models.Index(fields=["checksum"], name="code_fragment_checksum_idx"),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:51
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0019_admin_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatUpload",
+            fields=[
+                ("id", models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ("size", models.PositiveBigIntegerField(blank=True, null=True)),
+                ("encoding", models.CharField(default="identity", max_length=20)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("user", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="chat_uploads", to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "verbose_name": "Chat Upload",
+                "verbose_name_plural": "Chat Uploads",
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0020_chat_upload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="autotag_tags",
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:24
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def copy_timestamps(apps, schema_editor):
+    # The day of the last change is the closest record of when existing chats were added.
+    Chat = apps.get_model("chatsnipserver", "Chat")
+    ChatImage = apps.get_model("chatsnipserver", "ChatImage")
+    Chat.objects.update(created=F("timestamp"))
+    ChatImage.objects.update(created=Subquery(Chat.objects.filter(pk=OuterRef("chat_id")).values("timestamp")[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatsnipserver", "0021_chat_autotag_tags"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="created",
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name="chatimage",
+            name="created",
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(copy_timestamps, migrations.RunPython.noop),
+    ]
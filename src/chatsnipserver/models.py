@@ -1,29 +1,86 @@
-import json
 import hashlib
-import os
 import uuid
 
 from django.contrib.auth import get_user_model
 from django.db import models
 from django.utils import timezone
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItemBase
+
+from .storage import image_storage, sharded_path
 
 User = get_user_model()
 
 
+class TaggedChat(TaggedItemBase):
+    """Model linking a tag to a chat.
+
+    Replaces taggit's generic ``TaggedItem`` with a foreign key to the chat and carries
+    the owner of the chat, so the tag filters of a user are answered from one index.
+    """
+
+    content_object = models.ForeignKey("Chat", on_delete=models.CASCADE, related_name="tagged_items")
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name="+")
+
+    class Meta:
+        verbose_name = "Tagged Chat"
+        verbose_name_plural = "Tagged Chats"
+        constraints = [
+            models.UniqueConstraint(fields=["content_object", "tag"], name="unique_tagged_chat"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "tag", "content_object"], name="tagged_chat_user_tag_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.user_id is None:
+            self.user_id = self.content_object.user_id
+        super().save(*args, **kwargs)
+
+
+class UserTagCount(models.Model):
+    """Model holding the number of chats of a user with a tag.
+
+    Maintained by signals when tags are added to or removed from chats. Run the
+    ``rebuild_tag_counts`` management command to recompute the counts.
+    """
+
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name="tag_counts")
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name="+")
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "User Tag Count"
+        verbose_name_plural = "User Tag Counts"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "tag"], name="unique_user_tag_count"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-count"], name="user_tag_count_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.tag} ({self.count})"
+
+
 class Chat(models.Model):
     """Model representing a chat."""
 
     unique_identifier = models.CharField(max_length=255, unique=True)
     name = models.CharField(max_length=255)
     timestamp = models.DateTimeField(auto_now=True)
-    tags = TaggableManager(blank=True)
+    # The daily statistics count the chat on the day it was created.
+    created = models.DateTimeField(default=timezone.now, editable=False)
+    tags = TaggableManager(blank=True, through=TaggedChat)
     json_data = models.JSONField(null=True, blank=True)
     markdown = models.TextField(null=True, blank=True)
     checksum = models.CharField(max_length=64)
     images_downloaded = models.BooleanField(default=False)
     chatbot = models.CharField(max_length=100, null=True, blank=True)
     llm_model = models.CharField(max_length=100, null=True, blank=True)
+    autotag_version = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Every tag name derived for the chat, so tags the user removed are not derived again.
+    autotag_tags = models.JSONField(default=list, blank=True, editable=False)
 
     user = models.ForeignKey(
         get_user_model(), on_delete=models.CASCADE, related_name="chats"
@@ -33,13 +90,51 @@ class Chat(models.Model):
         verbose_name = "Chat"
         verbose_name_plural = "Chats"
         ordering = ["-timestamp"]
+        indexes = [
+            models.Index(fields=["user", "timestamp"], name="chat_user_timestamp_idx"),
+            models.Index(fields=["user", "chatbot", "timestamp"], name="chat_user_chatbot_idx"),
+            models.Index(fields=["user", "llm_model", "timestamp"], name="chat_user_llm_model_idx"),
+            # The admin lists chats by timestamp and id, and searches them by the start of their name.
+            models.Index(fields=["timestamp", "id"], name="chat_timestamp_idx"),
+            models.Index(fields=["name"], name="chat_name_idx", opclasses=["varchar_pattern_ops"]),
+        ]
+
+    def __setattr__(self, name, value):
+        if name == "json_data":
+            self.__dict__["_json_data_changed"] = True
+        super().__setattr__(name, value)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._json_data_changed = False
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if fields is None or "json_data" in fields:
+            self._json_data_changed = False
 
     def save(self, *args, **kwargs):
-        """Generate checksum and save the chat."""
-        from .services import generate_checksum
+        """
+        Generate checksum if the JSON data has changed and save the chat.
+
+        The JSON data counts as changed when it was assigned or is named in
+        ``update_fields``, so after changing it in place, like
+        ``chat.json_data.append(...)``, save with ``update_fields=["json_data"]``.
+        """
+        from .services import generate_json_checksum
 
-        self.checksum = generate_checksum(json.dumps(self.json_data))
+        update_fields = kwargs.get("update_fields")
+        json_data_saved = "json_data" in self.__dict__ and (update_fields is None or "json_data" in update_fields)
+        changed = self._json_data_changed or update_fields is not None or not self.checksum
+        if json_data_saved and changed:
+            self.checksum = generate_json_checksum(self.json_data)
+            if update_fields is not None and "checksum" not in update_fields:
+                kwargs["update_fields"] = [*update_fields, "checksum"]
         super().save(*args, **kwargs)
+        if json_data_saved:
+            self._json_data_changed = False
 
     def __str__(self):
         return self.name
@@ -62,16 +157,46 @@ class CodeFragment(models.Model):
         verbose_name = "Code Fragment"
         verbose_name_plural = "Code Fragments"
         ordering = ["-timestamp"]
+        indexes = [
+            models.Index(fields=["timestamp", "id"], name="code_fragment_timestamp_idx"),
+            models.Index(fields=["filename"], name="code_fragment_filename_idx", opclasses=["varchar_pattern_ops"]),
+            models.Index(fields=["checksum"], name="code_fragment_checksum_idx"),
+        ]
 
     def save(self, *args, **kwargs):
         """Clean content, generate checksum and save the code fragment."""
+        adding = self._state.adding
+        self.prepare_content()
+        super().save(*args, **kwargs)
+        self.touch_chat()
+        if adding:
+            self.record_stats(1)
+
+    def prepare_content(self):
+        """Clean the source code and generate its checksum."""
         from .services import clean_content, generate_checksum
 
         self.source_code = clean_content(
             self.source_code, self.chat, self.filename, self.programming_language
         )
         self.checksum = generate_checksum(self.source_code)
-        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """Delete the code fragment and mark its chat as modified."""
+        result = super().delete(*args, **kwargs)
+        self.touch_chat()
+        self.record_stats(-1)
+        return result
+
+    def record_stats(self, count):
+        """Add the code fragment to the daily statistics of the chat owner, or subtract it."""
+        from .stats import StatChanges, record_stats
+
+        record_stats(self.chat.user_id, StatChanges().add(UserDailyStat.LANGUAGE, self.programming_language, count))
+
+    def touch_chat(self):
+        """Update the chat timestamp, so cached renderings of the chat are revalidated."""
+        Chat.objects.filter(pk=self.chat_id).update(timestamp=timezone.now())
 
     def __str__(self):
         return f"{self.filename or 'No Filename'} - {self.programming_language or 'Unknown Language'}"
@@ -82,15 +207,30 @@ class ChatSnipProfile(models.Model):
 
     user = models.OneToOneField(get_user_model(), on_delete=models.CASCADE)
     api_key = models.CharField(max_length=255, unique=True, default=uuid.uuid4)
+    api_key_hash = models.CharField(max_length=64, unique=True, null=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        """Hash the API key, drop the cached lookup of a replaced key and save the profile."""
+        from .authentication import api_key_cache
+
+        api_key_hash = self.hash_api_key(self.api_key)
+        if self.api_key_hash and self.api_key_hash != api_key_hash:
+            api_key_cache.invalidate(self.api_key_hash)
+        self.api_key_hash = api_key_hash
+        super().save(*args, **kwargs)
 
     def regenerate_api_key(self):
         """Regenerate the API key for the user."""
         self.api_key = uuid.uuid4()
         self.save()
 
+    @staticmethod
+    def hash_api_key(api_key) -> str:
+        return hashlib.sha256(str(api_key).encode("utf-8")).hexdigest()
+
 
 def chat_image_upload_to(instance, filename):
-    return os.path.join("chat_images", instance.chat.name, filename)
+    return sharded_path("chat_images", instance.checksum, filename)
 
 
 class ChatImage(models.Model):
@@ -98,9 +238,18 @@ class ChatImage(models.Model):
     source_url = models.CharField(max_length=500)
     title = models.CharField(max_length=255, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
-    image = models.ImageField(upload_to=chat_image_upload_to)
+    image = models.ImageField(upload_to=chat_image_upload_to, storage=image_storage)
     checksum = models.CharField(max_length=64, blank=True, null=True)
     blacklisted = models.BooleanField(default=False)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    size = models.PositiveBigIntegerField(blank=True, null=True)
+    created = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["checksum"], name="chat_image_checksum_idx"),
+        ]
 
     def __str__(self):
         return self.title if self.title else "Chat Image"
@@ -108,6 +257,8 @@ class ChatImage(models.Model):
     def save(self, *args, **kwargs):
         if self.image and not self.checksum:
             self.checksum = self.generate_checksum(self.image)
+        if self.image and self.size is None:
+            self.size = self.image.size
         super().save(*args, **kwargs)
 
     @staticmethod
@@ -126,3 +277,112 @@ class ChatImage(models.Model):
     @classmethod
     def exists_with_checksum(cls, chat, checksum):
         return cls.objects.filter(chat=chat, checksum=checksum).exists()
+
+
+def quarantine_upload_to(instance, filename):
+    return sharded_path("quarantine", instance.checksum, f"{uuid.uuid4().hex}.bin")
+
+
+class QuarantinedImage(models.Model):
+    """Model representing a downloaded chat image that failed validation.
+
+    The file is kept for inspection under a name without its original extension,
+    so it is never served as an image.
+    """
+
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name="quarantined_images")
+    source_url = models.CharField(max_length=500)
+    reason = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    checksum = models.CharField(max_length=64)
+    file = models.FileField(upload_to=quarantine_upload_to, storage=image_storage)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Quarantined Image"
+        verbose_name_plural = "Quarantined Images"
+
+    def __str__(self):
+        return f"{self.source_url} ({self.reason})"
+
+
+def image_variant_upload_to(instance, filename):
+    return sharded_path("chat_image_variants", instance.checksum, filename)
+
+
+class ChatImageVariant(models.Model):
+    """Model representing a resized re-encoding of a chat image.
+
+    Variants are keyed by the checksum of the original image, so they are shared
+    by every chat image with the same content.
+    """
+
+    checksum = models.CharField(max_length=64)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    format = models.CharField(max_length=10)
+    image = models.FileField(upload_to=image_variant_upload_to, storage=image_storage)
+
+    class Meta:
+        verbose_name = "Chat Image Variant"
+        verbose_name_plural = "Chat Image Variants"
+        constraints = [
+            models.UniqueConstraint(fields=["checksum", "width", "format"], name="unique_chat_image_variant"),
+        ]
+
+    def __str__(self):
+        return f"{self.checksum[:12]} {self.width}w {self.format}"
+
+
+class UserDailyStat(models.Model):
+    """Model rolling up the content a user added on one day, for the statistics page.
+
+    Every row counts one kind of content: chats by ``chatbot`` and by ``llm_model``,
+    code fragments by ``language``, and ``images`` with their total ``size`` in bytes.
+    Removed content is subtracted on the day it is removed.
+    """
+
+    CHATBOT = "chatbot"
+    LLM_MODEL = "llm_model"
+    LANGUAGE = "language"
+    IMAGES = "images"
+    METRICS = [(CHATBOT, "Chatbot"), (LLM_MODEL, "LLM model"), (LANGUAGE, "Language"), (IMAGES, "Images")]
+
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name="daily_stats")
+    day = models.DateField()
+    metric = models.CharField(max_length=20, choices=METRICS)
+    key = models.CharField(max_length=100, blank=True, default="")
+    count = models.BigIntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "User Daily Stat"
+        verbose_name_plural = "User Daily Stats"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "day", "metric", "key"], name="unique_user_daily_stat"),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.day} {self.metric} {self.key}: {self.count}"
+
+
+class ChatUpload(models.Model):
+    """Model representing a chat being uploaded in chunks.
+
+    The chunks are stored on disk by ``uploads.ChunkStore``, which is also the record of
+    how much was received. ``size`` is the total size declared by the client, if it
+    knew it, and ``encoding`` the ``Content-Encoding`` of the assembled payload.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name="chat_uploads")
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    encoding = models.CharField(max_length=20, default="identity")
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Chat Upload"
+        verbose_name_plural = "Chat Uploads"
+
+    def __str__(self):
+        return f"{self.user} {self.id}"
@@ -0,0 +1,178 @@
+import logging
+import time
+import traceback
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when more queries are executed than the declared budget allows."""
+
+
+class QueryBudget(ContextDecorator):
+    """Record every SQL statement executed inside the block and enforce a maximum count.
+
+    Use it as a context manager or a decorator::
+
+        with QueryBudget(3, name="compose_chat_view"):
+            compose_chat_view(chat)
+
+        @QueryBudget(3)
+        def test_compose_chat_view(): ...
+
+    ``QueryBudgetExceeded`` is raised on exit when the budget is exceeded. The
+    message lists the repeated statements with the stack trace of each execution.
+    """
+
+    def __init__(self, limit: int, name: str | None = None, raise_on_exceed: bool = True):
+        self.limit = limit
+        self.name = name
+        self.raise_on_exceed = raise_on_exceed
+        self.queries = []
+
+    def __enter__(self):
+        self.queries = []
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self._record))
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._stack.close()
+        if exc_type is None and self.exceeded and self.raise_on_exceed:
+            raise QueryBudgetExceeded(self.report())
+        return False
+
+    def __call__(self, func):
+        if self.name is None:
+            self.name = func.__qualname__
+        return super().__call__(func)
+
+    def _record(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stack = traceback.extract_stack()[:-1]
+            self.queries.append((sql, time.perf_counter() - started, _application_frames(stack)))
+
+    @property
+    def exceeded(self) -> bool:
+        return len(self.queries) > self.limit
+
+    def duplicates(self) -> dict[str, list]:
+        """Return the stack traces of every statement that was executed more than once."""
+        counts = Counter(sql for sql, _, _ in self.queries)
+        duplicates = {}
+        for sql, _, stack in self.queries:
+            if counts[sql] > 1:
+                duplicates.setdefault(sql, []).append(stack)
+        return duplicates
+
+    def report(self) -> str:
+        """Describe the executed queries, highlighting duplicates and where they came from."""
+        lines = [f"{self.name or 'Block'} executed {len(self.queries)} queries, budget is {self.limit}."]
+        for sql, stacks in self.duplicates().items():
+            lines.append(f"\n{len(stacks)}x {sql}")
+            for stack in stacks:
+                lines.append("".join(traceback.format_list(stack)).rstrip())
+                lines.append("    --")
+        if not self.duplicates():
+            lines += [f"  {sql}" for sql, _, _ in self.queries]
+        return "\n".join(lines)
+
+
+def _application_frames(stack: traceback.StackSummary) -> traceback.StackSummary:
+    """Drop frames from installed packages and the standard library."""
+    frames = [frame for frame in stack if "site-packages" not in frame.filename and "/lib/python" not in frame.filename]
+    return traceback.StackSummary.from_list(frames or stack[-5:])
+
+
+def with_query_budget(limit):
+    """Declare the query budget of a function-based view for ``QueryBudgetMiddleware``."""
+
+    def decorator(view_func):
+        view_func.query_budget = limit
+        return view_func
+
+    return decorator
+
+
+def get_query_budget(view_func, method: str) -> int | None:
+    """Look up the budget declared for a view.
+
+    Class-based views declare ``query_budget`` as a class attribute, either a single
+    budget or a dict keyed by lowercase HTTP method. DRF viewsets key the dict by action
+    name instead. Function-based views use ``with_query_budget``.
+
+    Args:
+        view_func (Callable): The resolved view function.
+        method (str): The HTTP method of the request.
+
+    Returns:
+        int | None: The budget, or None if the view does not declare one.
+    """
+    view_class = getattr(view_func, "cls", None) or getattr(view_func, "view_class", None)
+    budget = getattr(view_class or view_func, "query_budget", None)
+    if isinstance(budget, dict):
+        actions = getattr(view_func, "actions", None) or {}
+        return budget.get(actions.get(method.lower(), method.lower()))
+    return budget
+
+
+class QueryBudgetMiddleware:
+    """Check every request against the query budget of its view. Only active when DEBUG is on.
+
+    Over-budget requests are logged with their duplicate queries. With
+    ``CHATSNIP_QUERY_BUDGET_STRICT = True`` they raise ``QueryBudgetExceeded`` instead,
+    which makes test client requests fail.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        budget = QueryBudget(limit=0, name=f"{request.method} {request.path}", raise_on_exceed=False)
+        with budget:
+            response = self.get_response(request)
+        self.check(request, budget)
+        return response
+
+    async def __acall__(self, request):
+        # Async views query the database from the sync_to_async thread of the request,
+        # so the budget has to be entered and exited on that thread.
+        budget = QueryBudget(limit=0, name=f"{request.method} {request.path}", raise_on_exceed=False)
+        await sync_to_async(budget.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(budget.__exit__)(None, None, None)
+        self.check(request, budget)
+        return response
+
+    def check(self, request, budget: QueryBudget) -> None:
+        match = request.resolver_match
+        limit = get_query_budget(match.func, request.method) if match else None
+        if limit is None:
+            return
+        budget.limit = limit
+        if budget.exceeded:
+            if getattr(settings, "CHATSNIP_QUERY_BUDGET_STRICT", False):
+                raise QueryBudgetExceeded(budget.report())
+            logger.warning(budget.report())
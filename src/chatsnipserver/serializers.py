@@ -1,15 +1,33 @@
-from rest_framework import serializers
+from rest_framework import exceptions, serializers
 
-from .models import Chat, CodeFragment
+from .models import Chat, ChatUpload, CodeFragment
+from .uploads import PayloadTooLarge, normalize_encoding, upload_max_bytes
 
 
 class ChatSerializer(serializers.ModelSerializer):
     class Meta:
         model = Chat
-        fields = ["unique_identifier", "name", "content"]
+        fields = ["id", "unique_identifier", "name", "timestamp", "json_data", "markdown", "checksum", "chatbot", "llm_model"]
 
 
 class CodeFragmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = CodeFragment
         fields = ["chat", "filename", "programming_language", "source_code"]
+
+
+class ChatUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChatUpload
+        fields = ["id", "size", "encoding"]
+
+    def validate_size(self, value):
+        if value is not None and value > upload_max_bytes():
+            raise PayloadTooLarge()
+        return value
+
+    def validate_encoding(self, value):
+        try:
+            return normalize_encoding(value)
+        except exceptions.UnsupportedMediaType as error:
+            raise serializers.ValidationError(error.detail)
@@ -1,22 +1,42 @@
-import time
+import asyncio
 import hashlib
+import logging
 import os
 import re
 import uuid
+from collections import defaultdict
 from datetime import datetime
-from io import BytesIO
-from typing import IO, List, Tuple
+from tempfile import SpooledTemporaryFile
+from typing import IO, AsyncIterable, Iterable, List, NamedTuple, Tuple
 import json
 import re
 from typing import Optional, Dict
 
 
+import httpx
 import requests
-from django.core.files.base import ContentFile
-
-from .models import Chat, ChatImage, CodeFragment
-
-
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import File
+from django.db import connection, transaction
+from django.db.models import F, Max, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+
+from .filenames import header_filename, name_untitled
+from .images import SNIFF_BYTES, InvalidImage, get_chat_image_attributes, schedule_image_variants, sniff_image, validate_image
+from .instrumentation import instrument, record_download, record_image
+from .models import Chat, ChatImage, CodeFragment, QuarantinedImage
+
+logger = logging.getLogger(__name__)
+
+
+@instrument
 def parse_source_code_fragments(content: str) -> List[Tuple[str, str]]:
     """Parses the content to extract source code fragments based on different detection methods.
 
@@ -116,25 +136,98 @@ def has_duplicate_checksum(
     Returns:
         bool: True if a duplicate checksum is found, False otherwise.
     """
-    new_checksum = generate_checksum(new_fragment[1])
+    # Comparing the normalized text gives the same answer as comparing checksums, without hashing.
+    new_content = _strip_whitespace(new_fragment[1])
     for filename, code in existing_fragments:
-        if filename == new_fragment[0] and generate_checksum(code) == new_checksum:
+        if filename == new_fragment[0] and _strip_whitespace(code) == new_content:
             return True
     return False
 
 
+CHECKSUM_CHUNK_SIZE = 64 * 1024
+IMAGE_DOWNLOAD_TIMEOUT = 30
+# Downloads larger than this are spooled to disk instead of memory.
+IMAGE_SPOOL_SIZE = 1024 * 1024
+
+HIGHLIGHT_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+_json_encoder = json.JSONEncoder()
+
+
+# The characters ``str.split`` treats as whitespace, which checksums ignore.
+_ASCII_WHITESPACE = b"\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f "
+_UNICODE_WHITESPACE = "\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+
+
+def _strip_whitespace(text: str) -> bytes:
+    """Encode text as UTF-8 without whitespace, like ``"".join(text.split()).encode()`` but without the intermediate list and string."""
+    if text.isascii():
+        return text.encode("ascii").translate(None, _ASCII_WHITESPACE)
+    if any(space in text for space in _UNICODE_WHITESPACE):
+        return "".join(text.split()).encode("utf-8")
+    # ASCII bytes never occur inside the multi-byte sequences of other characters.
+    return text.encode("utf-8").translate(None, _ASCII_WHITESPACE)
+
+
+def _hash_normalized_chunks(chunks: Iterable[str]) -> str:
+    """Feed whitespace-free slices of text into a SHA-256 hasher.
+
+    Small chunks, like the tokens of a JSON encoder, are joined and large ones are
+    sliced, so the text is normalized in pieces of about ``CHECKSUM_CHUNK_SIZE``
+    characters. Removing whitespace doesn't depend on the surrounding text, so
+    the digest equals the one of the whole normalized text.
+
+    Args:
+        chunks (Iterable[str]): The pieces of text to hash, in order.
+
+    Returns:
+        str: The hex digest of the normalized text.
+    """
+    hasher = hashlib.sha256()
+    pending, size = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= CHECKSUM_CHUNK_SIZE:
+            text, pending, size = "".join(pending), [], 0
+            for start in range(0, len(text), CHECKSUM_CHUNK_SIZE):
+                hasher.update(_strip_whitespace(text[start : start + CHECKSUM_CHUNK_SIZE]))
+    hasher.update(_strip_whitespace("".join(pending)))
+    return hasher.hexdigest()
+
+
 def generate_checksum(content: str) -> str:
     """
     Generate a SHA-256 checksum for the given content.
 
+    Whitespace is ignored. The content is normalized and hashed in fixed-size
+    slices instead of building a full whitespace-stripped copy first, with the
+    whitespace of ASCII text removed from its encoded bytes.
+
     Args:
         content (str): The content to generate the checksum for.
 
     Returns:
         str: The generated checksum.
     """
-    normalized_content = "".join(content.split())
-    return hashlib.sha256(normalized_content.encode("utf-8")).hexdigest()
+    return _hash_normalized_chunks((content,))
+
+
+def generate_json_checksum(data) -> str:
+    """
+    Generate a SHA-256 checksum for JSON-serializable data.
+
+    The data is hashed while it is being encoded, so the full JSON document is
+    never materialized. The result equals ``generate_checksum(json.dumps(data))``,
+    keeping stored chat checksums valid.
+
+    Args:
+        data: The JSON-serializable data to generate the checksum for.
+
+    Returns:
+        str: The generated checksum.
+    """
+    return _hash_normalized_chunks(_json_encoder.iterencode(data))
 
 
 def identify_language(content: str) -> str:
@@ -151,7 +244,7 @@ def identify_language(content: str) -> str:
     return "python"
 
 
-def get_or_create_chat(identifier: str, name: str, user) -> Chat:
+def get_or_create_chat(identifier: str, name: str, user, defaults: dict | None = None) -> Chat:
     """
     Get or create a chat with the given identifier.
 
@@ -159,19 +252,82 @@ def get_or_create_chat(identifier: str, name: str, user) -> Chat:
         identifier (str): The unique identifier of the chat.
         name (str): The name of the chat.
         user (User): The user associated with the chat.
+        defaults (dict, optional): Additional field values to set on the chat.
 
     Returns:
         Chat: The retrieved or newly created chat.
     """
+    defaults = {"name": name, **(defaults or {})}
     chat, created = Chat.objects.get_or_create(
-        unique_identifier=identifier, defaults={"name": name, "user": user}
+        unique_identifier=identifier, defaults={"user": user, **defaults}
     )
     if not created:
-        chat.name = name
-        chat.save()
+        for field, value in defaults.items():
+            setattr(chat, field, value)
+        chat.save(update_fields=[*defaults, "timestamp"])
     return chat
 
 
+# The number of recent files in a chat that an untitled code block is compared with.
+MAX_SIMILARITY_CANDIDATES = 50
+
+
+def similarity_candidates(chat: Chat, language: str) -> dict[str, str]:
+    """
+    Get the selected source code of the most recent files of a chat in a language, to match untitled code blocks with.
+
+    Args:
+        chat (Chat): The chat object.
+        language (str): The programming language.
+
+    Returns:
+        dict[str, str]: The source code by filename.
+    """
+    if not chat.pk:
+        return {}
+    fragments = selected_code_fragments(chat).filter(programming_language=language)
+    return dict(fragments.values_list("filename", "source_code")[:MAX_SIMILARITY_CANDIDATES])
+
+
+def build_code_fragment(
+    chat: Chat, filename: str, content: str, language: str = "", candidates: dict[str, str] | None = None
+) -> CodeFragment:
+    """
+    Build an unsaved code fragment, with its content cleaned and its checksum set.
+
+    A code fragment without a filename is named by its filename comment. Failing
+    that, it joins the most similar file of the chat in the same language, or is
+    named after its first definition or its checksum.
+
+    Args:
+        chat (Chat): The chat object.
+        filename (str): The filename of the code fragment.
+        content (str): The content of the code fragment.
+        language (str, optional): The programming language of the code fragment. Identified from the content if empty.
+        candidates (dict[str, str], optional): The files to match an untitled fragment with, as returned
+            by ``similarity_candidates``. Loaded from the database if needed and not given.
+
+    Returns:
+        CodeFragment: The unsaved code fragment.
+    """
+    if not language:
+        language = identify_language(content)
+
+    if not filename:
+        filename = header_filename(content)
+
+    code_fragment = CodeFragment(
+        chat=chat, filename=filename, programming_language=language, source_code=content
+    )
+    code_fragment.prepare_content()
+    if not code_fragment.filename:
+        if candidates is None:
+            candidates = similarity_candidates(chat, language)
+        code_fragment.filename = name_untitled(code_fragment.source_code, code_fragment.checksum, language, candidates)
+    return code_fragment
+
+
+@instrument
 def save_code_fragment(
     chat: Chat, filename: str, content: str, language: str = ""
 ) -> CodeFragment | None:
@@ -190,37 +346,120 @@ def save_code_fragment(
     if check_duplicate_code_fragment(chat, content, filename):
         return
 
-    if not language:
-        language = identify_language(content)
+    code_fragment = build_code_fragment(chat, filename, content, language)
+    code_fragment.save()
+    return code_fragment
 
-    language_file_extension_mapping = {
-        "python": ".py",
-        "javascript": ".js",
-        "java": ".java",
-        "c++": ".cpp",
-        "c#": ".cs",
-        "kotlin": ".kt",
-        "go": ".go",
-        "rust": ".rs",
-        "php": ".php",
-        "swift": ".swift",
-        "c": ".c",
-        'json': '.json',
-        'html': '.html',
-        'css': '.css',
-        'xml': '.xml',
-    }
 
-    if not filename:
-        filename = f"untitled_{int(time.time())}{language_file_extension_mapping.get(language)}"
+@instrument
+def build_new_code_fragments(chat: Chat, code_samples: Iterable[dict]) -> list[CodeFragment]:
+    """
+    Build the code fragments of a chat that are not duplicates, for saving in bulk.
 
-    code_fragment = CodeFragment(
-        chat=chat, filename=filename, programming_language=language, source_code=content
+    Applies the duplicate check of ``save_code_fragment`` to every sample, but loads the
+    checksums of the existing fragments with a single query. Samples repeated in
+    ``code_samples`` are only built once, and the files that untitled samples are
+    matched with are loaded at most once per language.
+
+    Args:
+        chat (Chat): The chat object. May be unsaved, in which case it has no existing fragments.
+        code_samples (Iterable[dict]): The code elements of the chat content, with ``filename``, ``content`` and ``language``.
+
+    Returns:
+        list[CodeFragment]: The unsaved code fragments.
+    """
+    existing = defaultdict(set)
+    if chat.pk:
+        for filename, checksum in chat.code_fragments.values_list("filename", "checksum"):
+            existing[filename].add(checksum)
+
+    candidates, built = {}, defaultdict(dict)
+    fragments = []
+    for code_sample in code_samples:
+        filename, content = code_sample.get("filename"), code_sample.get("content")
+        checksum = generate_checksum(content)
+        # Like check_duplicate_code_fragment, compare with every fragment when none has the filename.
+        if filename and existing.get(filename):
+            duplicate = checksum in existing[filename]
+        else:
+            duplicate = any(checksum in checksums for checksums in existing.values())
+        if duplicate:
+            continue
+        language = code_sample.get("language") or identify_language(content)
+        # Untitled samples are matched with the files of the chat, including the ones built here.
+        if not filename and language not in candidates and not header_filename(content):
+            candidates[language] = {**similarity_candidates(chat, language), **built[language]}
+        fragment = build_code_fragment(chat, filename, content, language, candidates.get(language, {}))
+        existing[fragment.filename].add(fragment.checksum)
+        built[language][fragment.filename] = fragment.source_code
+        if language in candidates:
+            candidates[language][fragment.filename] = fragment.source_code
+        fragments.append(fragment)
+    return fragments
+
+
+# The names given to code fragments without a filename before they were inferred.
+LEGACY_UNTITLED_PATTERN = r"^untitled_[0-9]{10}"
+
+
+@transaction.atomic
+def rename_untitled_fragments(chats) -> int:
+    """
+    Name the code fragments that were saved as ``untitled_<time>`` like new code fragments are named.
+
+    The fragments of every chat are visited in the order they were added, so an
+    untitled fragment can join a file that was named before it. Chats with renamed
+    fragments are touched, so cached renderings are revalidated.
+
+    Args:
+        chats (QuerySet): The chats.
+
+    Returns:
+        int: The number of renamed code fragments.
+    """
+    renamed = []
+    for chat in chats.filter(code_fragments__filename__regex=LEGACY_UNTITLED_PATTERN).distinct().only("pk"):
+        candidates = defaultdict(dict)
+        for fragment in chat.code_fragments.order_by("timestamp", "id").only("id", "chat_id", "filename", "programming_language", "source_code", "checksum"):
+            if re.match(LEGACY_UNTITLED_PATTERN, fragment.filename or ""):
+                language = fragment.programming_language
+                fragment.filename = header_filename(fragment.source_code) or name_untitled(
+                    fragment.source_code, fragment.checksum, language, candidates[language]
+                )
+                renamed.append(fragment)
+            candidates[fragment.programming_language][fragment.filename] = fragment.source_code
+    CodeFragment.objects.bulk_update(renamed, ["filename"], batch_size=500)
+    Chat.objects.filter(pk__in={fragment.chat_id for fragment in renamed}).update(timestamp=timezone.now())
+    return len(renamed)
+
+
+def selected_code_fragments(chat: Chat):
+    """
+    Select one code fragment per filename in the database.
+
+    A fragment marked as selected wins, otherwise the most recent one. Files are
+    ordered by their most recent fragment, newest first.
+
+    Args:
+        chat (Chat): The chat object.
+
+    Returns:
+        QuerySet: The selected code fragment of every file in the chat.
+    """
+    by_filename = {"partition_by": F("filename")}
+    return (
+        chat.code_fragments.annotate(
+            version_rank=Window(
+                RowNumber(), order_by=[F("selected").desc(), F("timestamp").desc(), F("id").desc()], **by_filename
+            ),
+            latest_timestamp=Window(Max("timestamp"), **by_filename),
+        )
+        .filter(version_rank=1)
+        .order_by("-latest_timestamp", "filename")
     )
-    code_fragment.save()
-    return code_fragment
 
 
+@instrument
 def compose_chat_view(chat: Chat) -> dict:
     """
     Compose a view of the chat including the selected code fragments.
@@ -229,39 +468,124 @@ def compose_chat_view(chat: Chat) -> dict:
         chat (Chat): The chat object.
 
     Returns:
-        dict: The context for the chat view including selected code fragments.
+        dict: The context for the chat view including selected code fragments and the
+        attributes of the chat images.
     """
-    fragments = chat.code_fragments.all()
-    grouped_fragments = {}
-    for fragment in fragments:
-        if fragment.filename not in grouped_fragments:
-            grouped_fragments[fragment.filename] = []
-        grouped_fragments[fragment.filename].append(fragment)
-
-    selected_fragments = {
-        filename: max(group, key=lambda x: x.selected or x.timestamp)
-        for filename, group in grouped_fragments.items()
-    }
-    return {"chat": chat, "selected_fragments": selected_fragments}
+    selected_fragments = {fragment.filename: fragment for fragment in selected_code_fragments(chat)}
+    return {"chat": chat, "selected_fragments": selected_fragments, "image_attributes": get_chat_image_attributes(chat)}
 
 
+@instrument
 def compose_source_code_view(chat: Chat) -> dict:
     """
     Compose a view of the source code with tabs for different versions.
 
+    Only the metadata of each version is loaded, except for the selected version
+    of every file. Other versions are fetched when their tab is opened.
+
     Args:
         chat (Chat): The chat object.
 
     Returns:
-        dict: The context for the source code view including grouped code fragments.
+        dict: The context for the source code view including grouped code fragments
+        and the ids of the selected versions.
     """
-    fragments = chat.code_fragments.all()
+    selected_fragments = {fragment.id: fragment for fragment in selected_code_fragments(chat)}
     grouped_fragments = {}
-    for fragment in fragments:
+    for fragment in chat.code_fragments.defer("source_code"):
         if fragment.filename not in grouped_fragments:
             grouped_fragments[fragment.filename] = []
-        grouped_fragments[fragment.filename].append(fragment)
-    return {"chat": chat, "grouped_fragments": grouped_fragments}
+        grouped_fragments[fragment.filename].append(selected_fragments.get(fragment.id, fragment))
+    return {"chat": chat, "grouped_fragments": grouped_fragments, "selected_fragment_ids": set(selected_fragments)}
+
+
+def compose_project_state_view(chat: Chat, message: int) -> dict:
+    """
+    Reconstruct the files of a chat as they were after one of its messages.
+
+    Messages are the text elements of the chat content, and code blocks belong to the
+    message before them. The latest version of every file up to the message wins, and
+    files are listed in the order they first appeared.
+    Code blocks are matched with their code fragments by checksum, which needs a
+    single query for the metadata of the fragments.
+
+    Args:
+        chat (Chat): The chat object.
+        message (int): The number of the message, starting at 1. Clamped to the messages of the chat.
+
+    Returns:
+        dict: The context for the project state, with the ``files`` as dicts of ``filename``,
+        ``language``, ``source_code`` and ``fragment_id``, the ``message`` and the number of ``messages``.
+    """
+    elements = [element for element in chat.json_data or [] if isinstance(element, dict)]
+    messages = sum(1 for element in elements if "language" not in element and "src" not in element)
+    message = max(1, min(message, messages))
+
+    fragments = {}
+    for fragment_id, filename, checksum in chat.code_fragments.order_by("timestamp", "id").values_list("id", "filename", "checksum"):
+        fragments[filename, checksum] = fragments[None, checksum] = (fragment_id, filename)
+
+    files, seen = {}, 0
+    for element in elements:
+        if "language" not in element and "src" not in element:
+            seen += 1
+            if seen > message:
+                break
+            continue
+        if "language" not in element:
+            continue
+        source_code = clean_content(element.get("content", ""), chat, element.get("filename"), element["language"])
+        checksum = generate_checksum(source_code)
+        fragment_id, filename = fragments.get((element.get("filename"), checksum)) or fragments.get((None, checksum)) or (None, None)
+        filename = filename or element.get("filename") or "untitled"
+        files[filename] = {"filename": filename, "language": element["language"], "source_code": source_code, "fragment_id": fragment_id}
+    return {"chat": chat, "files": list(files.values()), "message": message, "messages": messages}
+
+
+def highlight_source_code(source_code: str, language: str | None) -> str:
+    """
+    Syntax highlight source code as HTML using Pygments.
+
+    Args:
+        source_code (str): The source code to highlight.
+        language (str): The programming language of the code. Unknown languages are rendered as plain text.
+
+    Returns:
+        str: The highlighted HTML.
+    """
+    try:
+        lexer = get_lexer_by_name(language or "text")
+    except ClassNotFound:
+        lexer = get_lexer_by_name("text")
+    return highlight(source_code, lexer, HtmlFormatter())
+
+
+def get_highlighted_fragment(fragment_id: int, user) -> str | None:
+    """
+    Get the highlighted HTML of a code fragment, cached by its checksum.
+
+    The source code is only loaded from the database when the HTML is not cached.
+    The fragment id is part of the cache key because the checksum ignores whitespace.
+
+    Args:
+        fragment_id (int): The id of the code fragment.
+        user (User): The user owning the chat of the fragment.
+
+    Returns:
+        str | None: The highlighted HTML, or None if the user has no such fragment.
+    """
+    fragment = (
+        CodeFragment.objects.filter(pk=fragment_id, chat__user=user)
+        .only("id", "checksum", "programming_language")
+        .first()
+    )
+    if fragment is None:
+        return None
+    cache_key = f"chatsnip:highlight:{fragment.id}:{fragment.checksum}:{fragment.programming_language}"
+    if (html := cache.get(cache_key)) is None:
+        html = highlight_source_code(fragment.source_code, fragment.programming_language)
+        cache.set(cache_key, html, HIGHLIGHT_CACHE_TIMEOUT)
+    return html
 
 
 def check_duplicate_chat_content(chat: Chat, new_content: str) -> bool:
@@ -279,6 +603,7 @@ def check_duplicate_chat_content(chat: Chat, new_content: str) -> bool:
     return chat.checksum == new_checksum
 
 
+@instrument
 def check_duplicate_code_fragment(chat: Chat, new_content: str, filename: str | None = None ) -> bool:
     """
     Check if the new content is a duplicate of an existing code fragment within the chat.
@@ -325,50 +650,316 @@ def get_unique_filename(filename, file_extension=None):
 
 
 def detect_image_type(file: IO) -> str | None:
-    header = file.read(16)
-    if header.startswith(b"\xff\xd8"):
-        return ".jpg"
-    elif header.startswith(b"\x89PNG\r\n\x1a\n"):
-        return ".png"
-    elif header.startswith(b"GIF87a") or header.startswith(b"GIF89a"):
-        return ".gif"
-    elif header[:4] == b"RIFF" and header[8:12] == b"WEBP":
-        return ".webp"
-    elif header[:4] == b"\x00\x00\x00\x00" and header[4:8] == b"ftyp":
-        if header[8:12] in [b"avif"]:
-            return ".avif"
+    """Return the file extension of an image, based on its header."""
+    info = sniff_image(file.read(SNIFF_BYTES))
+    return info.extension if info else None
+
+
+class KnownImages(NamedTuple):
+    """The source URLs and checksums of the images of a chat that must not be downloaded or saved again."""
+
+    existing: frozenset = frozenset()
+    blacklisted: frozenset = frozenset()
+    quarantined: frozenset = frozenset()
+    checksums: frozenset = frozenset()
+
+
+def known_images(chat, image_urls: Iterable[str]) -> KnownImages:
+    """
+    Look up which of the images of a chat are already saved, blacklisted or quarantined, with one query each.
+
+    Args:
+        chat (Chat): The chat object, which may be unsaved.
+        image_urls (Iterable[str]): The source URLs of the images to download.
+
+    Returns:
+        KnownImages: The known source URLs, and the checksums of the images the chat has.
+    """
+    urls = {url for url in image_urls if url}
+    if not urls:
+        return KnownImages()
+    blacklisted = frozenset(ChatImage.objects.filter(source_url__in=urls, blacklisted=True).values_list("source_url", flat=True))
+    if not chat.pk:
+        return KnownImages(blacklisted=blacklisted)
+    existing, checksums = set(), set()
+    for source_url, checksum in ChatImage.objects.filter(chat=chat).values_list("source_url", "checksum"):
+        existing.add(source_url)
+        checksums.add(checksum)
+    quarantined = QuarantinedImage.objects.filter(chat=chat, source_url__in=urls).values_list("source_url", flat=True)
+    return KnownImages(frozenset(existing & urls), blacklisted, frozenset(quarantined), frozenset(checksums))
+
+
+@instrument
+def download_image(chat, image_url, title=None, description=None, known: KnownImages | None = None) -> dict:
+    """
+    Download an image and write it to the image storage, without saving it to the database.
+
+    The chat may be unsaved, as in a chat that is being ingested. The result holds an unsaved
+    ``ChatImage`` under ``image``, or an unsaved ``QuarantinedImage`` under ``quarantined``.
+    Save them with ``save_downloaded_image``, or delete their files with ``discard_downloaded_images``.
+
+    Args:
+        chat (Chat): The chat object.
+        image_url (str): The URL of the image.
+        title (str, optional): The title of the image.
+        description (str, optional): The description of the image.
+        known (KnownImages, optional): The known images of the chat. Looked up for this image if not given.
+
+    Returns:
+        dict: The status and message of the download, and the staged image if it succeeded.
+    """
+    known = known_images(chat, [image_url]) if known is None else known
+    if skipped := _check_image_download(known, image_url):
+        return skipped
+
+    try:
+        with requests.get(image_url, stream=True, timeout=IMAGE_DOWNLOAD_TIMEOUT) as response:
+            if response.status_code != 200:
+                return {
+                    "status": False, "message": "Failed to download image",
+                    "Status code": f"{response.status_code}",
+                }
+            with SpooledTemporaryFile(max_size=IMAGE_SPOOL_SIZE) as spool:
+                checksum = _download_to(response.iter_content(chunk_size=CHECKSUM_CHUNK_SIZE), spool)
+                if checksum is None:
+                    return {"status": False, "message": "Image is too large"}
+                return _stage_downloaded_image(chat, known, image_url, response.headers.get("Content-Type", ""), File(spool), checksum, title, description)
+    except requests.RequestException as error:
+        logger.warning("Downloading image %s failed: %s", image_url, error)
+        return {"status": False, "message": "Failed to download image"}
+
+
+def download_images(chat, images: list[dict], known: KnownImages | None = None) -> list[dict]:
+    """
+    Download the images of a chat one after another with ``download_image``.
+
+    If a download fails with an exception, the files staged so far are deleted.
+
+    Args:
+        chat (Chat): The chat object.
+        images (list[dict]): The image elements of the chat content, with ``src`` and ``content``.
+        known (KnownImages, optional): The known images of the chat. Looked up for all images at once if not given.
+
+    Returns:
+        list[dict]: The result of every download, in the order of ``images``.
+    """
+    known = known_images(chat, [image.get("src") for image in images]) if known is None else known
+    results = []
+    try:
+        for image in images:
+            results.append(download_image(chat, image.get("src"), title=None, description=image.get("content"), known=known))
+    except BaseException:
+        discard_downloaded_images(results)
+        raise
+    return results
 
 
 def download_and_save_image(chat, image_url, title=None, description=None) -> dict:
-    if ChatImage.objects.filter(chat=chat, source_url=image_url).exists():
+    """Download an image and save it to a saved chat."""
+    return save_downloaded_image(download_image(chat, image_url, title=title, description=description))
+
+
+def save_downloaded_image(result: dict) -> dict:
+    """
+    Save the image or quarantine record staged by ``download_image``.
+
+    Args:
+        result (dict): The result of ``download_image``. Its chat must be saved.
+
+    Returns:
+        dict: The result.
+    """
+    if quarantined := result.get("quarantined"):
+        quarantined.save()
+    elif chat_image := result.get("image"):
+        chat_image.save()
+        record_image()
+        schedule_image_variants(chat_image)
+    return result
+
+
+def save_downloaded_images(results: list[dict]) -> list[dict]:
+    """
+    Save the images and quarantine records staged by ``download_image`` for one chat, with one query for each kind.
+
+    Args:
+        results (list[dict]): The results of ``download_image``. Their chat must be saved.
+
+    Returns:
+        list[dict]: The results.
+    """
+    if not connection.features.can_return_rows_from_bulk_insert:
+        # The variants of the images are generated by primary key.
+        return [save_downloaded_image(result) for result in results]
+    if quarantined := [result["quarantined"] for result in results if result.get("quarantined")]:
+        QuarantinedImage.objects.bulk_create(quarantined)
+    if chat_images := [result["image"] for result in results if result.get("image") and not result.get("quarantined")]:
+        ChatImage.objects.bulk_create(chat_images)
+        for chat_image in chat_images:
+            record_image()
+            schedule_image_variants(chat_image)
+    return results
+
+
+def discard_downloaded_images(results: Iterable[dict]) -> None:
+    """Delete the files staged by ``download_image`` whose records were not saved."""
+    for result in results:
+        staged = result.get("image") or result.get("quarantined")
+        if staged is None:
+            continue
+        field_file = staged.file if isinstance(staged, QuarantinedImage) else staged.image
+        try:
+            field_file.storage.delete(field_file.name)
+        except Exception:
+            logger.exception("Deleting staged image file %s failed", field_file.name)
+
+
+@instrument
+async def adownload_image(chat, image_url, client, title=None, description=None, known: KnownImages | None = None) -> dict:
+    """
+    Async version of ``download_image``, downloading with an async HTTP client.
+
+    Only the download runs on the event loop. The checks, validation and storage writes
+    run in the sync thread of the request.
+
+    Args:
+        chat (Chat): The chat object.
+        image_url (str): The URL of the image.
+        client (httpx.AsyncClient): The client to download with.
+        title (str, optional): The title of the image.
+        description (str, optional): The description of the image.
+        known (KnownImages, optional): The known images of the chat. Looked up for this image if not given.
+
+    Returns:
+        dict: The status and message of the download, and the staged image if it succeeded.
+    """
+    if known is None:
+        known = await sync_to_async(known_images)(chat, [image_url])
+    if skipped := _check_image_download(known, image_url):
+        return skipped
+
+    try:
+        async with client.stream("GET", image_url) as response:
+            if response.status_code != 200:
+                return {
+                    "status": False, "message": "Failed to download image",
+                    "Status code": f"{response.status_code}",
+                }
+            with SpooledTemporaryFile(max_size=IMAGE_SPOOL_SIZE) as spool:
+                checksum = await _adownload_to(response.aiter_bytes(CHECKSUM_CHUNK_SIZE), spool)
+                if checksum is None:
+                    return {"status": False, "message": "Image is too large"}
+                return await sync_to_async(_stage_downloaded_image)(
+                    chat, known, image_url, response.headers.get("Content-Type", ""), File(spool), checksum, title, description
+                )
+    except httpx.HTTPError as error:
+        logger.warning("Downloading image %s failed: %s", image_url, error)
+        return {"status": False, "message": "Failed to download image"}
+
+
+async def adownload_images(chat, images: list[dict], known: KnownImages | None = None) -> list[dict]:
+    """
+    Download the images of a chat concurrently with ``adownload_image``.
+
+    At most ``CHATSNIP_IMAGE_DOWNLOAD_CONCURRENCY`` (default 4) downloads run at the same time.
+    If a download fails with an exception, the files staged by the others are deleted.
+
+    Args:
+        chat (Chat): The chat object.
+        images (list[dict]): The image elements of the chat content, with ``src`` and ``content``.
+        known (KnownImages, optional): The known images of the chat. Looked up for all images at once if not given.
+
+    Returns:
+        list[dict]: The result of every download, in the order of ``images``.
+    """
+    if known is None:
+        known = await sync_to_async(known_images)(chat, [image.get("src") for image in images])
+    limit = asyncio.Semaphore(getattr(settings, "CHATSNIP_IMAGE_DOWNLOAD_CONCURRENCY", 4))
+
+    async def download(client, image):
+        async with limit:
+            return await adownload_image(chat, image.get("src"), client, title=None, description=image.get("content"), known=known)
+
+    async with httpx.AsyncClient(timeout=IMAGE_DOWNLOAD_TIMEOUT, follow_redirects=True) as client:
+        results = await asyncio.gather(*(download(client, image) for image in images), return_exceptions=True)
+    if errors := [result for result in results if isinstance(result, BaseException)]:
+        await sync_to_async(discard_downloaded_images)([result for result in results if isinstance(result, dict)])
+        raise errors[0]
+    return results
+
+
+def _check_image_download(known: KnownImages, image_url) -> dict | None:
+    """Return the result for an image that must not be downloaded, or None."""
+    if image_url in known.existing:
         return {"status": False, "message": "Image already exists", }
 
-    if ChatImage.objects.filter(source_url=image_url, blacklisted=True).exists():
+    if image_url in known.blacklisted:
         return {"status": False, "message": "Image is blacklisted"}
 
-    response = requests.get(image_url)
-    if response.status_code == 200:
-        checksum = ChatImage.checksum_from_content(response.content)
-        if ChatImage.exists_with_checksum(chat, checksum):
-            return {"status": False, "message": "Image with same checksum already exists"}
+    if image_url in known.quarantined:
+        return {"status": False, "message": "Image is quarantined"}
+    return None
 
-        image_name = os.path.basename(image_url)
-        file_extension = detect_image_type(BytesIO(response.content))
-        unique_image_name = get_unique_filename(image_name, file_extension)
 
-        chat_image = ChatImage(
-            chat=chat, source_url=image_url, title=title, description=description
-        )
+def _download_to(chunks: Iterable[bytes], file: IO) -> str | None:
+    """Write a download into ``file`` and return the sha256 of its content, or None if it exceeds ``CHATSNIP_IMAGE_MAX_BYTES``."""
+    hasher, size, max_bytes = hashlib.sha256(), 0, _max_image_bytes()
+    for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            return None
+        hasher.update(chunk)
+        file.write(chunk)
+    return _finish_download(file, hasher, size)
 
-        chat_image.image.save(
-            unique_image_name, ContentFile(response.content), save=True
+
+async def _adownload_to(chunks: AsyncIterable[bytes], file: IO) -> str | None:
+    """Async version of ``_download_to``."""
+    hasher, size, max_bytes = hashlib.sha256(), 0, _max_image_bytes()
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            return None
+        hasher.update(chunk)
+        file.write(chunk)
+    return _finish_download(file, hasher, size)
+
+
+def _max_image_bytes() -> int:
+    return getattr(settings, "CHATSNIP_IMAGE_MAX_BYTES", 50 * 1024 * 1024)
+
+
+def _finish_download(file: IO, hasher, size: int) -> str:
+    record_download(size)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def _stage_downloaded_image(chat, known: KnownImages, image_url, content_type: str, file: File, checksum: str, title=None, description=None) -> dict:
+    if checksum in known.checksums:
+        return {"status": False, "message": "Image with same checksum already exists"}
+
+    try:
+        info = validate_image(file)
+    except InvalidImage as error:
+        quarantined = QuarantinedImage(
+            chat=chat, source_url=image_url, reason=str(error), content_type=content_type[:100], checksum=checksum
         )
-        return {"status": True, "message": "Image downloaded", "image": chat_image}
-    else:
-        return {
-            "status": False, "message": "Failed to download image",
-            "Status code": f"{response.status_code}",
-        }
+        quarantined.file.save("quarantined.bin", file, save=False)
+        logger.warning("Quarantined image %s: %s", image_url, error)
+        return {"status": False, "message": f"Image quarantined: {error}", "quarantined": quarantined}
+
+    image_name = os.path.basename(image_url)
+    unique_image_name = get_unique_filename(image_name, info.extension)
+
+    chat_image = ChatImage(
+        chat=chat, source_url=image_url, title=title, description=description,
+        checksum=checksum, width=info.width, height=info.height, size=file.size,
+    )
+
+    chat_image.image.save(unique_image_name, file, save=False)
+    return {"status": True, "message": "Image downloaded", "image": chat_image}
+
 
 def detect_language(json_file: str, source_code: str) -> Optional[str]:
     """Detect the programming language of a given source code.
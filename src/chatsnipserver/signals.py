@@ -1,8 +1,17 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
 
-from .models import ChatSnipProfile
+from .authentication import api_key_cache
+from .database import configure_sqlite
+from .models import Chat, ChatSnipProfile, ChatUpload, TaggedChat
+from .stats import StatChanges, chat_day, record_stats, release_chat_stats
+from .tags import adjust_tag_counts
+from .uploads import ChunkStore
+
+connection_created.connect(configure_sqlite, dispatch_uid="chatsnipserver.configure_sqlite")
 
 
 @receiver(post_save, sender=get_user_model())
@@ -14,3 +23,57 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
             ChatSnipProfile.objects.create(user=instance)
         else:
             instance.chatsnipprofile.save()
+
+
+@receiver(post_save, sender=ChatSnipProfile)
+@receiver(post_delete, sender=ChatSnipProfile)
+def invalidate_profile_api_key(sender, instance, **kwargs):
+    """Drop the cached owner of the API key, so a new key or user takes effect in this process right away."""
+    api_key_cache.invalidate(instance.api_key_hash)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_api_keys(sender, instance, **kwargs):
+    """Drop the cached API keys of a user, so a deactivated or deleted user is refused right away."""
+    api_key_cache.invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=TaggedChat)
+def update_tag_counts(sender, instance, action, pk_set, **kwargs):
+    """Keep the tag counts of the chat owner in step with the tags of the chat."""
+    if action == "pre_clear":
+        instance._cleared_tag_ids = set(instance.tagged_items.values_list("tag_id", flat=True))
+        return
+    if action == "post_clear":
+        pk_set = instance.__dict__.pop("_cleared_tag_ids", None)
+    elif action not in ("post_add", "post_remove"):
+        return
+    if not pk_set:
+        return
+    adjust_tag_counts(instance.user_id, pk_set, -1 if action != "post_add" else 1)
+    # The tag cloud is part of the chat list, whose ETag follows the chat timestamps.
+    Chat.objects.filter(pk=instance.pk).update(timestamp=timezone.now())
+
+
+@receiver(pre_delete, sender=Chat)
+def release_tag_counts(sender, instance, **kwargs):
+    adjust_tag_counts(instance.user_id, instance.tagged_items.values_list("tag_id", flat=True), -1)
+
+
+@receiver(post_save, sender=Chat)
+def record_daily_stats(sender, instance, created, raw=False, **kwargs):
+    """Count a new chat in the daily statistics of its owner, however it was created."""
+    if created and not raw:
+        record_stats(instance.user_id, StatChanges().add_chat(instance), chat_day(instance))
+
+
+@receiver(pre_delete, sender=Chat)
+def release_daily_stats(sender, instance, **kwargs):
+    release_chat_stats(instance)
+
+
+@receiver(post_delete, sender=ChatUpload)
+def delete_upload_chunks(sender, instance, **kwargs):
+    """Remove the chunks of an upload from disk with the upload."""
+    ChunkStore(instance.pk).delete()
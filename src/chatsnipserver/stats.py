@@ -0,0 +1,195 @@
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Chat, ChatImage, CodeFragment, UserDailyStat
+
+DEFAULT_ACTIVITY_DAYS = 90
+KEY_LENGTH = UserDailyStat._meta.get_field("key").max_length
+
+
+class StatChanges(dict):
+    """The changes of the statistics of a user, as ``(metric, key) -> (count, size)``."""
+
+    def add(self, metric: str, key: str | None = "", count: int = 1, size: int = 0) -> "StatChanges":
+        key = (key or "")[:KEY_LENGTH]
+        old_count, old_size = self.get((metric, key), (0, 0))
+        self[metric, key] = (old_count + count, old_size + size)
+        return self
+
+    def add_chat(self, chat: Chat, sign: int = 1) -> "StatChanges":
+        """Count a chat by its chatbot and LLM model."""
+        return self.add(UserDailyStat.CHATBOT, chat.chatbot, sign).add(UserDailyStat.LLM_MODEL, chat.llm_model, sign)
+
+
+def record_stats(user_id: int, changes: StatChanges, day: datetime.date | None = None) -> None:
+    """
+    Add changes to the statistics of a user on a day, with two queries.
+
+    Missing rows are created at zero first, so concurrent updates only ever
+    increment or decrement a row.
+
+    Args:
+        user_id (int): The id of the user.
+        changes (StatChanges): The changes.
+        day (date, optional): The day. Defaults to today.
+    """
+    changes = {metric_key: change for metric_key, change in changes.items() if any(change)}
+    if not changes:
+        return
+    day = day or timezone.localdate()
+    UserDailyStat.objects.bulk_create([UserDailyStat(user_id=user_id, day=day, metric=metric, key=key) for metric, key in changes], ignore_conflicts=True)
+
+    def delta(index):
+        return Case(*(When(metric=metric, key=key, then=Value(change[index])) for (metric, key), change in changes.items()), default=Value(0))
+
+    rows = Q()
+    for metric, key in changes:
+        rows |= Q(metric=metric, key=key)
+    UserDailyStat.objects.filter(rows, user_id=user_id, day=day).update(count=F("count") + delta(0), size=F("size") + delta(1))
+
+
+def chat_day(chat: Chat) -> datetime.date:
+    """The day a chat is counted on in the statistics, the day it was created."""
+    return timezone.localdate(chat.created)
+
+
+def release_chat_stats(chat: Chat) -> None:
+    """Subtract a chat that is about to be deleted, with its code fragments and images, from the statistics of its owner."""
+    changes = StatChanges().add_chat(chat, -1)
+    for language, count in CodeFragment.objects.filter(chat=chat).values_list("programming_language").annotate(Count("id")).order_by():
+        changes.add(UserDailyStat.LANGUAGE, language, -count)
+    images = ChatImage.objects.filter(chat=chat).aggregate(images=Count("id"), size=Sum("size"))
+    changes.add(UserDailyStat.IMAGES, "", -images["images"], -(images["size"] or 0))
+    record_stats(chat.user_id, changes)
+
+
+def fill_image_sizes(queryset=None) -> int:
+    """
+    Store the file size of chat images saved before sizes were recorded.
+
+    Args:
+        queryset (QuerySet, optional): The images to look at. Defaults to all images.
+
+    Returns:
+        int: The number of images updated.
+    """
+    queryset = ChatImage.objects.all() if queryset is None else queryset
+    updated = 0
+    for chat_image in queryset.filter(size__isnull=True).only("pk", "image").iterator():
+        try:
+            size = chat_image.image.size
+        except (OSError, ValueError):
+            continue
+        updated += ChatImage.objects.filter(pk=chat_image.pk).update(size=size)
+    return updated
+
+
+@transaction.atomic
+def rebuild_stats(user=None) -> int:
+    """
+    Recompute the daily statistics from the chats, code fragments and images.
+
+    Like the incremental updates, chats are counted on the day they were created,
+    and code fragments and images on the day they were added.
+
+    Args:
+        user (User, optional): Only rebuild the statistics of this user. Defaults to every user.
+
+    Returns:
+        int: The number of rows written.
+    """
+    chats = Chat.objects.all()
+    fragments = CodeFragment.objects.all()
+    images = ChatImage.objects.all()
+    stats = UserDailyStat.objects.all()
+    if user is not None:
+        chats, fragments, images, stats = chats.filter(user=user), fragments.filter(chat__user=user), images.filter(chat__user=user), stats.filter(user=user)
+
+    rows = defaultdict(StatChanges)
+    for metric in (UserDailyStat.CHATBOT, UserDailyStat.LLM_MODEL):
+        for user_id, day, key, count in chats.values_list("user_id", TruncDate("created"), metric).annotate(Count("id")).order_by():
+            rows[user_id, day].add(metric, key, count)
+    for user_id, day, key, count in fragments.values_list("chat__user_id", TruncDate("timestamp"), "programming_language").annotate(Count("id")).order_by():
+        rows[user_id, day].add(UserDailyStat.LANGUAGE, key, count)
+    for user_id, day, count, size in images.values_list("chat__user_id", TruncDate("created")).annotate(Count("id"), Sum("size")).order_by():
+        rows[user_id, day].add(UserDailyStat.IMAGES, "", count, size or 0)
+
+    stats.delete()
+    return len(
+        UserDailyStat.objects.bulk_create(
+            UserDailyStat(user_id=user_id, day=day, metric=metric, key=key, count=count, size=size)
+            for (user_id, day), changes in rows.items()
+            for (metric, key), (count, size) in changes.items()
+        )
+    )
+
+
+def user_stats(user, days: int = DEFAULT_ACTIVITY_DAYS) -> dict:
+    """
+    Build the statistics page of a user from the daily rollups.
+
+    Reads two queries over the user's rollup rows, whose number depends on the days
+    with activity, not on the number of chats.
+
+    Args:
+        user (User): The user.
+        days (int, optional): The number of days of activity. Defaults to 90.
+
+    Returns:
+        dict: The ``chatbots``, ``llm_models`` and ``languages`` as ``(name, count)`` pairs, most used
+        first, the number of ``chats``, ``fragments``, ``images`` and ``image_bytes``, and the
+        ``activity`` of every day with the number of chats, fragments and images added.
+    """
+    breakdowns = defaultdict(list)
+    totals = defaultdict(lambda: [0, 0])
+    for metric, key, count, size in UserDailyStat.objects.filter(user=user).values_list("metric", "key").annotate(Sum("count"), Sum("size")).order_by():
+        totals[metric][0] += count
+        totals[metric][1] += size
+        if count:
+            breakdowns[metric].append((key, count))
+    for pairs in breakdowns.values():
+        pairs.sort(key=lambda pair: (-pair[1], pair[0]))
+
+    today = timezone.localdate()
+    start = today - datetime.timedelta(days=days - 1)
+    activity = {start + datetime.timedelta(days=offset): {"chats": 0, "fragments": 0, "images": 0} for offset in range(days)}
+    names = {UserDailyStat.CHATBOT: "chats", UserDailyStat.LANGUAGE: "fragments", UserDailyStat.IMAGES: "images"}
+    for day, metric, count in (
+        UserDailyStat.objects.filter(user=user, day__gte=start, day__lte=today, metric__in=names).values_list("day", "metric").annotate(Sum("count")).order_by()
+    ):
+        activity[day][names[metric]] = count
+
+    return {
+        "chatbots": breakdowns[UserDailyStat.CHATBOT],
+        "llm_models": breakdowns[UserDailyStat.LLM_MODEL],
+        "languages": breakdowns[UserDailyStat.LANGUAGE],
+        "chats": totals[UserDailyStat.CHATBOT][0],
+        "fragments": totals[UserDailyStat.LANGUAGE][0],
+        "images": totals[UserDailyStat.IMAGES][0],
+        "image_bytes": totals[UserDailyStat.IMAGES][1],
+        "activity": [{"day": day, **counts} for day, counts in activity.items()],
+    }
+
+
+def chat_metadata_choices(user) -> dict[str, list[str]]:
+    """
+    Get the chatbots and LLM models of a user's chats from the rollups, to suggest as filters.
+
+    Args:
+        user (User): The user.
+
+    Returns:
+        dict[str, list[str]]: The sorted ``chatbot`` and ``llm_model`` names.
+    """
+    choices = {UserDailyStat.CHATBOT: set(), UserDailyStat.LLM_MODEL: set()}
+    for metric, key, count in (
+        UserDailyStat.objects.filter(user=user, metric__in=choices).exclude(key="").values_list("metric", "key").annotate(Sum("count")).order_by()
+    ):
+        if count > 0:
+            choices[metric].add(key)
+    return {metric: sorted(keys) for metric, keys in choices.items()}
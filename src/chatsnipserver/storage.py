@@ -0,0 +1,58 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.storage import storages
+from django.urls import reverse
+
+
+def image_storage():
+    """Return the storage for chat images and their variants.
+
+    ``CHATSNIP_IMAGE_STORAGE`` names an alias in ``STORAGES``, so images can live in
+    an S3-compatible bucket while static files and other uploads stay local.
+    """
+    return storages[getattr(settings, "CHATSNIP_IMAGE_STORAGE", "default")]
+
+
+def sharded_path(prefix: str, key: str, filename: str) -> str:
+    """
+    Build a storage path spread over two levels of directories named after a hash prefix.
+
+    Keeps the number of files per directory low on file systems, and spreads keys over
+    partitions on S3-compatible storage.
+
+    Args:
+        prefix (str): The top-level directory.
+        key (str): A hex digest identifying the file, e.g. the checksum of its content.
+        filename (str): The name of the file.
+
+    Returns:
+        str: The path, like ``prefix/ab/cd/filename``.
+    """
+    if not key:
+        key = hashlib.sha256(filename.encode("utf-8")).hexdigest()
+    return os.path.join(prefix, key[:2], key[2:4], filename)
+
+
+def signed_image_urls() -> bool:
+    return getattr(settings, "CHATSNIP_SIGNED_IMAGE_URLS", False)
+
+
+def chat_image_url(chat_image) -> str:
+    """
+    Return the URL to embed in chat markdown for an image.
+
+    With ``CHATSNIP_SIGNED_IMAGE_URLS = True`` this is a stable URL that redirects to a
+    freshly signed storage URL, so expiring signatures are never stored in a chat.
+    """
+    if signed_image_urls():
+        return reverse("chatsnip:chat_image_file", args=[chat_image.pk])
+    return chat_image.image.url
+
+
+def image_variant_url(variant) -> str:
+    """Return the URL to use for an image variant in a ``srcset``."""
+    if signed_image_urls():
+        return reverse("chatsnip:chat_image_variant_file", args=[variant.pk])
+    return variant.image.url
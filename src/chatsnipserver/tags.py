@@ -0,0 +1,128 @@
+import math
+
+from django.db import transaction
+from django.db.models import Count, F, QuerySet
+from taggit.models import Tag
+
+from .models import TaggedChat, UserTagCount
+
+TAG_CLOUD_WEIGHTS = 5
+
+
+def adjust_tag_counts(user_id: int, tag_ids, delta: int) -> None:
+    """
+    Add ``delta`` to the number of chats of a user with each of the tags.
+
+    Missing counts are created at zero first, so concurrent updates only ever
+    increment or decrement a row.
+
+    Args:
+        user_id (int): The id of the user.
+        tag_ids (Iterable[int]): The ids of the tags.
+        delta (int): The change of every count.
+    """
+    tag_ids = set(tag_ids or ())
+    if not tag_ids or not delta:
+        return
+    if delta > 0:
+        UserTagCount.objects.bulk_create([UserTagCount(user_id=user_id, tag_id=tag_id) for tag_id in tag_ids], ignore_conflicts=True)
+    UserTagCount.objects.filter(user_id=user_id, tag_id__in=tag_ids).update(count=F("count") + delta)
+
+
+@transaction.atomic
+def rebuild_tag_counts(user=None) -> int:
+    """
+    Recompute the tag counts, and the owners stored with the tags of every chat.
+
+    Args:
+        user (User, optional): Only rebuild the counts of this user. Defaults to every user.
+
+    Returns:
+        int: The number of counts written.
+    """
+    tagged_chats = TaggedChat.objects.all()
+    counts = UserTagCount.objects.all()
+    if user is not None:
+        tagged_chats = tagged_chats.filter(content_object__user=user)
+        counts = counts.filter(user=user)
+
+    # The owner of a chat can be changed in the admin.
+    for tagged_chat in tagged_chats.exclude(user=F("content_object__user")).select_related("content_object"):
+        TaggedChat.objects.filter(pk=tagged_chat.pk).update(user_id=tagged_chat.content_object.user_id)
+
+    counts.delete()
+    return len(
+        UserTagCount.objects.bulk_create(
+            UserTagCount(user_id=row["user_id"], tag_id=row["tag_id"], count=row["count"])
+            for row in tagged_chats.values("user_id", "tag_id").annotate(count=Count("id"))
+        )
+    )
+
+
+def filter_chats_by_tags(queryset: QuerySet, user, slugs: list[str]) -> QuerySet:
+    """
+    Filter chats of a user to the ones tagged with every one of the tags.
+
+    The chats are found by grouping the user's tagged chats on the composite
+    ``(user, tag, content_object)`` index, instead of joining the tags once per tag.
+
+    Args:
+        queryset (QuerySet): The chats to filter.
+        user (User): The owner of the chats.
+        slugs (list[str]): The slugs of the tags.
+
+    Returns:
+        QuerySet: The filtered chats.
+    """
+    slugs = set(slugs)
+    if not slugs:
+        return queryset
+    tag_ids = list(Tag.objects.filter(slug__in=slugs).values_list("pk", flat=True))
+    if len(tag_ids) < len(slugs):
+        return queryset.none()
+    matching = (
+        TaggedChat.objects.filter(user=user, tag_id__in=tag_ids)
+        .values("content_object_id")
+        .annotate(matches=Count("tag_id"))
+        .filter(matches=len(tag_ids))
+        .values("content_object_id")
+    )
+    return queryset.filter(user=user, pk__in=matching)
+
+
+def tag_cloud(user) -> list[dict]:
+    """
+    Build the tag cloud of a user from the precomputed counts.
+
+    Args:
+        user (User): The user.
+
+    Returns:
+        list[dict]: The ``name``, ``slug``, ``count`` and ``weight`` (1 to 5, on a logarithmic scale) of every tag, by name.
+    """
+    tags = list(UserTagCount.objects.filter(user=user, count__gt=0).order_by("tag__name").values("count", name=F("tag__name"), slug=F("tag__slug")))
+    if tags:
+        smallest, largest = math.log(min(tag["count"] for tag in tags)), math.log(max(tag["count"] for tag in tags))
+        spread = largest - smallest or 1
+        for tag in tags:
+            tag["weight"] = 1 + round((math.log(tag["count"]) - smallest) / spread * (TAG_CLOUD_WEIGHTS - 1))
+    return tags
+
+
+def autocomplete_tags(user, prefix: str, limit: int = 10) -> list[dict]:
+    """
+    Find the tags of a user starting with ``prefix``, most used first.
+
+    Args:
+        user (User): The user.
+        prefix (str): The start of the tag name, case-insensitive.
+        limit (int, optional): The maximum number of tags. Defaults to 10.
+
+    Returns:
+        list[dict]: The ``name``, ``slug`` and ``count`` of every tag.
+    """
+    return list(
+        UserTagCount.objects.filter(user=user, count__gt=0, tag__name__istartswith=prefix)
+        .order_by("-count", "tag__name")
+        .values("count", name=F("tag__name"), slug=F("tag__slug"))[:limit]
+    )
@@ -1,3 +1,4 @@
+import re
 import markdown
 from django import template
 from django.utils.safestring import mark_safe
@@ -25,4 +26,27 @@ def highlight_code(code, language):
 
 @register.filter(name='markdown')
 def markdown_format(text):
-    return mark_safe(markdown.markdown(text, extensions=['codehilite', "fenced_code"]))
\ No newline at end of file
+    return mark_safe(markdown.markdown(text, extensions=['codehilite', "fenced_code"]))
+
+_IMG_SRC = re.compile(r'<img([^>]*?)\ssrc="([^"]+)"([^>]*?)\s*/?>')
+
+
+@register.filter(name='responsive_images')
+def responsive_images(html, image_attributes):
+    """
+    Add dimensions, ``srcset`` and lazy loading to the images of rendered markdown.
+    :param html: The rendered HTML
+    :param image_attributes: The attributes of every image, keyed by the URL of the original image
+    :return: HTML with responsive images
+    """
+    def replace(match):
+        before, src, after = match.groups()
+        attributes = f'{before} src="{src}"{after} loading="lazy" decoding="async"'
+        extra = (image_attributes or {}).get(src, {})
+        if "width" in extra:
+            attributes += f' width="{extra["width"]}" height="{extra["height"]}"'
+        if "srcset" in extra:
+            attributes += f' srcset="{extra["srcset"]}" sizes="(max-width: 1280px) 100vw, 1280px"'
+        return f'<img{attributes} />'
+
+    return mark_safe(_IMG_SRC.sub(replace, str(html)))
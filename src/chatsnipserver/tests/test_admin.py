@@ -0,0 +1,71 @@
+import pytest
+from chatsnipserver.admin import EstimatedCountPaginator
+from chatsnipserver.database import estimated_row_count
+from chatsnipserver.models import Chat, CodeFragment
+from chatsnipserver.stats import rebuild_stats
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.urls import reverse
+
+
+@pytest.fixture
+def admin_client(client):
+    user = get_user_model().objects.create_superuser(username="admin", password="testpass")
+    client.force_login(user)
+    return client
+
+
+@pytest.fixture
+def chats():
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    chats = [
+        Chat.objects.create(unique_identifier=f"chat-{i}", name=f"Project {i}", json_data=[{"content": "x" * 1000}], user=user, chatbot="ChatGPT")
+        for i in range(5)
+    ]
+    for chat in chats:
+        CodeFragment.objects.create(chat=chat, filename="app/main.py", programming_language="python", source_code="print(1)")
+        CodeFragment.objects.create(chat=chat, filename="schema.sql", programming_language="sql", source_code="SELECT 1;")
+    rebuild_stats()
+    return chats
+
+
+@pytest.mark.django_db
+def test_changelists_do_not_query_per_row(admin_client, chats, django_assert_max_num_queries):
+    for model in ("chat", "codefragment", "chatimage", "quarantinedimage"):
+        with django_assert_max_num_queries(8):
+            assert admin_client.get(reverse(f"admin:chatsnipserver_{model}_changelist")).status_code == 200
+
+    fragment = CodeFragment.objects.filter(filename="app/main.py").first()
+    response = admin_client.get(reverse("admin:chatsnipserver_codefragment_change", args=[fragment.pk]))
+    assert response.status_code == 200
+    assert "print(1)" in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_search_and_filters_use_indexed_lookups(admin_client, chats):
+    url = reverse("admin:chatsnipserver_chat_changelist")
+    assert list(admin_client.get(url, {"q": "Project 3"}).context["cl"].result_list) == [chats[3]]
+    assert list(admin_client.get(url, {"q": "chat-1"}).context["cl"].result_list) == [chats[1]]
+    assert len(admin_client.get(url, {"q": "testuser"}).context["cl"].result_list) == 5
+    assert not admin_client.get(url, {"q": "roject"}).context["cl"].result_list
+
+    url = reverse("admin:chatsnipserver_codefragment_changelist")
+    response = admin_client.get(url, {"programming_language": "sql"})
+    assert [fragment.filename for fragment in response.context["cl"].result_list] == ["schema.sql"] * 5
+    assert ">sql</a>" in response.content.decode()
+    assert len(admin_client.get(url, {"q": "app/"}).context["cl"].result_list) == 5
+
+
+@pytest.mark.django_db
+def test_estimated_count_for_unfiltered_lists(settings, chats):
+    if connection.vendor != "sqlite":
+        pytest.skip("Only SQLite updates its statistics on demand.")
+    settings.CHATSNIP_ADMIN_ESTIMATED_COUNT_MIN = 1
+    assert estimated_row_count(CodeFragment) is None
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    assert estimated_row_count(CodeFragment) == 10
+
+    CodeFragment.objects.filter(programming_language="sql").delete()
+    assert EstimatedCountPaginator(CodeFragment.objects.all(), 100).count == 10
+    assert EstimatedCountPaginator(CodeFragment.objects.filter(programming_language="python"), 100).count == 5
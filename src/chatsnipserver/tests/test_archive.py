@@ -0,0 +1,73 @@
+import io
+import zipfile
+
+import pytest
+from chatsnipserver.archive import archive_path
+from chatsnipserver.models import Chat, CodeFragment
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+
+def unzip(response):
+    content = b"".join(response.streaming_content) if response.streaming else response.content
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        return {name: archive.read(name).decode() for name in archive.namelist()}
+
+
+def test_archive_paths_stay_inside_the_archive():
+    assert archive_path("src/app/main.py", 1) == "src/app/main.py"
+    assert archive_path("../../etc/passwd", 1) == "etc/passwd"
+    assert archive_path("/abs\\\\win.py", 1) == "abs/win.py"
+    assert archive_path(None, 7) == "untitled_7"
+
+
+@pytest.mark.django_db
+def test_download_selected_sources_as_zip(client, settings):
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "archive"}}
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    client.force_login(user)
+    chat = Chat.objects.create(unique_identifier="1", name="My Project", json_data=[], user=user)
+    other = Chat.objects.create(unique_identifier="2", name="Other", json_data=[], user=user)
+    for index, source in enumerate(["print(1)", "print(2)"]):
+        CodeFragment.objects.create(chat=chat, filename="app/main.py", programming_language="python", source_code=source, selected=index == 0)
+    CodeFragment.objects.create(chat=chat, filename="README.md", programming_language="markdown", source_code="# Hello")
+    CodeFragment.objects.create(chat=other, filename="main.py", programming_language="python", source_code="print(3)")
+
+    response = client.get(reverse("chatsnip:chat_source_zip", args=[chat.pk]))
+    assert response.streaming
+    assert response["Content-Disposition"] == 'attachment; filename="my-project.zip"'
+    assert unzip(response) == {"README.md": "# Hello", "app/main.py": "print(1)"}
+
+    cached = client.get(reverse("chatsnip:chat_source_zip", args=[chat.pk]))
+    assert not cached.streaming and cached["ETag"] == response["ETag"]
+    assert client.get(reverse("chatsnip:chat_source_zip", args=[chat.pk]), HTTP_IF_NONE_MATCH=response["ETag"]).status_code == 304
+
+    chat.tags.add("python")
+    other.tags.add("python")
+    response = client.get(reverse("chatsnip:tagged_source_zip"), {"tag": "python"})
+    assert set(unzip(response)) == {f"my-project-{chat.pk}/README.md", f"my-project-{chat.pk}/app/main.py", f"other-{other.pk}/main.py"}
+    assert client.get(reverse("chatsnip:tagged_source_zip")).status_code == 400
+
+
+@pytest.mark.django_db
+def test_download_streams_under_asgi(client):
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    chat = Chat.objects.create(unique_identifier="1", name="My Project", json_data=[], user=user)
+    for index in range(3):
+        CodeFragment.objects.create(chat=chat, filename=f"file_{index}.py", programming_language="python", source_code=f"print({index})")
+    async_client = AsyncClient()
+    async_client.force_login(user)
+
+    async def download():
+        response = await async_client.get(reverse("chatsnip:chat_source_zip", args=[chat.pk]))
+        assert response.is_async
+        chunks = [chunk async for chunk in response.streaming_content]
+        return response, chunks
+
+    response, chunks = async_to_sync(download)()
+    assert len(chunks) == 4
+    response.streaming_content = chunks
+    assert unzip(response) == {f"file_{index}.py": f"print({index})" for index in range(3)}
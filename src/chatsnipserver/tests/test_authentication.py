@@ -0,0 +1,58 @@
+import pytest
+from chatsnipserver.authentication import ApiKeyAuthentication, api_key_cache
+from django.contrib.auth import get_user_model
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+
+@pytest.fixture
+def profile():
+    api_key_cache.clear()
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    return user.chatsnipprofile
+
+
+def authenticate(**headers):
+    request = Request(APIRequestFactory().post("/api/chats/", {}, format="json", **headers), parsers=[JSONParser()])
+    return ApiKeyAuthentication().authenticate(request)
+
+
+@pytest.mark.django_db
+def test_api_key_header_is_cached(profile, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        user, auth = authenticate(HTTP_X_API_KEY=str(profile.api_key))
+    assert user == profile.user
+    with django_assert_num_queries(0):
+        user, auth = authenticate(HTTP_AUTHORIZATION=f"Api-Key {profile.api_key}")
+    assert user == profile.user
+
+
+@pytest.mark.django_db
+def test_regenerated_api_key_is_invalidated(profile):
+    old_key = str(profile.api_key)
+    authenticate(HTTP_X_API_KEY=old_key)
+    profile.regenerate_api_key()
+    with pytest.raises(AuthenticationFailed):
+        authenticate(HTTP_X_API_KEY=old_key)
+    user, auth = authenticate(HTTP_X_API_KEY=str(profile.api_key))
+    assert user == profile.user
+
+
+@pytest.mark.django_db
+def test_deactivated_user_is_invalidated(profile):
+    user, auth = authenticate(HTTP_X_API_KEY=str(profile.api_key))
+    other, _ = authenticate(HTTP_X_API_KEY=str(profile.api_key))
+    assert other is not user and auth.api_key_hash == profile.api_key_hash
+    user.username = "changed"
+    assert other.username == "testuser"
+
+    profile.user.is_active = False
+    profile.user.save()
+    with pytest.raises(AuthenticationFailed):
+        authenticate(HTTP_X_API_KEY=str(profile.api_key))
+
+
+def test_missing_api_key_is_not_authenticated():
+    assert authenticate() is None
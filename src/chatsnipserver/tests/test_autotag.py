@@ -0,0 +1,69 @@
+from io import StringIO
+
+import pytest
+from chatsnipserver.autotag import AUTOTAG_VERSION, autotag_chats, derive_tags
+from chatsnipserver.models import Chat, CodeFragment, UserTagCount
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from rest_framework.test import APIClient
+
+
+def test_derive_tags_from_fragments_and_text():
+    fragments = [
+        ("manage.py", "python", "import os\nfrom django.core.management import execute_from_command_line\n"),
+        ("web/App.tsx", "typescript", "import React from 'react'\n"),
+    ]
+    text = "Should I deploy with Docker? Docker compose works. Redis is mentioned once."
+    assert derive_tags(text, fragments) == ["django", "react", "python", "typescript", "docker"]
+    assert derive_tags("", [("notes.txt", "plaintext", "nothing to see")]) == []
+
+
+@pytest.mark.django_db
+def test_autotag_chats_adds_tags_and_counts_once():
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    chats = [Chat.objects.create(unique_identifier=str(i), name="Chat", json_data=[{"content": "A question"}], user=user) for i in range(3)]
+    for chat in chats:
+        CodeFragment.objects.create(chat=chat, filename="app.py", programming_language="python", source_code="import pandas as pd\n")
+    chats[0].tags.add("Python")
+    timestamp = Chat.objects.get(pk=chats[1].pk).timestamp
+
+    assert autotag_chats(Chat.objects.all()) == 5
+    assert autotag_chats(Chat.objects.all()) == 0
+    assert set(chats[1].tags.names()) == {"Python", "pandas"}
+    assert dict(UserTagCount.objects.filter(user=user).values_list("tag__name", "count")) == {"Python": 3, "pandas": 3}
+    assert set(Chat.objects.values_list("autotag_version", flat=True)) == {AUTOTAG_VERSION}
+    assert Chat.objects.get(pk=chats[1].pk).timestamp == timestamp
+
+
+@pytest.mark.django_db
+def test_autotag_chats_keeps_removed_tags_removed():
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    chat = Chat.objects.create(unique_identifier="1", name="Chat", json_data=[{"content": "Docker and docker again"}], user=user)
+    CodeFragment.objects.create(chat=chat, filename="app.py", programming_language="python", source_code="print(1)\n")
+    assert autotag_chats(Chat.objects.all()) == 2
+
+    chat.tags.remove("docker")
+    Chat.objects.update(autotag_version=0)
+    assert autotag_chats(Chat.objects.all()) == 0
+    assert list(chat.tags.names()) == ["python"]
+    assert Chat.objects.get().autotag_tags == ["docker", "python"]
+    assert UserTagCount.objects.get(user=user, tag__name="python").count == 1
+
+
+@pytest.mark.django_db
+def test_autotag_command_resumes_and_ingest_tags_inline(settings):
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    for i in range(5):
+        Chat.objects.create(unique_identifier=str(i), name="Chat", json_data=[{"content": "kubernetes and k8s"}], user=user)
+
+    call_command("autotag_chats", batch_size=2, limit=3, stdout=StringIO())
+    assert Chat.objects.filter(autotag_version=AUTOTAG_VERSION).count() == 3
+    call_command("autotag_chats", batch_size=2, stdout=StringIO())
+    assert UserTagCount.objects.get(user=user, tag__name="kubernetes").count == 5
+
+    settings.CHATSNIP_AUTOTAG_INLINE = True
+    client = APIClient(HTTP_X_API_KEY=str(user.chatsnipprofile.api_key))
+    content = [{"content": "Use a Dockerfile"}, {"language": "rust", "filename": "src/main.rs", "content": "fn main() {}\n"}]
+    response = client.post("/api/chats/", {"chatId": "new", "chatName": "New", "content": content, "markdown": ""}, format="json")
+    assert response.status_code == 200
+    assert list(Chat.objects.get(unique_identifier="new").tags.names()) == ["rust"]
@@ -0,0 +1,40 @@
+import pytest
+from chatsnipserver.database import SQLITE_PRAGMAS, sqlite_database
+from django.db.utils import ConnectionHandler
+
+
+def pragmas(connection, *names):
+    with connection.cursor() as cursor:
+        return [cursor.execute(f"PRAGMA {name}").fetchone()[0] for name in names]
+
+
+@pytest.fixture
+def file_database(tmp_path, django_db_blocker):
+    """Open connections to new SQLite files, outside the test database."""
+    connections = []
+
+    def connect(name="db.sqlite3"):
+        connections.append(ConnectionHandler({"default": sqlite_database(tmp_path / name)})["default"])
+        return connections[-1]
+
+    with django_db_blocker.unblock():
+        yield connect
+        for connection in connections:
+            connection.close()
+
+
+def test_sqlite_pragmas_are_applied_to_new_connections(settings, file_database):
+    settings.CHATSNIP_SQLITE_PRAGMAS = SQLITE_PRAGMAS
+    connection = file_database()
+    assert pragmas(connection, "journal_mode", "synchronous", "busy_timeout", "cache_size") == ["wal", 1, 5000, -65536]
+    assert connection.settings_dict["CONN_MAX_AGE"] == 0
+    assert sqlite_database("db.sqlite3", conn_max_age=600)["CONN_MAX_AGE"] == 600
+
+
+def test_sqlite_pragmas_are_optional_and_validated(settings, file_database):
+    settings.CHATSNIP_SQLITE_PRAGMAS = None
+    assert pragmas(file_database(), "journal_mode") == ["delete"]
+
+    settings.CHATSNIP_SQLITE_PRAGMAS = {"journal_mode": "WAL; DROP TABLE chat"}
+    with pytest.raises(ValueError):
+        file_database("other.sqlite3").ensure_connection()
@@ -0,0 +1,105 @@
+import random
+
+import pytest
+from chatsnipserver.diffs import diff_opcodes, render_diff
+from chatsnipserver.models import Chat, CodeFragment
+from chatsnipserver.services import compose_project_state_view
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+
+def apply_opcodes(a, b, opcodes):
+    result = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+            result += a[i1:i2]
+        else:
+            result += b[j1:j2]
+    return result
+
+
+def test_diff_opcodes_rebuild_the_new_version():
+    generator = random.Random(0)
+    for _ in range(200):
+        a = [generator.choice(["x", "y", "z", "}", ""]) + str(generator.randrange(4)) for _ in range(generator.randrange(40))]
+        b = list(a)
+        for _ in range(generator.randrange(6)):
+            position = generator.randrange(len(b) + 1)
+            if b and generator.random() < 0.5:
+                del b[min(position, len(b) - 1)]
+            else:
+                b.insert(position, f"new {generator.randrange(10)}")
+        assert apply_opcodes(a, b, diff_opcodes(a, b)) == b
+
+
+def test_diff_anchors_on_unique_lines():
+    old = ["def a():", "    return 1", "", "def b():", "    return 2"]
+    new = ["def b():", "    return 2", "", "def a():", "    return 1"]
+    equal = sum(i2 - i1 for tag, i1, i2, _, _ in diff_opcodes(old, new) if tag == "equal")
+    assert equal == 2
+
+
+def test_render_diff_modes():
+    old, new = "a\nb\nc\n", "a\nB\nc\n<d>\n"
+    unified = render_diff(old, new, "unified")
+    assert (unified["added"], unified["removed"]) == (2, 1)
+    assert '<tr class="diff-delete">' in unified["html"] and "-b" in unified["html"]
+    assert "+&lt;d&gt;" in unified["html"]
+    split = render_diff(old, new, "split")
+    assert '<table class="diff diff-split">' in split["html"]
+    assert '<tr class="diff-replace">' in split["html"]
+    assert "No changes." in render_diff(old, old)["html"]
+
+
+@pytest.mark.django_db
+def test_fragment_diff_against_previous_version(client, settings, django_assert_num_queries):
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "diffs"}}
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    other = get_user_model().objects.create_user(username="other", password="testpass")
+    client.force_login(user)
+    chat = Chat.objects.create(unique_identifier="1", name="Chat", json_data=[], user=user)
+    first = CodeFragment.objects.create(chat=chat, filename="main.py", programming_language="python", source_code="print(1)\n")
+    second = CodeFragment.objects.create(chat=chat, filename="main.py", programming_language="python", source_code="print(1)\nprint(2)\n")
+    CodeFragment.objects.create(chat=chat, filename="other.py", programming_language="python", source_code="print(3)\n")
+
+    url = reverse("chatsnip:fragment_diff", args=[second.pk])
+    data = client.get(url).json()
+    assert (data["previous"], data["added"], data["removed"]) == (first.pk, 1, 0)
+    assert "+print(2)" in data["html"]
+    with django_assert_num_queries(4):
+        assert client.get(url).json() == data
+
+    assert client.get(reverse("chatsnip:fragment_diff", args=[first.pk])).json()["previous"] is None
+    assert client.get(url, {"mode": "inline"}).status_code == 400
+    client.force_login(other)
+    assert client.get(url).status_code == 404
+
+
+@pytest.mark.django_db
+def test_project_state_at_message(client):
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    client.force_login(user)
+    json_data = [
+        {"content": "Write a script"},
+        {"language": "python", "filename": "main.py", "content": "print(1)"},
+        {"language": "text", "filename": "notes.txt", "content": "todo"},
+        {"content": "Print two"},
+        {"language": "python", "filename": "main.py", "content": "print(2)"},
+    ]
+    chat = Chat.objects.create(unique_identifier="1", name="Chat", json_data=json_data, user=user)
+    fragment = CodeFragment.objects.create(chat=chat, filename="main.py", programming_language="python", source_code="print(1)")
+
+    state = compose_project_state_view(chat, 1)
+    assert (state["message"], state["messages"]) == (1, 2)
+    assert [(file["filename"], file["source_code"], file["fragment_id"]) for file in state["files"]] == [
+        ("main.py", "print(1)", fragment.pk),
+        ("notes.txt", "todo", None),
+    ]
+    state = compose_project_state_view(chat, 99)
+    assert state["message"] == 2
+    assert [file["source_code"] for file in state["files"]] == ["print(2)", "todo"]
+
+    response = client.get(reverse("chatsnip:chat_source_code", args=[chat.pk]), {"message": "1"})
+    assert response.status_code == 200
+    assert response.context["project_state"] and len(response.context["files"]) == 2
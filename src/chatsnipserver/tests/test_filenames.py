@@ -0,0 +1,84 @@
+import pytest
+from chatsnipserver.filenames import definition_filename, file_extension, header_filename, similar_filename
+from chatsnipserver.models import Chat, CodeFragment
+from chatsnipserver.services import build_new_code_fragments, generate_checksum, rename_untitled_fragments, save_code_fragment
+from django.contrib.auth import get_user_model
+
+VIEW = """from django.http import HttpResponse
+
+
+def index(request):
+    return HttpResponse("Hello")
+
+
+def about(request):
+    return HttpResponse("About")
+"""
+
+
+@pytest.mark.parametrize(
+    "content, language, filename",
+    [
+        ("// File: src/index.js\nconsole.log(1);", "javascript", "src/index.js"),
+        ("/* styles.css */\nbody { margin: 0; }", "css", "styles.css"),
+        ("<!-- templates/base.html -->\n<html></html>", "html", "templates/base.html"),
+        ("import os\n\nclass UserService:\n    pass\n\ndef main():\n    pass", "python", "user_service.py"),
+        ("async def fetch_all():\n    pass", "python", "fetch_all.py"),
+        ("package com.example;\n\npublic final class HttpClient {\n}", "java", "HttpClient.java"),
+        ("export default function App() {\n  return null;\n}", "jsx", "App.jsx"),
+        ("package main\n\nfunc main() {}", "go", "main.go"),
+        ("# version 1.2\nx = 1", "python", None),
+        ("SELECT 1;", "sql", None),
+    ],
+)
+def test_infer_filename(content, language, filename):
+    assert (header_filename(content) or definition_filename(content, language)) == filename
+
+
+def test_file_extension_of_unknown_language():
+    assert file_extension("Python") == ".py"
+    assert file_extension("brainfuck") == ".txt"
+    assert file_extension(None) == ".txt"
+
+
+def test_similar_filename():
+    candidates = {"views.py": VIEW, "models.py": "from django.db import models\n\nclass Chat(models.Model):\n    pass\n"}
+    changed = VIEW.replace('"About"', '"About us"') + '\n\ndef contact(request):\n    return HttpResponse("Contact")\n'
+    assert similar_filename(changed, candidates) == "views.py"
+    assert similar_filename("print('unrelated')\n", candidates) is None
+
+
+@pytest.mark.django_db
+def test_untitled_fragments_are_grouped_and_named_stably():
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    chat = Chat.objects.create(unique_identifier="1", name="Chat", json_data=[], user=user)
+    samples = [
+        {"content": "x = 1\ny = 2\nprint(x + y)", "language": "python"},
+        {"content": "x = 1\ny = 3\nprint(x + y)", "language": "python"},
+        {"content": "SELECT * FROM chats;", "language": "sql"},
+    ]
+    fragments = build_new_code_fragments(chat, samples)
+    assert fragments[0].filename == fragments[1].filename == f"untitled_{fragments[0].checksum[:8]}.py"
+    assert fragments[2].filename == f"untitled_{generate_checksum('SELECT * FROM chats;')[:8]}.sql"
+    CodeFragment.objects.bulk_create(fragments)
+
+    fragment = save_code_fragment(chat, None, "x = 1\ny = 4\nprint(x + y)", "python")
+    assert fragment.filename == fragments[0].filename
+    assert save_code_fragment(chat, None, "x = 1\ny = 4\nprint(x + y)", "python") is None
+
+
+@pytest.mark.django_db
+def test_rename_legacy_untitled_fragments():
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    chat = Chat.objects.create(unique_identifier="1", name="Chat", json_data=[], user=user)
+    CodeFragment.objects.create(chat=chat, filename="views.py", programming_language="python", source_code=VIEW)
+    similar = CodeFragment.objects.create(
+        chat=chat, filename="untitled_1718000000.py", programming_language="python", source_code=VIEW.replace("About", "Team")
+    )
+    named = CodeFragment.objects.create(chat=chat, filename="untitled_1718000001None", programming_language="python", source_code="class ApiClient:\n    pass")
+
+    assert rename_untitled_fragments(Chat.objects.all()) == 2
+    similar.refresh_from_db()
+    named.refresh_from_db()
+    assert (similar.filename, named.filename) == ("views.py", "api_client.py")
+    assert rename_untitled_fragments(Chat.objects.all()) == 0
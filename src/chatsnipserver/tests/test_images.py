@@ -0,0 +1,128 @@
+from io import BytesIO
+
+import pytest
+from chatsnipserver import services
+from chatsnipserver.images import InvalidImage, generate_image_variants, get_chat_image_attributes, render_variants, sniff_image, validate_image
+from chatsnipserver.models import Chat, ChatImage, ChatImageVariant, QuarantinedImage
+from chatsnipserver.templatetags.markdown_extras import responsive_images
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from PIL import Image, features
+
+
+def png(width, height, format="PNG"):
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize(
+    "format, extension",
+    [("PNG", ".png"), ("JPEG", ".jpg"), ("GIF", ".gif"), ("WEBP", ".webp"), ("BMP", ".bmp"), ("AVIF", ".avif")],
+)
+def test_sniff_image_reads_type_and_dimensions_from_header(format, extension):
+    if format == "AVIF" and not features.check("avif"):
+        pytest.skip("Pillow was built without AVIF support")
+    info = validate_image(BytesIO(png(123, 45, format)))
+    assert (info.extension, info.width, info.height) == (extension, 123, 45)
+
+
+def test_sniff_image_svg_and_unknown(settings):
+    svg = b'<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 16"><path d="M0 0"/></svg>'
+    assert sniff_image(svg)[:4] == (".svg", "image/svg+xml", 24, 16)
+    assert sniff_image(b"<html><body>Not found</body></html>") is None
+
+    encoded = svg.replace(b"<path", b'<a href="jav&#x61;script:alert(1)"><text>x</text></a><path')
+    for content in (svg, encoded):
+        with pytest.raises(InvalidImage, match="not accepted"):
+            validate_image(BytesIO(content))
+    settings.CHATSNIP_IMAGE_ALLOW_SVG = True
+    assert validate_image(BytesIO(svg)).extension == ".svg"
+
+    with pytest.raises(InvalidImage):
+        validate_image(BytesIO(svg.replace(b"<path", b"<script>alert(1)</script><path")))
+    with pytest.raises(InvalidImage):
+        validate_image(BytesIO(png(100, 100)[:-20]))
+
+
+def test_sniff_image_truncated_headers():
+    for length in range(8, 24):
+        truncated = png(100, 100)[:length]
+        assert sniff_image(truncated)[:4] == (".png", "image/png", None, None)
+        with pytest.raises(InvalidImage, match="dimensions"):
+            validate_image(BytesIO(truncated))
+
+
+def test_render_variants_keeps_aspect_ratio_and_never_upscales():
+    rendered = render_variants(png(400, 200), [(150, "webp"), (320, "webp"), (640, "webp")])
+
+    assert [(width, height, name) for width, height, name, _ in rendered] == [(150, 75, "webp"), (320, 160, "webp")]
+    with Image.open(BytesIO(rendered[0][3])) as variant:
+        assert variant.format == "WEBP"
+        assert variant.size == (150, 75)
+
+
+@pytest.mark.django_db
+def test_variants_are_shared_by_checksum_and_used_in_image_attributes(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    settings.CHATSNIP_IMAGE_VARIANT_WIDTHS = (150, 320)
+    settings.CHATSNIP_IMAGE_VARIANT_FORMATS = ("webp",)
+    user = get_user_model().objects.create(username="testuser")
+    first = Chat.objects.create(unique_identifier="1", name="First", json_data=[], user=user)
+    second = Chat.objects.create(unique_identifier="2", name="Second", json_data=[], user=user)
+    images = []
+    for chat in (first, second):
+        image = ChatImage(chat=chat, source_url="http://example.com/a.png")
+        image.image.save("a.png", ContentFile(png(400, 300)), save=True)
+        images.append(image)
+
+    assert len(generate_image_variants(images[0])) == 2
+    assert generate_image_variants(images[1]) == []
+    assert ChatImageVariant.objects.count() == 2
+
+    attributes = get_chat_image_attributes(second)
+    assert list(attributes) == [images[1].image.url]
+    assert attributes[images[1].image.url]["srcset"].endswith("_320.webp 320w")
+
+    html = responsive_images(f'<p><img alt="a" src="{images[1].image.url}" /></p>', attributes)
+    assert 'srcset="' in html and 'loading="lazy"' in html
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {"Content-Type": "image/png"}
+
+    def __init__(self, content):
+        self.content = content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def iter_content(self, chunk_size):
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset : offset + chunk_size]
+
+
+@pytest.mark.django_db
+def test_download_records_dimensions_and_quarantines_invalid_images(settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path
+    settings.CHATSNIP_IMAGE_VARIANTS_INLINE = True
+    user = get_user_model().objects.create(username="testuser")
+    chat = Chat.objects.create(unique_identifier="1", name="Chat", json_data=[], user=user)
+    downloads = {"http://example.com/a.png": png(400, 300), "http://example.com/b.png": b"<html>Rate limited</html>"}
+    monkeypatch.setattr(services.requests, "get", lambda url, **kwargs: FakeResponse(downloads[url]))
+
+    result = services.download_and_save_image(chat, "http://example.com/a.png")
+    assert (result["image"].width, result["image"].height) == (400, 300)
+    assert result["image"].image.name.endswith(".png")
+
+    result = services.download_and_save_image(chat, "http://example.com/b.png")
+    assert not result["status"]
+    assert not ChatImage.objects.filter(source_url="http://example.com/b.png").exists()
+    quarantined = QuarantinedImage.objects.get()
+    assert quarantined.reason == "Unrecognized image format"
+    assert quarantined.file.name.endswith(".bin")
+    assert services.download_and_save_image(chat, "http://example.com/b.png")["message"] == "Image is quarantined"
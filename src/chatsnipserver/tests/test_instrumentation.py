@@ -0,0 +1,36 @@
+import pytest
+from chatsnipserver.instrumentation import PerformanceMiddleware, instrument, registry
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+
+@pytest.fixture(autouse=True)
+def reset_registry():
+    registry.reset()
+
+
+@instrument
+def count_users():
+    return get_user_model().objects.count()
+
+
+@pytest.mark.django_db
+def test_middleware_records_queries_and_functions(settings, caplog):
+    settings.CHATSNIP_SLOW_REQUEST_SECONDS = 0
+    middleware = PerformanceMiddleware(lambda request: HttpResponse(str(count_users())))
+    middleware(RequestFactory().get("/chat/"))
+
+    assert registry.requests["unresolved"][0] == 1
+    assert registry.db_queries == 1
+    assert registry.functions["count_users"][0] == 1
+    assert "count_users=" in caplog.text and "db=" in caplog.text
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint(client, settings):
+    settings.CHATSNIP_METRICS_TOKEN = "secret"
+    assert client.get("/metrics/").status_code == 403
+    response = client.get("/metrics/", HTTP_AUTHORIZATION="Bearer secret")
+    assert response.status_code == 200
+    assert "chatsnip_db_queries_total" in response.content.decode()
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from chatsnipserver.models import Chat, CodeFragment
 from chatsnipserver.services import generate_checksum
@@ -40,3 +42,38 @@ def test_code_fragment_creation():
     assert code_fragment.programming_language == "python"
     assert code_fragment.source_code == 'print("Hello, world!")'
     assert code_fragment.checksum == generate_checksum('print("Hello, world!")')
+
+
+@pytest.mark.django_db
+def test_chat_checksum_only_recomputed_when_json_data_changes(monkeypatch):
+    from chatsnipserver import services
+
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    chat = Chat.objects.create(unique_identifier="123", name="Test Chat", json_data=[{"content": "Hello"}], user=user)
+    assert chat.checksum == generate_checksum(json.dumps([{"content": "Hello"}]))
+
+    calls = []
+    original = services.generate_json_checksum
+    monkeypatch.setattr(services, "generate_json_checksum", lambda data: calls.append(data) or original(data))
+
+    chat = Chat.objects.get(pk=chat.pk)
+    chat.name = "Renamed"
+    chat.save()
+    assert calls == []
+
+    chat.json_data = [{"content": "Hello again"}]
+    chat.save()
+    assert len(calls) == 1
+    assert Chat.objects.get(pk=chat.pk).checksum == generate_checksum(json.dumps([{"content": "Hello again"}]))
+
+    chat.save()
+    assert len(calls) == 1
+    chat.json_data.append({"content": "Changed in place"})
+    chat.save(update_fields=["json_data"])
+    assert len(calls) == 2
+    assert Chat.objects.get(pk=chat.pk).checksum == generate_checksum(json.dumps([{"content": "Hello again"}, {"content": "Changed in place"}]))
+
+    chat = Chat.objects.defer("json_data").get(pk=chat.pk)
+    chat.name = "Deferred"
+    chat.save()
+    assert len(calls) == 2
@@ -0,0 +1,117 @@
+import functools
+import json
+
+import pytest
+from chatsnipserver import services, urls
+from chatsnipserver.models import Chat, CodeFragment
+from chatsnipserver.querybudget import QueryBudget, QueryBudgetExceeded, get_query_budget
+from django.contrib.auth import get_user_model
+from django.urls import URLResolver, resolve, reverse
+from rest_framework.test import APIClient
+
+from .test_views import mock_image_transport
+
+
+def iter_patterns(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from iter_patterns(pattern.url_patterns)
+        else:
+            yield pattern
+
+
+def request_within_budget(client, method, url, data=None, **kwargs):
+    budget = get_query_budget(resolve(url).func, method)
+    assert budget is not None, f"No query budget declared for {method.upper()} {url}"
+    with QueryBudget(budget, name=f"{method.upper()} {url}"):
+        return getattr(client, method)(url, data, **kwargs)
+
+
+@pytest.mark.django_db
+def test_query_budget_reports_duplicates():
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    with pytest.raises(QueryBudgetExceeded) as excinfo:
+        with QueryBudget(1, name="lookups"):
+            get_user_model().objects.get(pk=user.pk)
+            get_user_model().objects.get(pk=user.pk)
+    assert "lookups executed 2 queries, budget is 1." in str(excinfo.value)
+    assert "2x SELECT" in str(excinfo.value)
+    assert "test_querybudget.py" in str(excinfo.value)
+
+
+def test_every_view_declares_a_query_budget():
+    for pattern in iter_patterns(urls.urlpatterns):
+        view = pattern.callback
+        view_class = getattr(view, "cls", None) or getattr(view, "view_class", None)
+        if view_class and view_class.__module__.startswith("rest_framework"):
+            continue
+        assert getattr(view_class or view, "query_budget", None) is not None, pattern.name
+
+
+@pytest.mark.django_db
+def test_views_stay_within_query_budget(client, settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path
+    monkeypatch.setattr(services.httpx, "AsyncClient", functools.partial(services.httpx.AsyncClient, transport=mock_image_transport()))
+    user = get_user_model().objects.create_user(username="testuser", password="testpass", is_staff=True)
+    client.force_login(user)
+    chats = [Chat.objects.create(unique_identifier=str(i), name="Test Chat", json_data=[], markdown="Hello", user=user) for i in range(3)]
+    fragments = [
+        CodeFragment.objects.create(chat=chat, filename=f"file_{i}.py", programming_language="python", source_code=f"x = {i}")
+        for chat in chats
+        for i in range(3)
+    ]
+
+    chats[0].tags.add("python", "django")
+    chats[1].tags.add("python")
+    request_within_budget(client, "get", reverse("chatsnip:chat_list"))
+    request_within_budget(client, "get", reverse("chatsnip:chat_list"), {"tag": ["python", "django"]})
+    request_within_budget(client, "get", reverse("chatsnip:chat_list"), {"chatbot": "ChatGPT", "since": "2024-01-01", "until": "2024-12-31"})
+    request_within_budget(client, "get", reverse("chatsnip:tag_autocomplete"), {"q": "py"})
+    request_within_budget(client, "get", reverse("chatsnip:chat_detail", args=[chats[0].pk]))
+    request_within_budget(client, "get", reverse("chatsnip:chat_source_code", args=[chats[0].pk]))
+    request_within_budget(client, "get", reverse("chatsnip:fragment_highlighted", args=[fragments[0].pk]))
+    newer = CodeFragment.objects.create(chat=chats[0], filename="file_0.py", programming_language="python", source_code="x = 1")
+    request_within_budget(client, "get", reverse("chatsnip:fragment_diff", args=[newer.pk]), {"mode": "split"})
+    request_within_budget(client, "get", reverse("chatsnip:chat_source_code", args=[chats[0].pk]), {"message": "1"})
+    request_within_budget(client, "get", reverse("chatsnip:chat_source_zip", args=[chats[0].pk]))
+    request_within_budget(client, "get", reverse("chatsnip:tagged_source_zip"), {"tag": "python"})
+    request_within_budget(client, "get", reverse("chatsnip:codefragment_list"))
+    request_within_budget(client, "get", reverse("chatsnip:codefragment_update", args=[fragments[0].pk]))
+    request_within_budget(client, "post", reverse("chatsnip:fragment_delete"), {"fragment_id": fragments[1].pk})
+    request_within_budget(client, "get", reverse("chatsnip:profile"))
+    request_within_budget(client, "get", reverse("chatsnip:stats"))
+    request_within_budget(client, "get", reverse("chatsnip:metrics"))
+    request_within_budget(client, "post", reverse("chatsnip:chat_delete", args=[chats[2].pk]))
+
+    api_client = APIClient(HTTP_X_API_KEY=str(user.chatsnipprofile.api_key))
+    data = {
+        "chatId": "new",
+        "chatName": "New Chat",
+        "markdown": "",
+        "content": [
+            {"content": "Hello"},
+            {"language": "python", "filename": "a.py", "content": "print(1)"},
+            {"language": "python", "filename": "b.py", "content": "print(2)"},
+        ],
+    }
+    request_within_budget(api_client, "post", "/api/chats/", data, format="json")
+    sources = [f"http://images.example.com/image_{index}.png" for index in range(3)]
+    data = {"chatId": "images", "content": [{"content": "Images"}, *({"src": src, "content": "An image"} for src in sources[:2])]}
+    assert request_within_budget(api_client, "post", "/api/chats/", data, format="json").json()["status"] == "Process done. Saved chat & images."
+    data["content"] += [{"src": sources[2], "content": "Another image"}, {"language": "python", "filename": "c.py", "content": "print(3)"}]
+    assert request_within_budget(api_client, "post", "/api/chats/", data, format="json").json()["status"] == "Process done. Saved images & code."
+    request_within_budget(api_client, "get", "/api/chats/")
+    request_within_budget(api_client, "get", "/api/chats/", {"llm_model": "gpt-4o", "since": "2024-01-01"})
+    request_within_budget(api_client, "get", f"/api/chats/{chats[0].pk}/")
+    request_within_budget(api_client, "get", "/api/codefragments/")
+    data = {"chat_id": chats[0].pk, "filename": "c.py", "programming_language": "python", "source_code": "print(3)"}
+    request_within_budget(api_client, "post", "/api/codefragments/", data, format="json")
+
+    body = json.dumps({"chatId": "uploaded", "content": [{"language": "python", "filename": "d.py", "content": "print(4)"}]}).encode()
+    upload = request_within_budget(api_client, "post", "/api/uploads/", {"size": len(body)}, format="json").data
+    url = f"/api/uploads/{upload['id']}/"
+    request_within_budget(api_client, "patch", url, body, content_type="application/octet-stream", HTTP_UPLOAD_OFFSET="0")
+    request_within_budget(api_client, "get", url)
+    request_within_budget(api_client, "post", f"{url}finalize/")
+    upload = request_within_budget(api_client, "post", "/api/uploads/", format="json").data
+    request_within_budget(api_client, "delete", f"/api/uploads/{upload['id']}/")
@@ -1,4 +1,5 @@
 import hashlib
+import json
 import os
 
 import django
@@ -21,6 +22,7 @@ from chatsnipserver.services import (
     check_duplicate_code_fragment,
     clean_content,
     generate_checksum,
+    generate_json_checksum,
     identify_language,
 )
 
@@ -232,3 +234,60 @@ def test_clean_content():
     )
     cleaned_code = clean_content(raw_code, chat)
     assert cleaned_code == expected_cleaned_code
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "",
+        "a\tb\x0bc\x0cd\re\x1cf\x1fg",
+        "caf\u00e9 = 'cr\u00e8me'\n" * 50_000,
+        "x\u00a0=\u30001\u2028\x85y\u200bz",
+    ],
+)
+def test_generate_checksum_ignores_the_whitespace_of_str_split(content):
+    assert generate_checksum(content) == hashlib.sha256("".join(content.split()).encode("utf-8")).hexdigest()
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        None,
+        [{"content": "Hello,  world!", "language": "python"}],
+        {"nested": {"text": "x " * 100_000, "items": [1, 2.5, True, None]}},
+    ],
+)
+def test_generate_json_checksum_matches_serialized_checksum(data):
+    assert generate_json_checksum(data) == generate_checksum(json.dumps(data))
+
+
+@pytest.mark.django_db
+def test_compose_chat_view_selects_one_fragment_per_file(django_assert_num_queries):
+    from datetime import timedelta
+
+    from django.utils import timezone
+
+    from chatsnipserver.services import compose_chat_view
+
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    chat = Chat.objects.create(unique_identifier="123", name="Test Chat", json_data=[], user=user)
+    now = timezone.now()
+
+    def fragment(filename, source_code, minutes, selected=False):
+        return CodeFragment.objects.create(
+            chat=chat,
+            filename=filename,
+            programming_language="python",
+            source_code=source_code,
+            timestamp=now - timedelta(minutes=minutes),
+            selected=selected,
+        )
+
+    fragment("a.py", "a = 1", 30)
+    latest_a = fragment("a.py", "a = 2", 20)
+    selected_b = fragment("b.py", "b = 1", 10, selected=True)
+    fragment("b.py", "b = 2", 5)
+
+    with django_assert_num_queries(2):
+        selected_fragments = compose_chat_view(chat)["selected_fragments"]
+        assert list(selected_fragments.items()) == [("b.py", selected_b), ("a.py", latest_a)]
@@ -0,0 +1,93 @@
+import datetime
+
+import pytest
+from chatsnipserver.models import Chat, ChatImage, CodeFragment, UserDailyStat
+from chatsnipserver.stats import rebuild_stats, user_stats
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+
+def summary(user):
+    stats = user_stats(user, days=1)
+    return {key: stats[key] for key in ("chatbots", "llm_models", "languages", "chats", "fragments", "images", "image_bytes")}
+
+
+@pytest.mark.django_db
+def test_stats_follow_ingest_and_deletes():
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    client = APIClient(HTTP_X_API_KEY=str(user.chatsnipprofile.api_key))
+    content = [
+        {"content": "Hello"},
+        {"language": "python", "filename": "a.py", "content": "print(1)"},
+        {"language": "python", "filename": "b.py", "content": "print(2)"},
+        {"language": "rust", "filename": "main.rs", "content": "fn main() {}"},
+    ]
+    for identifier in ("first", "second"):
+        response = client.post("/api/chats/", {"chatId": identifier, "chatName": "Chat", "content": content, "markdown": ""}, format="json")
+        assert response.status_code == 200
+
+    stats = summary(user)
+    assert stats["chats"] == 2
+    assert stats["languages"] == [("python", 4), ("rust", 2)]
+    assert stats["chatbots"] == [("", 2)]
+    assert user_stats(user, days=3)["activity"][-1] == {"day": UserDailyStat.objects.get(metric="chatbot").day, "chats": 2, "fragments": 6, "images": 0}
+
+    CodeFragment.objects.filter(filename="main.rs").first().delete()
+    Chat.objects.get(unique_identifier="first").delete()
+    assert summary(user)["languages"] == [("python", 2)]
+    assert summary(user)["chats"] == 1
+
+
+@pytest.mark.django_db
+def test_stats_count_chats_created_anywhere_and_survive_a_rebuild():
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    client = APIClient(HTTP_X_API_KEY=str(user.chatsnipprofile.api_key))
+    content = [{"content": "Hello"}, {"language": "python", "filename": "a.py", "content": "print(1)"}]
+    assert client.post("/api/chats/", {"chatId": "api", "chatName": "Chat", "content": content, "markdown": ""}, format="json").status_code == 200
+    Chat.objects.create(unique_identifier="shell", name="Shell", json_data=[], user=user, chatbot="Claude")
+    assert summary(user)["chatbots"] == [("", 1), ("Claude", 1)]
+
+    earlier = timezone.now() - datetime.timedelta(days=3)
+    Chat.objects.update(created=earlier)
+    CodeFragment.objects.update(timestamp=earlier)
+    UserDailyStat.objects.update(day=timezone.localdate(earlier))
+    content.append({"language": "rust", "filename": "main.rs", "content": "fn main() {}"})
+    assert client.post("/api/chats/", {"chatId": "api", "chatName": "Chat", "content": content, "markdown": ""}, format="json").status_code == 200
+
+    def rollups():
+        return sorted(UserDailyStat.objects.filter(user=user).exclude(count=0, size=0).values_list("day", "metric", "key", "count", "size"))
+
+    incremental = rollups()
+    assert rebuild_stats(user) == len(incremental)
+    assert rollups() == incremental
+
+    Chat.objects.get(unique_identifier="shell").delete()
+    assert summary(user)["chats"] == 1
+    assert summary(user)["chatbots"] == [("", 1)]
+
+
+@pytest.mark.django_db
+def test_rebuild_stats_matches_incremental_stats(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    chat = Chat.objects.create(unique_identifier="1", name="Chat", json_data=[], user=user, chatbot="ChatGPT", llm_model="gpt-4o")
+    CodeFragment.objects.create(chat=chat, filename="a.py", programming_language="python", source_code="print(1)")
+    chat_image = ChatImage(chat=chat, source_url="http://example.com/a.png")
+    chat_image.image.save("a.png", ContentFile(b"12345"), save=False)
+    chat_image.save()
+    ChatImage.objects.filter(pk=chat_image.pk).update(size=None)
+
+    rebuild_stats()
+    stats = summary(user)
+    assert stats["chatbots"] == [("ChatGPT", 1)]
+    assert stats["llm_models"] == [("gpt-4o", 1)]
+    assert stats["languages"] == [("python", 1)]
+    assert (stats["images"], stats["image_bytes"]) == (1, 0)
+
+    from django.core.management import call_command
+    from io import StringIO
+
+    call_command("rebuild_stats", stdout=StringIO())
+    assert summary(user)["image_bytes"] == 5
@@ -0,0 +1,44 @@
+import re
+
+import pytest
+from chatsnipserver import services
+from chatsnipserver.models import Chat, ChatImage
+from chatsnipserver.storage import chat_image_url, sharded_path
+from chatsnipserver.tests.test_images import FakeResponse, png
+from django.contrib.auth import get_user_model
+
+
+def test_sharded_path():
+    assert sharded_path("chat_images", "abcdef", "a.png") == "chat_images/ab/cd/a.png"
+    assert re.fullmatch(r"chat_images/[0-9a-f]{2}/[0-9a-f]{2}/a\.png", sharded_path("chat_images", None, "a.png"))
+
+
+@pytest.mark.django_db
+def test_images_stream_to_s3_and_redirect_to_signed_urls(settings, monkeypatch, client):
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    s3 = pytest.importorskip("storages.backends.s3")
+    settings.CHATSNIP_SIGNED_IMAGE_URLS = True
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    other_user = get_user_model().objects.create_user(username="other", password="testpass")
+    chat = Chat.objects.create(unique_identifier="1", name="Chat", json_data=[], user=user)
+    monkeypatch.setattr(services.requests, "get", lambda url, **kwargs: FakeResponse(png(64, 48)))
+
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="chatsnip")
+        storage = s3.S3Storage(bucket_name="chatsnip", access_key="testing", secret_key="testing", region_name="us-east-1")
+        monkeypatch.setattr(ChatImage._meta.get_field("image"), "storage", storage)
+
+        chat_image = services.download_and_save_image(chat, "http://example.com/a.png")["image"]
+        assert chat_image.image.name.startswith(f"chat_images/{chat_image.checksum[:2]}/{chat_image.checksum[2:4]}/")
+        assert storage.exists(chat_image.image.name)
+
+        url = chat_image_url(chat_image)
+        client.force_login(user)
+        response = client.get(url)
+        assert response.status_code == 302
+        assert "Signature=" in response["Location"]
+        assert "private" in response["Cache-Control"]
+
+        client.force_login(other_user)
+        assert client.get(url).status_code == 404
@@ -0,0 +1,50 @@
+import pytest
+from chatsnipserver.models import Chat, UserTagCount
+from chatsnipserver.tags import autocomplete_tags, filter_chats_by_tags, rebuild_tag_counts, tag_cloud
+from django.contrib.auth import get_user_model
+
+
+def counts(user):
+    return dict(UserTagCount.objects.filter(user=user, count__gt=0).values_list("tag__name", "count"))
+
+
+@pytest.mark.django_db
+def test_tag_counts_follow_tag_changes():
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    other = get_user_model().objects.create(username="other", password="testpass")
+    first, second = (Chat.objects.create(unique_identifier=str(i), name="Chat", json_data=[], user=user) for i in range(2))
+    Chat.objects.create(unique_identifier="other", name="Chat", json_data=[], user=other).tags.add("python")
+
+    first.tags.add("python", "django")
+    second.tags.add("python")
+    assert counts(user) == {"python": 2, "django": 1}
+
+    first.tags.set(["django", "sqlite"])
+    assert counts(user) == {"python": 1, "django": 1, "sqlite": 1}
+
+    second.tags.clear()
+    first.delete()
+    assert counts(user) == {}
+    assert counts(other) == {"python": 1}
+
+    UserTagCount.objects.all().delete()
+    assert rebuild_tag_counts() == 1
+    assert counts(other) == {"python": 1}
+
+
+@pytest.mark.django_db
+def test_tag_filter_cloud_and_autocomplete():
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    chats = [Chat.objects.create(unique_identifier=str(i), name=f"Chat {i}", json_data=[], user=user) for i in range(4)]
+    for chat in chats:
+        chat.tags.add("python")
+    chats[0].tags.add("django", "postgres")
+    chats[1].tags.add("django")
+
+    assert set(filter_chats_by_tags(Chat.objects.all(), user, ["python", "django"])) == {chats[0], chats[1]}
+    assert list(filter_chats_by_tags(Chat.objects.all(), user, ["django", "postgres"])) == [chats[0]]
+    assert not filter_chats_by_tags(Chat.objects.all(), user, ["django", "missing"]).exists()
+
+    cloud = {tag["name"]: (tag["count"], tag["weight"]) for tag in tag_cloud(user)}
+    assert cloud == {"django": (2, 3), "postgres": (1, 1), "python": (4, 5)}
+    assert [tag["name"] for tag in autocomplete_tags(user, "P")] == ["python", "postgres"]
@@ -0,0 +1,60 @@
+import pytest
+from chatsnipserver.throttling import IngestCoalescer, LocalTokenBucketBackend, parse_rate
+
+
+def test_parse_rate():
+    assert parse_rate("60/min") == (60, 60)
+    assert parse_rate("5/s") == (5, 1)
+
+
+def test_token_bucket_refuses_when_empty():
+    backend = LocalTokenBucketBackend()
+    assert backend.consume("key", capacity=2, refill_rate=0.5) == 0
+    assert backend.consume("key", capacity=2, refill_rate=0.5) == 0
+    assert backend.consume("key", capacity=2, refill_rate=0.5) == pytest.approx(2, abs=0.01)
+    assert backend.consume("other", capacity=2, refill_rate=0.5) == 0
+
+
+def test_token_bucket_drops_full_and_least_recent_buckets(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("chatsnipserver.throttling.time.monotonic", lambda: now)
+    backend = LocalTokenBucketBackend(maxsize=2)
+    for key in ("a", "b", "c"):
+        backend.consume(key, capacity=2, refill_rate=1)
+    assert list(backend._buckets) == ["b", "c"]
+    backend.consume("b", capacity=2, refill_rate=1)
+    assert backend.consume("b", capacity=2, refill_rate=1) == pytest.approx(1)
+
+    now += 0.5
+    backend.consume("d", capacity=2, refill_rate=1)
+    assert list(backend._buckets) == ["b", "d"]
+    now += 10
+    backend.consume("e", capacity=2, refill_rate=1)
+    assert list(backend._buckets) == ["e"]
+
+
+def test_coalescer_runs_latest_queued_payload():
+    coalescer = IngestCoalescer()
+    handled = []
+
+    def handler(payload):
+        handled.append(payload)
+        if payload == "first":
+            assert coalescer.run("chat", "second", handler) is None
+            assert coalescer.run("chat", "third", handler) is None
+        return payload
+
+    assert coalescer.run("chat", "first", handler) == "third"
+    assert handled == ["first", "third"]
+    assert coalescer.run("chat", "fourth", handler) == "fourth"
+
+
+def test_coalescer_releases_key_on_error():
+    coalescer = IngestCoalescer()
+
+    def handler(payload):
+        raise ValueError(payload)
+
+    with pytest.raises(ValueError):
+        coalescer.run("chat", "first", handler)
+    assert coalescer.run("chat", "second", lambda payload: payload) == "second"
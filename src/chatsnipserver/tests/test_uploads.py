@@ -0,0 +1,134 @@
+import gzip
+import io
+import json
+import os
+import uuid
+import zlib
+from datetime import timedelta
+
+import pytest
+from chatsnipserver.models import Chat, ChatUpload
+from chatsnipserver.uploads import JSONStreamDecoder, PayloadTooLarge, load_json_stream
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.test import APIClient
+
+CHAT = {
+    "chatId": "large",
+    "chatName": "Large Chat",
+    "content": [
+        {"content": "Write a script " * 2000},
+        {"language": "python", "filename": "main.py", "content": "print('\\u00e6\\u00f8\\u00e5')\n" * 500},
+        {"content": 'Done, with "quotes" and a number', "score": 1.5e3, "tags": [{"nested": [None, True]}]},
+    ],
+}
+
+
+@pytest.fixture
+def api_client(settings, tmp_path):
+    settings.CHATSNIP_UPLOAD_DIR = str(tmp_path / "uploads")
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    return APIClient(HTTP_X_API_KEY=str(user.chatsnipprofile.api_key))
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 4096])
+def test_stream_decoder_matches_json(read_size):
+    text = json.dumps(CHAT, indent=1)
+    assert JSONStreamDecoder(io.StringIO(text), read_size=read_size).decode() == CHAT
+    assert JSONStreamDecoder(io.StringIO(" [1, 20, {}, []] "), read_size=read_size).decode() == [1, 20, {}, []]
+    assert JSONStreamDecoder(io.StringIO("123"), read_size=read_size).decode() == 123
+
+
+def test_stream_decoder_read_boundaries():
+    numbers = [0.7, 1e5, -12.5e-3, 123456789, -0, 1.0e10, 2e-7, 3.25, 0]
+    for padding in range(12):
+        text = json.dumps({"pad": "x" * padding, "content": [numbers, *numbers, {"n": 10.5}], "last": 1.5e3})
+        for read_size in (1, 2, 3, 5, 7):
+            assert JSONStreamDecoder(io.StringIO(text), read_size=read_size).decode() == json.loads(text)
+
+
+@pytest.mark.parametrize("text", ['{"a": 1', '{"a": 1} x', '{"a" 1}', '{"a": [1 2]}', '{"a": "b}', "[1,]", ""])
+def test_stream_decoder_rejects_invalid_json(text):
+    with pytest.raises(exceptions.ParseError):
+        JSONStreamDecoder(io.StringIO(text), read_size=3).decode()
+
+
+def test_load_compressed_json_stream():
+    body = json.dumps(CHAT).encode()
+    assert load_json_stream(io.BytesIO(gzip.compress(body)), "gzip") == CHAT
+    assert load_json_stream(io.BytesIO(zlib.compress(body)), "deflate") == CHAT
+    with pytest.raises(PayloadTooLarge):
+        load_json_stream(io.BytesIO(gzip.compress(b"[" + b" " * 10_000 + b"]")), "gzip", limit=1000)
+    with pytest.raises(exceptions.UnsupportedMediaType):
+        load_json_stream(io.BytesIO(body), "br")
+
+
+@pytest.mark.django_db
+def test_chunked_upload_resumes_and_saves_the_chat(api_client):
+    body = gzip.compress(json.dumps(CHAT).encode())
+    response = api_client.post("/api/uploads/", {"size": len(body), "encoding": "gzip"}, format="json")
+    assert response.status_code == 201
+    url = response["Location"]
+    assert response.data["offset"] == 0
+
+    size = len(body) // 5 + 1
+    chunks = [body[i : i + size] for i in range(0, len(body), size)]
+    for offset, chunk in zip(range(0, len(body), size), chunks[:2]):
+        response = api_client.patch(url, chunk, content_type="application/octet-stream", HTTP_UPLOAD_OFFSET=str(offset))
+        assert response.data["offset"] == offset + len(chunk)
+    # A retried chunk that was already stored is refused with the offset to resume from.
+    response = api_client.patch(url, chunks[1], content_type="application/octet-stream", HTTP_UPLOAD_OFFSET=str(size))
+    assert (response.status_code, response.data["offset"]) == (409, 2 * size)
+    assert api_client.post(f"{url}finalize/").status_code == 409
+
+    offset = api_client.get(url).data["offset"]
+    for chunk in chunks[2:]:
+        offset = api_client.patch(url, chunk, content_type="application/octet-stream", HTTP_UPLOAD_OFFSET=str(offset)).data["offset"]
+    response = api_client.patch(url, b"x", content_type="application/octet-stream", HTTP_UPLOAD_OFFSET=str(offset))
+    assert response.status_code == 413
+
+    response = api_client.post(f"{url}finalize/")
+    assert response.data["status"] == "Process done. Saved chat & code."
+    chat = Chat.objects.get(unique_identifier="large")
+    assert chat.json_data == CHAT["content"]
+    assert not ChatUpload.objects.exists()
+    assert api_client.get(url).status_code == 404
+
+
+@pytest.mark.django_db
+def test_invalid_upload_is_kept(api_client):
+    upload = api_client.post("/api/uploads/", {"encoding": "identity"}, format="json").data
+    url = f"/api/uploads/{upload['id']}/"
+    api_client.patch(url, b'{"chatId": "1", "content": [', content_type="application/octet-stream", HTTP_UPLOAD_OFFSET="0")
+    assert api_client.post(f"{url}finalize/").status_code == 400
+    assert ChatUpload.objects.filter(pk=upload["id"]).exists()
+    assert api_client.delete(url).status_code == 204
+    assert not ChatUpload.objects.exists()
+    assert api_client.post("/api/uploads/", {"encoding": "br"}, format="json").status_code == 400
+    assert api_client.post("/api/uploads/", {"size": 10**12}, format="json").status_code == 413
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("path", ["/api/chats/", "/api/uploads/"])
+def test_compressed_request_body(api_client, path):
+    body = gzip.compress(json.dumps(CHAT if path == "/api/chats/" else {"size": 10}).encode())
+    response = api_client.generic("POST", path, body, content_type="application/json", HTTP_CONTENT_ENCODING="gzip")
+    assert response.status_code == (200 if path == "/api/chats/" else 201)
+
+
+@pytest.mark.django_db
+def test_clear_stale_uploads(api_client, settings, tmp_path):
+    stale = api_client.post("/api/uploads/", format="json").data["id"]
+    fresh = api_client.post("/api/uploads/", format="json").data["id"]
+    for upload in (stale, fresh):
+        api_client.patch(f"/api/uploads/{upload}/", b"{", content_type="application/octet-stream", HTTP_UPLOAD_OFFSET="0")
+    ChatUpload.objects.filter(pk=stale).update(created=timezone.now() - timedelta(days=2))
+    orphan = tmp_path / "uploads" / "orphan"
+    orphan.mkdir()
+    os.utime(orphan, (0, 0))
+
+    call_command("clear_stale_uploads", stdout=io.StringIO())
+    assert list(ChatUpload.objects.values_list("pk", flat=True)) == [uuid.UUID(fresh)]
+    assert sorted(path.name for path in (tmp_path / "uploads").iterdir()) == [fresh]
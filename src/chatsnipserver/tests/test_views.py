@@ -1,7 +1,12 @@
+import asyncio
+from datetime import timedelta
+
 import pytest
 from chatsnipserver.models import Chat, CodeFragment
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
 
 
@@ -57,3 +62,234 @@ def test_code_fragment_create_view():
     response = client.post(url, data, format="json")
     assert response.status_code == 201
     assert response.data["status"] == "Code fragment saved."
+
+
+@pytest.mark.django_db
+def test_chat_create_is_rate_limited(settings):
+    settings.CHATSNIP_RATE_LIMIT = "1/min"
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    client = APIClient(HTTP_X_API_KEY=str(user.chatsnipprofile.api_key))
+    data = {"chatId": "123", "chatName": "Test Chat", "markdown": "", "content": [{"content": "Hello"}]}
+    assert client.post("/api/chats/", data, format="json").status_code == 200
+    response = client.post("/api/chats/", data, format="json")
+    assert response.status_code == 429
+    assert int(response["Retry-After"]) > 0
+
+
+@pytest.mark.django_db
+def test_chat_source_code_view_loads_other_versions_lazily(client):
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    client.force_login(user)
+    chat = Chat.objects.create(unique_identifier="123", name="Test Chat", json_data=[], user=user)
+    old = CodeFragment.objects.create(chat=chat, filename="a.py", programming_language="python", source_code="old_version = 1")
+    CodeFragment.objects.create(chat=chat, filename="a.py", programming_language="python", source_code="new_version = 2")
+
+    content = client.get(reverse("chatsnip:chat_source_code", args=[chat.pk])).content.decode()
+    assert "new_version" in content
+    assert "old_version" not in content
+    assert reverse("chatsnip:fragment_highlighted", args=[old.pk]) in content
+
+    response = client.get(reverse("chatsnip:fragment_highlighted", args=[old.pk]))
+    assert response.json()["id"] == old.pk
+    assert "old_version" in response.json()["html"]
+
+    other_user = get_user_model().objects.create_user(username="other", password="testpass")
+    client.force_login(other_user)
+    assert client.get(reverse("chatsnip:fragment_highlighted", args=[old.pk])).status_code == 404
+    assert client.get(reverse("chatsnip:chat_source_code", args=[chat.pk])).status_code == 404
+    assert client.get(reverse("chatsnip:chat_source_code", args=[chat.pk]), {"message": "1"}).status_code == 404
+
+
+@pytest.mark.django_db
+def test_chat_detail_conditional_get(client, django_assert_max_num_queries):
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    client.force_login(user)
+    chat = Chat.objects.create(unique_identifier="123", name="Test Chat", json_data=[], markdown="Hello", user=user)
+    url = reverse("chatsnip:chat_detail", args=[chat.pk])
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert "no-cache" in response["Cache-Control"]
+    etag = response["ETag"]
+
+    with django_assert_max_num_queries(3):
+        assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    CodeFragment.objects.create(chat=chat, filename="a.py", programming_language="python", source_code="x = 1")
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+
+@pytest.mark.django_db
+def test_chat_api_is_scoped_and_conditional():
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    other_user = get_user_model().objects.create(username="other", password="testpass")
+    chat = Chat.objects.create(unique_identifier="123", name="Test Chat", json_data=[], user=user)
+    Chat.objects.create(unique_identifier="456", name="Other Chat", json_data=[], user=other_user)
+    client = APIClient(HTTP_X_API_KEY=str(user.chatsnipprofile.api_key))
+
+    response = client.get("/api/chats/")
+    assert [item["id"] for item in response.data] == [chat.pk]
+    assert client.get("/api/chats/", HTTP_IF_NONE_MATCH=response["ETag"]).status_code == 304
+
+    response = client.get(f"/api/chats/{chat.pk}/")
+    assert response.data["name"] == "Test Chat"
+    assert client.get(f"/api/chats/{chat.pk}/", HTTP_IF_NONE_MATCH=response["ETag"]).status_code == 304
+    assert APIClient().get("/api/chats/").status_code == 403
+
+
+def mock_image_transport(delay=0.0):
+    from io import BytesIO
+
+    import httpx
+    from PIL import Image
+
+    async def handler(request):
+        await asyncio.sleep(delay)
+        buffer = BytesIO()
+        Image.new("RGB", (40, 30), (int(request.url.path[-5]) * 50, 0, 0)).save(buffer, format="PNG")
+        return httpx.Response(200, content=buffer.getvalue(), headers={"Content-Type": "image/png"})
+
+    return httpx.MockTransport(handler)
+
+
+@pytest.mark.django_db
+def test_async_ingest_downloads_images_concurrently(settings, tmp_path, monkeypatch):
+    import functools
+    import time
+
+    from chatsnipserver import services
+
+    settings.MEDIA_ROOT = tmp_path
+    monkeypatch.setattr(services.httpx, "AsyncClient", functools.partial(services.httpx.AsyncClient, transport=mock_image_transport(delay=0.3)))
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    client = APIClient(HTTP_X_API_KEY=str(user.chatsnipprofile.api_key))
+    sources = [f"http://images.example.com/image_{index}.png" for index in range(4)]
+    data = {
+        "chatId": "123",
+        "chatName": "Test Chat",
+        "markdown": " ".join(f"![image]({src})" for src in sources),
+        "content": [{"src": src, "content": "An image"} for src in sources],
+    }
+
+    started = time.perf_counter()
+    response = client.post("/api/chats/", data, format="json")
+    assert time.perf_counter() - started < 1.2
+    assert response.status_code == 200
+    assert response.json()["status"] == "Process done. Saved chat & images."
+
+    chat = Chat.objects.get(unique_identifier="123")
+    assert chat.images.count() == 4
+    assert chat.images_downloaded
+    assert "images.example.com" not in chat.markdown
+
+
+@pytest.mark.django_db
+def test_async_ingest_under_asgi():
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    post = async_to_sync(AsyncClient().post)
+    headers = {"X-Api-Key": str(user.chatsnipprofile.api_key)}
+    data = {"chatId": "123", "chatName": "Test Chat", "markdown": "", "content": [{"language": "python", "filename": "a.py", "content": "a = 1"}]}
+
+    response = post("/api/chats/", data, content_type="application/json", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["status"] == "Process done. Saved chat & code."
+    assert post("/api/chats/", data, content_type="application/json", headers=headers).status_code == 208
+    assert post("/api/chats/", data, content_type="application/json").status_code == 400
+
+
+@pytest.mark.django_db
+def test_failed_ingest_saves_nothing_and_removes_image_files(settings, tmp_path, monkeypatch):
+    import functools
+
+    from chatsnipserver import services
+    from chatsnipserver.models import ChatImage
+
+    settings.MEDIA_ROOT = tmp_path
+    monkeypatch.setattr(services.httpx, "AsyncClient", functools.partial(services.httpx.AsyncClient, transport=mock_image_transport()))
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    client = APIClient(HTTP_X_API_KEY=str(user.chatsnipprofile.api_key))
+    sources = [f"http://images.example.com/image_{index}.png" for index in range(2)]
+    data = {
+        "chatId": "123",
+        "chatName": "Test Chat",
+        "markdown": "",
+        "content": [*({"src": src, "content": "An image"} for src in sources), {"language": "python", "filename": "a.py", "content": "a = 1"}],
+    }
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("Database is gone")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(CodeFragment.objects, "bulk_create", fail)
+        with pytest.raises(RuntimeError):
+            client.post("/api/chats/", data, format="json")
+    assert not Chat.objects.exists()
+    assert not ChatImage.objects.exists()
+    assert not [path for path in tmp_path.rglob("*") if path.is_file()]
+
+    response = client.post("/api/chats/", data, format="json")
+    assert response.json()["status"] == "Process done. Saved chat & images & code."
+    chat = Chat.objects.get(unique_identifier="123")
+    assert (chat.images.count(), chat.code_fragments.count(), chat.images_downloaded) == (2, 1, True)
+    assert len([path for path in tmp_path.rglob("*") if path.is_file()]) == 2
+
+
+@pytest.mark.django_db
+def test_chats_are_filtered_by_chatbot_model_and_date():
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    client = APIClient(HTTP_X_API_KEY=str(user.chatsnipprofile.api_key))
+    for identifier, chatbot, model in (("a", "ChatGPT", "gpt-4o"), ("b", "ChatGPT", "o3"), ("c", "Claude", None)):
+        data = {"chatId": identifier, "chatName": identifier, "chatbot": chatbot, "llmModel": model, "content": [{"content": "Hi"}], "markdown": ""}
+        assert client.post("/api/chats/", data, format="json").status_code == 200
+    Chat.objects.filter(unique_identifier="a").update(timestamp=timezone.now() - timedelta(days=10))
+
+    def names(**params):
+        return sorted(chat["unique_identifier"] for chat in client.get("/api/chats/", params).json())
+
+    assert names(chatbot="ChatGPT") == ["a", "b"]
+    assert names(chatbot="ChatGPT", llm_model="o3") == ["b"]
+    assert names(since=(timezone.localdate() - timedelta(days=1)).isoformat()) == ["b", "c"]
+    assert names(until=(timezone.localdate() - timedelta(days=5)).isoformat()) == ["a"]
+    assert client.get("/api/chats/", {"since": "yesterday"}).status_code == 400
+    assert Chat.objects.get(unique_identifier="c").llm_model is None
+
+
+@pytest.mark.django_db
+def test_chat_list_shows_the_users_chats(client):
+    user = get_user_model().objects.create_user(username="testuser", password="testpass")
+    other = get_user_model().objects.create_user(username="other", password="testpass")
+    mine = Chat.objects.create(unique_identifier="1", name="Mine", json_data=[], user=user, chatbot="ChatGPT")
+    Chat.objects.create(unique_identifier="2", name="Other", json_data=[], user=other, chatbot="ChatGPT")
+    client.force_login(user)
+
+    response = client.get(reverse("chatsnip:chat_list"), {"chatbot": "ChatGPT"})
+    assert list(response.context["chats"]) == [mine]
+    if connection.vendor == "sqlite":
+        assert "chat_user_chatbot_idx" in response.context["view"].queryset.explain()
+    assert "auth_user" not in str(response.context["view"].queryset.query)
+    assert list(client.get(reverse("chatsnip:chat_list"), {"user": "other"}).context["chats"]) == [mine]
+
+
+@pytest.mark.django_db
+def test_sync_ingest_survives_failed_image_downloads(settings, monkeypatch):
+    import requests
+
+    from chatsnipserver import services
+
+    def timeout(*args, **kwargs):
+        raise requests.Timeout("timed out")
+
+    settings.CHATSNIP_ASYNC_INGEST = False
+    monkeypatch.setattr(services.requests, "get", timeout)
+    user = get_user_model().objects.create(username="testuser", password="testpass")
+    client = APIClient(HTTP_X_API_KEY=str(user.chatsnipprofile.api_key))
+    data = {"chatId": "123", "chatName": "Test Chat", "markdown": "", "content": [{"src": "http://images.example.com/slow.png", "content": "An image"}]}
+
+    response = client.post("/api/chats/", data, format="json")
+    assert response.status_code == 200
+    chat = Chat.objects.get(unique_identifier="123")
+    assert not chat.images.exists()
+    assert services.download_image(chat, "http://images.example.com/slow.png") == {"status": False, "message": "Failed to download image"}
@@ -0,0 +1,201 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+_IN_FLIGHT = object()
+
+
+def parse_rate(rate: str) -> tuple[int, float]:
+    """Parse a rate such as ``"60/min"`` into a request count and a period in seconds.
+
+    Args:
+        rate (str): The rate, as ``<requests>/<period>`` where the period starts with s, m, h or d.
+
+    Returns:
+        tuple[int, float]: The number of requests and the period length in seconds.
+    """
+    num, period = rate.split("/")
+    return int(num), {"s": 1, "m": 60, "h": 3600, "d": 86400}[period[0]]
+
+
+class LocalTokenBucketBackend:
+    """Token buckets kept in process memory, least recently used first.
+
+    Buckets that have refilled to capacity are dropped, since a missing bucket is
+    a full one. At most ``maxsize`` buckets are kept; past that the least recently
+    used ones are dropped even if they are not full.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, capacity: float, refill_rate: float) -> float:
+        """Take one token from the bucket for ``key``.
+
+        Args:
+            key (str): The bucket identifier.
+            capacity (float): The maximum number of tokens, i.e. the allowed burst.
+            refill_rate (float): The number of tokens added per second.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the number of seconds until one is available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.pop(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / refill_rate
+            tokens = tokens - 1 if tokens >= 1 else tokens
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / refill_rate)
+            self._evict(now)
+            return wait
+
+    def _evict(self, now: float) -> None:
+        while self._buckets:
+            oldest = next(iter(self._buckets))
+            if self._buckets[oldest][2] > now and len(self._buckets) <= self.maxsize:
+                break
+            del self._buckets[oldest]
+
+
+class CacheTokenBucketBackend:
+    """Token buckets kept in a Django cache, shared by all processes using that cache.
+
+    Updates are read-modify-write without a lock, so concurrent requests for the
+    same key may occasionally both get the last token.
+    """
+
+    def __init__(self, alias: str = "default"):
+        self.cache = caches[alias]
+
+    def consume(self, key: str, capacity: float, refill_rate: float) -> float:
+        now = time.time()
+        cache_key = f"chatsnip:bucket:{key}"
+        tokens, updated = self.cache.get(cache_key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill_rate)
+        timeout = int(capacity / refill_rate) + 1
+        if tokens >= 1:
+            self.cache.set(cache_key, (tokens - 1, now), timeout)
+            return 0
+        self.cache.set(cache_key, (tokens, now), timeout)
+        return (1 - tokens) / refill_rate
+
+
+local_backend = LocalTokenBucketBackend(getattr(settings, "CHATSNIP_RATE_LIMIT_LOCAL_SIZE", 10000))
+
+
+def get_backend():
+    """Return the token bucket backend selected by ``CHATSNIP_RATE_LIMIT_BACKEND``."""
+    backend = getattr(settings, "CHATSNIP_RATE_LIMIT_BACKEND", "local")
+    if backend == "cache":
+        return CacheTokenBucketBackend(getattr(settings, "CHATSNIP_RATE_LIMIT_CACHE", "default"))
+    return local_backend
+
+
+class ApiKeyRateThrottle(BaseThrottle):
+    """Token-bucket throttle keyed by the authenticated API key, or the client address.
+
+    The sustained rate comes from ``CHATSNIP_RATE_LIMIT`` and the burst size from
+    ``CHATSNIP_RATE_LIMIT_BURST``, which defaults to the number of requests in the rate.
+    DRF turns a refused request into a 429 response with a ``Retry-After`` header.
+    """
+
+    def __init__(self):
+        rate = getattr(settings, "CHATSNIP_RATE_LIMIT", "60/min")
+        self.num_requests, self.period = parse_rate(rate)
+        self.capacity = getattr(settings, "CHATSNIP_RATE_LIMIT_BURST", self.num_requests)
+        self.backend = get_backend()
+        self.wait_time = 0
+
+    def get_cache_key(self, request, view) -> str:
+        if api_key_hash := getattr(request.auth, "api_key_hash", None):
+            return api_key_hash
+        return self.get_ident(request)
+
+    def allow_request(self, request, view) -> bool:
+        self.wait_time = self.backend.consume(self.get_cache_key(request, view), self.capacity, self.num_requests / self.period)
+        return self.wait_time == 0
+
+    def wait(self) -> float:
+        return self.wait_time
+
+
+class IngestCoalescer:
+    """Collapse concurrent submissions for the same chat into a single ingest.
+
+    While an ingest for a key is running, newer submissions are not processed
+    alongside it. Each one replaces the queued payload instead, and the running
+    request ingests the latest queued payload once it is done. Coalescing is
+    local to the process.
+    """
+
+    def __init__(self):
+        self._queued = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, payload, handler):
+        """Ingest ``payload`` with ``handler``, or queue it if an ingest for ``key`` is running.
+
+        Args:
+            key: Identifies the chat being ingested.
+            payload: The submitted data.
+            handler (Callable): Called with a payload to ingest it.
+
+        Returns:
+            The result of the handler for the last ingested payload, or None if the
+            payload was queued for the running ingest.
+        """
+        with self._lock:
+            if key in self._queued:
+                self._queued[key] = payload
+                return None
+            self._queued[key] = _IN_FLIGHT
+
+        try:
+            while True:
+                result = handler(payload)
+                with self._lock:
+                    payload = self._queued[key]
+                    if payload is _IN_FLIGHT:
+                        del self._queued[key]
+                        return result
+                    self._queued[key] = _IN_FLIGHT
+        except BaseException:
+            with self._lock:
+                self._queued.pop(key, None)
+            raise
+
+    async def arun(self, key, payload, handler):
+        """Async version of ``run``, for a handler returning a coroutine.
+
+        The lock is never held across an ``await``, so sync and async submissions
+        for the same key coalesce with each other.
+        """
+        with self._lock:
+            if key in self._queued:
+                self._queued[key] = payload
+                return None
+            self._queued[key] = _IN_FLIGHT
+
+        try:
+            while True:
+                result = await handler(payload)
+                with self._lock:
+                    payload = self._queued[key]
+                    if payload is _IN_FLIGHT:
+                        del self._queued[key]
+                        return result
+                    self._queued[key] = _IN_FLIGHT
+        except BaseException:
+            with self._lock:
+                self._queued.pop(key, None)
+            raise
+
+
+ingest_coalescer = IngestCoalescer()
@@ -0,0 +1,363 @@
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import zlib
+
+from django.conf import settings
+from rest_framework import exceptions, status
+from rest_framework.parsers import JSONParser
+
+DEFAULT_UPLOAD_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_UPLOAD_EXPIRY_HOURS = 24
+CONTENT_ENCODINGS = ("identity", "gzip", "deflate", "zstd")
+READ_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_CHARACTERS = frozenset("0123456789.eE+-")
+_decoder = json.JSONDecoder()
+
+
+class PayloadTooLarge(exceptions.APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Payload too large."
+    default_code = "payload_too_large"
+
+
+class OffsetMismatch(exceptions.APIException):
+    """Raised when a chunk does not start where the upload ends. ``offset`` is where it does end."""
+
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Chunk does not start at the offset of the upload."
+    default_code = "offset_mismatch"
+
+    def __init__(self, offset: int):
+        super().__init__()
+        self.offset = offset
+
+
+def upload_max_bytes() -> int:
+    """The largest upload accepted, both as sent and decompressed, from ``CHATSNIP_UPLOAD_MAX_BYTES``."""
+    return getattr(settings, "CHATSNIP_UPLOAD_MAX_BYTES", DEFAULT_UPLOAD_MAX_BYTES)
+
+
+def upload_dir() -> str:
+    """The directory the chunks of uploads are stored in, from ``CHATSNIP_UPLOAD_DIR``."""
+    return getattr(settings, "CHATSNIP_UPLOAD_DIR", None) or os.path.join(tempfile.gettempdir(), "chatsnip-uploads")
+
+
+def normalize_encoding(encoding: str | None) -> str:
+    """Check a ``Content-Encoding`` and return it in lower case, ``identity`` if it is empty."""
+    encoding = (encoding or "").strip().lower() or "identity"
+    if encoding not in CONTENT_ENCODINGS:
+        raise exceptions.UnsupportedMediaType(encoding, f"Unsupported content encoding {encoding!r}.")
+    return encoding
+
+
+class _LimitedReader(io.RawIOBase):
+    """Read a binary stream, refusing to read more than ``limit`` bytes from it."""
+
+    def __init__(self, stream, limit: int):
+        self.stream = stream
+        self.remaining = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # Read one byte past the limit to tell a stream of exactly the limit from a longer one.
+        data = self.stream.read(min(len(buffer), self.remaining + 1))
+        if len(data) > self.remaining:
+            raise PayloadTooLarge()
+        self.remaining -= len(data)
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class _ZlibReader(io.RawIOBase):
+    """Decompress a deflate stream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decompressor = zlib.decompressobj()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = b""
+        while not data and not self.decompressor.eof:
+            compressed = self.decompressor.unconsumed_tail or self.stream.read(READ_SIZE)
+            if not compressed:
+                raise exceptions.ParseError("Truncated deflate stream.")
+            data = self.decompressor.decompress(compressed, len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def _zstd_reader(stream):
+    try:
+        from compression import zstd
+    except ImportError:
+        pass
+    else:
+        return zstd.ZstdFile(stream)
+    try:
+        import zstandard
+    except ImportError:
+        raise exceptions.UnsupportedMediaType("zstd", "zstd content encoding requires the zstandard package.")
+    return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+
+
+def decoded_stream(stream, encoding: str | None, limit: int | None = None) -> io.BufferedReader:
+    """
+    Decompress a request body as it is read.
+
+    Args:
+        stream: The binary stream of the body.
+        encoding (str | None): Its ``Content-Encoding``: identity, gzip, deflate or zstd. zstd needs the ``zstandard`` package before Python 3.14.
+        limit (int, optional): The most bytes to decompress, to stop decompression bombs. Defaults to ``CHATSNIP_UPLOAD_MAX_BYTES``.
+
+    Returns:
+        io.BufferedReader: The decompressed body, which raises ``PayloadTooLarge`` when more than ``limit`` bytes are read.
+    """
+    encoding = normalize_encoding(encoding)
+    if encoding == "gzip":
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    elif encoding == "deflate":
+        stream = _ZlibReader(stream)
+    elif encoding == "zstd":
+        stream = _zstd_reader(stream)
+    return io.BufferedReader(_LimitedReader(stream, upload_max_bytes() if limit is None else limit), READ_SIZE)
+
+
+class JSONStreamDecoder:
+    """Decode a JSON document from a text stream without reading all of it into one string.
+
+    The top-level object or array and the containers directly inside it, like the
+    ``content`` list of a chat, are parsed member by member. Every other value is
+    decoded by ``json`` from a buffer that only holds the value being decoded, so the
+    largest string held besides the result is about the size of the largest message.
+    """
+
+    def __init__(self, stream, read_size: int = READ_SIZE, stream_depth: int = 2):
+        self.stream = stream
+        self.read_size = read_size
+        self.stream_depth = stream_depth
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def decode(self):
+        """Decode the document. Raises ``ParseError`` if it is not valid JSON."""
+        value = self._parse(0)
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                raise exceptions.ParseError("JSON parse error - Extra data after the document.")
+            if self.eof:
+                return value
+            self._read(self.read_size)
+
+    def _read(self, size: int):
+        data = self.stream.read(size)
+        if not data:
+            self.eof = True
+        self.buffer = self.buffer[self.pos :] + data
+        self.pos = 0
+
+    def _peek(self) -> str:
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise exceptions.ParseError("JSON parse error - Unexpected end of data.")
+            self._read(self.read_size)
+
+    def _expect(self, characters: str) -> str:
+        character = self._peek()
+        if character not in characters:
+            raise exceptions.ParseError(f"JSON parse error - Expecting {' or '.join(map(repr, characters))}, found {character!r}.")
+        self.pos += 1
+        return character
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as error:
+                if self.eof:
+                    raise exceptions.ParseError(f"JSON parse error - {error}")
+            else:
+                if self.eof or self._complete(value, end):
+                    self.pos = end
+                    return value
+            # Grow the buffer by at least its own size, so a long value is decoded a few times rather than once per read.
+            self._read(max(self.read_size, len(self.buffer) - self.pos))
+
+    def _complete(self, value, end: int) -> bool:
+        """Whether a decoded value can't go on in the next read, like ``0.`` + ``7`` or ``1`` + ``e5``."""
+        if end >= len(self.buffer):
+            return False
+        return not isinstance(value, (int, float)) or self.buffer[end] not in _NUMBER_CHARACTERS
+
+    def _parse(self, depth: int):
+        opening = self._peek()
+        if depth >= self.stream_depth or opening not in "[{":
+            return self._value()
+        self.pos += 1
+        closing = "]" if opening == "[" else "}"
+        result = [] if opening == "[" else {}
+        if self._peek() == closing:
+            self.pos += 1
+            return result
+        while True:
+            if opening == "{":
+                if self._peek() != '"':
+                    self._expect('"')
+                key = self._value()
+                self._expect(":")
+                result[key] = self._parse(depth + 1)
+            else:
+                result.append(self._parse(depth + 1))
+            if self._expect("," + closing) == closing:
+                return result
+
+
+def load_json_stream(stream, encoding: str | None = None, limit: int | None = None):
+    """
+    Decode a JSON document from a binary stream, decompressing it as it is read.
+
+    Args:
+        stream: The binary stream of the document.
+        encoding (str | None): The ``Content-Encoding`` of the stream.
+        limit (int, optional): The most bytes to decompress. Defaults to ``CHATSNIP_UPLOAD_MAX_BYTES``.
+
+    Returns:
+        The decoded document.
+    """
+    decoded = decoded_stream(stream, encoding, limit)
+    try:
+        return JSONStreamDecoder(io.TextIOWrapper(decoded, encoding="utf-8")).decode()
+    except (OSError, EOFError, zlib.error, UnicodeDecodeError) as error:
+        raise exceptions.ParseError(f"Could not decode the {normalize_encoding(encoding)} body: {error}")
+
+
+class CompressedJSONParser(JSONParser):
+    """Parse JSON request bodies sent with a gzip, deflate or zstd ``Content-Encoding``.
+
+    Compressed bodies are decompressed and decoded as they are read. Bodies without an
+    encoding are parsed by ``JSONParser``.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get("request")
+        encoding = normalize_encoding(request.META.get("HTTP_CONTENT_ENCODING") if request is not None else None)
+        if encoding == "identity":
+            return super().parse(stream, media_type, parser_context)
+        return load_json_stream(stream, encoding)
+
+
+class ChunkStore:
+    """The chunks of an upload, stored on disk in a directory of the upload.
+
+    Every chunk is a file named after its offset in the upload, and the chunks are the
+    only record of how much was received: a chunk is written to a temporary file and
+    then linked to its name, which fails if another request stored a chunk at the same
+    offset first. The upload ends where the first gap in the chunks starts.
+    """
+
+    def __init__(self, upload_id):
+        self.path = os.path.join(upload_dir(), str(upload_id))
+
+    def chunks(self) -> list[tuple[int, str, int]]:
+        """The offset, path and size of every chunk, in order."""
+        try:
+            entries = [entry for entry in os.scandir(self.path) if entry.name.isdigit()]
+        except FileNotFoundError:
+            return []
+        return sorted((int(entry.name), entry.path, entry.stat().st_size) for entry in entries)
+
+    def offset(self) -> int:
+        """The number of bytes received."""
+        return sum(size for _, _, size in self._contiguous())
+
+    def append(self, offset: int, stream, limit: int | None = None) -> int:
+        """
+        Store a chunk at the end of the upload.
+
+        Args:
+            offset (int): Where the chunk starts in the upload, which must be where the upload ends.
+            stream: The binary stream of the chunk.
+            limit (int, optional): The largest size of the upload. Defaults to ``CHATSNIP_UPLOAD_MAX_BYTES``.
+
+        Returns:
+            int: The offset the upload ends at with the chunk.
+        """
+        limit = upload_max_bytes() if limit is None else limit
+        if offset != (current := self.offset()):
+            raise OffsetMismatch(current)
+        os.makedirs(self.path, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=self.path, prefix=".chunk-")
+        try:
+            size = 0
+            with os.fdopen(descriptor, "wb") as file:
+                while data := stream.read(READ_SIZE):
+                    size += len(data)
+                    if offset + size > limit:
+                        raise PayloadTooLarge()
+                    file.write(data)
+            if size:
+                try:
+                    os.link(temporary, os.path.join(self.path, str(offset)))
+                except FileExistsError:
+                    raise OffsetMismatch(self.offset())
+        finally:
+            os.unlink(temporary)
+        return offset + size
+
+    def open(self) -> io.BufferedReader:
+        """Read the received bytes of the upload, one chunk after another."""
+        return io.BufferedReader(_ChunkReader([path for _, path, _ in self._contiguous()]), READ_SIZE)
+
+    def _contiguous(self):
+        offset = 0
+        for chunk in self.chunks():
+            if chunk[0] != offset:
+                break
+            offset += chunk[2]
+            yield chunk
+
+    def delete(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class _ChunkReader(io.RawIOBase):
+    def __init__(self, paths: list[str]):
+        self.paths = list(reversed(paths))
+        self.file = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self.file is None:
+                if not self.paths:
+                    return 0
+                self.file = open(self.paths.pop(), "rb")
+            if read := self.file.readinto(buffer):
+                return read
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        super().close()
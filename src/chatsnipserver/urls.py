@@ -8,12 +8,17 @@ app_name = "chatsnip"
 router = DefaultRouter()
 router.register(r"chats", views.ChatViewSet, basename="chat")
 router.register(r"codefragments", views.CodeFragmentViewSet, basename="codefragment")
+router.register(r"uploads", views.ChatUploadViewSet, basename="chatupload")
 
 urlpatterns = [
+    path("api/chats/", views.chat_collection, name="chat_collection"),
     path("api/", include(router.urls)),
     path("chat/", views.ChatListView.as_view(), name="chat_list"),
     path("chat/create/", views.ChatCreateView.as_view(), name="chat_create"),
     path("chat/<int:pk>/", views.ChatDetailView.as_view(), name="chat_detail"),
+    path("chat/<int:pk>/source/", views.ChatSourceCodeView.as_view(), name="chat_source_code"),
+    path("chat/<int:pk>/source.zip", views.download_chat_sources, name="chat_source_zip"),
+    path("chat/source.zip", views.download_tagged_sources, name="tagged_source_zip"),
     path("chat/<int:pk>/update/", views.ChatUpdateView.as_view(), name="chat_update"),
     path("chat/<int:pk>/delete/", views.ChatDeleteView.as_view(), name="chat_delete"),
     path(
@@ -51,5 +56,16 @@ urlpatterns = [
         views.delete_fragment,
         name="fragment_delete",
     ),
+    path(
+        "fragment/<int:pk>/highlighted/",
+        views.highlighted_fragment,
+        name="fragment_highlighted",
+    ),
+    path("fragment/<int:pk>/diff/", views.fragment_diff, name="fragment_diff"),
+    path("tags/autocomplete/", views.tag_autocomplete, name="tag_autocomplete"),
+    path("stats/", views.StatsView.as_view(), name="stats"),
+    path("image/<int:pk>/", views.chat_image_file, name="chat_image_file"),
+    path("image/variant/<int:pk>/", views.chat_image_variant_file, name="chat_image_variant_file"),
+    path("metrics/", views.metrics, name="metrics"),
 
 ]
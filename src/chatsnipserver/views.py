@@ -1,11 +1,19 @@
-import json
+import hashlib
+import io
 import logging
+import math
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, get_object_or_404
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import content_disposition_header, urlencode
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import (
     CreateView,
     DeleteView,
@@ -14,111 +22,221 @@ from django.views.generic import (
     TemplateView,
     UpdateView,
 )
-from rest_framework import status, viewsets
+from rest_framework import exceptions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from pygments.formatters import HtmlFormatter
 
-from .forms import ChatSnipProfileForm
-from .models import Chat, ChatSnipProfile, CodeFragment
-from .serializers import ChatSerializer, CodeFragmentSerializer
+from .archive import SourceArchive, archive_filename
+from .authentication import ApiKeyAuthentication, ApiKeyHeaderAuthentication
+from .conditional import chat_list_validators, chat_validators, conditional_response
+from .diffs import DIFF_MODES, get_fragment_diff
+from .forms import ChatFilterForm, ChatSnipProfileForm
+from .ingest import ChatIngest
+from .instrumentation import registry
+from .querybudget import with_query_budget
+from .models import Chat, ChatImage, ChatImageVariant, ChatSnipProfile, ChatUpload, CodeFragment
+from .serializers import ChatSerializer, ChatUploadSerializer, CodeFragmentSerializer
+from .stats import chat_metadata_choices, user_stats
 from .services import (
+    adownload_images,
     check_duplicate_chat_content,
     check_duplicate_code_fragment,
     compose_chat_view,
+    compose_project_state_view,
     compose_source_code_view,
-    download_and_save_image,
-    get_or_create_chat,
-    get_pretty_date,
+    download_images,
+    get_highlighted_fragment,
     parse_source_code_fragments,
     save_code_fragment,
 )
+from .tags import autocomplete_tags, filter_chats_by_tags, tag_cloud
+from .throttling import ApiKeyRateThrottle, ingest_coalescer
+from .uploads import ChunkStore, CompressedJSONParser, OffsetMismatch, load_json_stream
 
 logger = logging.getLogger(__name__)
 formatter = HtmlFormatter(style='colorful')
 pygments_css = formatter.get_style_defs('.highlight')
 
 class ChatViewSet(viewsets.ModelViewSet):
-    """API endpoint for Chat."""
+    """API endpoint for Chat. The list is filtered by ``ChatFilterForm`` from the query parameters."""
 
     queryset = Chat.objects.all()
     serializer_class = ChatSerializer
+    authentication_classes = [ApiKeyAuthentication]
+    throttle_classes = [ApiKeyRateThrottle]
+    parser_classes = [CompressedJSONParser, *api_settings.DEFAULT_PARSER_CLASSES]
+    query_budget = {"create": 16, "list": 3, "retrieve": 3}
+
+    def get_queryset(self):
+        queryset = Chat.objects.filter(user=self.request.user)
+        if self.action == "list":
+            filters = ChatFilterForm(self.request.query_params)
+            if not filters.is_valid():
+                raise exceptions.ValidationError(filters.errors)
+            queryset = filters.filter(queryset)
+        return queryset
+
+    def get_permissions(self):
+        if self.action == "create":
+            return []
+        return [IsAuthenticated()]
+
+    def list(self, request, *args, **kwargs):
+        validators = chat_list_validators(self.get_queryset())
+        return conditional_response(request, validators, lambda: super(ChatViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        validators = chat_validators(kwargs["pk"], self.get_queryset())
+        return conditional_response(request, validators, lambda: super(ChatViewSet, self).retrieve(request, *args, **kwargs))
 
     def create(self, request, *args, **kwargs):
-        api_key = request.data.get("apiKey")
-        logger.debug(f"Received API Key: {api_key}")
-        if not api_key:
+        if not request.user.is_authenticated:
             logger.debug("API key missing.")
             return Response(
                 {"status": "API key missing."}, status=status.HTTP_400_BAD_REQUEST
             )
-        try:
-            profile = ChatSnipProfile.objects.get(api_key=api_key)
-        except ChatSnipProfile.DoesNotExist:
-            logger.debug("Invalid API key.")
-            return Response(
-                {"status": "Invalid API key."}, status=status.HTTP_403_FORBIDDEN
-            )
 
-        data = request.data
-        identifier = data.get("chatId")
-        json_data = data.get("content")
-        markdown = data.get('markdown', "")
-        chat_name = data.get("chatName", get_pretty_date())
-        images = [element for element in json_data if "src" in element]        
-        code_samples = [element for element in json_data if "language" in element]
-        saved = []
-        unchanged = []
-        import pprint
-        pprint.pprint(json_data)
-
-        if chat := Chat.objects.filter(
-            unique_identifier=identifier, user=profile.user
-        ).first():
-            if check_duplicate_chat_content(chat, json.dumps(json_data)) and chat.images_downloaded:
-                logger.debug("Duplicate chat content.")
-                return Response(
-                    {"status": "Duplicate content."},
-                    status=status.HTTP_208_ALREADY_REPORTED,
-                )
-        else:
-            chat = get_or_create_chat(identifier, chat_name, profile.user)
-            chat.markdown = markdown
-            chat.json_data = json_data
-            if not images:
-                chat.images_downloaded = True
-            saved.append('chat')
-            chat.save()
-
-        if images:
-            image_source_replacement = {}
-            for image in images:
-                result = download_and_save_image(
-                    chat, image.get("src"), title=None, description=image.get("content")
-                )
-                if not result.get('status') and result.get("status_code", 200) == 403:
-                    return Response({"status": "Chat saved, but images could not be downloaded. Refresh page and try again."})
-
-                if "image" in result:
-                    image_source_replacement[image.get("src")] = result.get('image').image.url
-
-            saved.append('images')
-                            
-            if image_source_replacement:
-                for original_source, new_source in image_source_replacement.items():
-                    chat.markdown = chat.markdown.replace(original_source, new_source)
-                    chat.json_data = json.loads(json.dumps(chat.json_data).replace(original_source, new_source))
-                chat.save()
-
-            if not chat.images_downloaded:
-                chat.images_downloaded = True
-                chat.save()
-            
-        for code_sample in code_samples:
-            if save_code_fragment(chat, filename=code_sample.get("filename"), content=code_sample.get("content"), language=code_sample.get("language")):
-                if not 'code' in saved:
-                    saved.append('code')
-
-        return Response({"status": f"Process done. Saved {' & '.join(saved)}."})
+        return ingest_chat(request.user, request.data)
+
+
+def ingest_chat(user, data) -> Response:
+    """Save the chat content, images and code fragments from an extension post, or queue it while the same chat is being saved."""
+    response = ingest_coalescer.run((user.pk, data.get("chatId")), data, lambda data: _ingest_chat(user, data))
+    if response is None:
+        logger.debug("Chat ingest in progress, queued latest content.")
+        return Response(
+            {"status": "Chat is being saved. Latest content queued."},
+            status=status.HTTP_202_ACCEPTED,
+        )
+    return response
+
+
+def _ingest_chat(user, data) -> Response:
+    ingest = ChatIngest(user, data)
+    if result := ingest.start():
+        return Response(*result)
+    return Response(*ingest.finish(download_images(ingest.chat, ingest.images, ingest.known_images)))
+
+
+chat_collection_api = ChatViewSet.as_view({"get": "list", "post": "create"})
+
+
+@with_query_budget({"get": 3, "post": 16})
+@csrf_exempt
+async def chat_collection(request, *args, **kwargs):
+    """List chats, or ingest a chat posted by the extension without tying up a thread.
+
+    Under ASGI the image downloads of a post run concurrently on the event loop, and
+    only the database and storage work runs in a thread. Listing is served by
+    ``ChatViewSet``. Set ``CHATSNIP_ASYNC_INGEST = False`` to ingest with the viewset too.
+    """
+    if request.method != "POST" or not getattr(settings, "CHATSNIP_ASYNC_INGEST", True):
+        return await sync_to_async(chat_collection_api)(request, *args, **kwargs)
+
+    api_request = Request(request, parsers=[parser() for parser in ChatViewSet.parser_classes])
+    try:
+        authenticated = await sync_to_async(ApiKeyAuthentication().authenticate)(api_request)
+    except (exceptions.AuthenticationFailed, exceptions.ParseError, exceptions.UnsupportedMediaType) as error:
+        return JsonResponse({"detail": str(error.detail)}, status=error.status_code)
+    if authenticated is None:
+        logger.debug("API key missing.")
+        return JsonResponse({"status": "API key missing."}, status=status.HTTP_400_BAD_REQUEST)
+    user, api_request.auth = authenticated
+
+    throttle = ApiKeyRateThrottle()
+    if not await sync_to_async(throttle.allow_request)(api_request, None):
+        throttled = exceptions.Throttled(throttle.wait())
+        return JsonResponse({"detail": str(throttled.detail)}, status=throttled.status_code, headers={"Retry-After": str(math.ceil(throttle.wait()))})
+
+    async def ingest(data):
+        ingest = ChatIngest(user, data)
+        if result := await sync_to_async(ingest.start)():
+            return result
+        results = await adownload_images(ingest.chat, ingest.images, ingest.known_images)
+        return await sync_to_async(ingest.finish)(results)
+
+    result = await ingest_coalescer.arun((user.pk, api_request.data.get("chatId")), api_request.data, ingest)
+    if result is None:
+        logger.debug("Chat ingest in progress, queued latest content.")
+        return JsonResponse({"status": "Chat is being saved. Latest content queued."}, status=status.HTTP_202_ACCEPTED)
+    return JsonResponse(result[0], status=result[1])
+
+
+class ChatUploadViewSet(viewsets.ViewSet):
+    """API endpoint for uploading a large chat in chunks that can be resumed.
+
+    ``POST /api/uploads/`` starts an upload with the ``size`` and ``encoding`` of the
+    payload, ``PATCH /api/uploads/<id>/`` appends the request body at the offset in the
+    ``Upload-Offset`` header, ``GET`` returns the offset to resume from, and
+    ``POST /api/uploads/<id>/finalize/`` saves the chat like ``ChatViewSet.create``.
+    ``DELETE`` abandons the upload.
+    """
+
+    authentication_classes = [ApiKeyHeaderAuthentication]
+    permission_classes = [IsAuthenticated]
+    parser_classes = [CompressedJSONParser]
+    lookup_value_regex = "[0-9a-fA-F-]{32,36}"
+    query_budget = {"create": 2, "retrieve": 2, "partial_update": 2, "destroy": 3, "finalize": 16}
+
+    def get_throttles(self):
+        # Only starting and finishing an upload count, not the chunks in between.
+        if self.action in ("create", "finalize"):
+            return [ApiKeyRateThrottle()]
+        return []
+
+    def get_upload(self, pk) -> ChatUpload:
+        return get_object_or_404(ChatUpload, pk=pk, user=self.request.user)
+
+    def upload_state(self, upload, offset) -> dict:
+        return {**ChatUploadSerializer(upload).data, "offset": offset}
+
+    def create(self, request):
+        serializer = ChatUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save(user=request.user)
+        location = reverse("chatsnip:chatupload-detail", args=[upload.pk])
+        return Response(self.upload_state(upload, 0), status=status.HTTP_201_CREATED, headers={"Location": location})
+
+    def retrieve(self, request, pk=None):
+        upload = self.get_upload(pk)
+        return Response(self.upload_state(upload, ChunkStore(upload.pk).offset()), headers={"Cache-Control": "no-store"})
+
+    def partial_update(self, request, pk=None):
+        """Append the request body to the upload."""
+        upload = self.get_upload(pk)
+        try:
+            offset = int(request.headers["Upload-Offset"])
+        except (KeyError, ValueError):
+            raise exceptions.ValidationError({"Upload-Offset": "The offset of the chunk is required."})
+        try:
+            offset = ChunkStore(upload.pk).append(offset, request.stream or io.BytesIO(), upload.size)
+        except OffsetMismatch as error:
+            return Response({"detail": error.detail, "offset": error.offset}, status=error.status_code)
+        return Response(self.upload_state(upload, offset))
+
+    def destroy(self, request, pk=None):
+        self.get_upload(pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=["post"])
+    def finalize(self, request, pk=None):
+        """Decode the uploaded chat and save it. An upload that fails to decode is kept until it is deleted or expires."""
+        upload = self.get_upload(pk)
+        store = ChunkStore(upload.pk)
+        offset = store.offset()
+        if upload.size is not None and offset != upload.size:
+            return Response({"detail": "Upload incomplete.", "offset": offset}, status=status.HTTP_409_CONFLICT)
+        with store.open() as stream:
+            data = load_json_stream(stream, upload.encoding)
+        if not isinstance(data, dict):
+            raise exceptions.ParseError("A chat must be a JSON object.")
+        response = ingest_chat(request.user, data)
+        upload.delete()
+        return response
 
 
 class CodeFragmentViewSet(viewsets.ModelViewSet):
@@ -126,22 +244,16 @@ class CodeFragmentViewSet(viewsets.ModelViewSet):
 
     queryset = CodeFragment.objects.all()
     serializer_class = CodeFragmentSerializer
+    authentication_classes = [ApiKeyAuthentication]
+    throttle_classes = [ApiKeyRateThrottle]
+    query_budget = {"create": 9, "list": 1, "retrieve": 1}
 
     def create(self, request, *args, **kwargs):
-        api_key = request.data.get("apiKey")
-        logger.debug(f"Received API Key: {api_key}")
-        if not api_key:
+        if not request.user.is_authenticated:
             logger.debug("API key missing.")
             return Response(
                 {"status": "API key missing."}, status=status.HTTP_400_BAD_REQUEST
             )
-        try:
-            profile = ChatSnipProfile.objects.get(api_key=api_key)
-        except ChatSnipProfile.DoesNotExist:
-            logger.debug("Invalid API key.")
-            return Response(
-                {"status": "Invalid API key."}, status=status.HTTP_403_FORBIDDEN
-            )
 
         data = request.data
         logger.debug(f"Received data: {data}")
@@ -163,11 +275,41 @@ class CodeFragmentViewSet(viewsets.ModelViewSet):
 
 
 class ChatListView(LoginRequiredMixin, ListView):
-    """View to list all chats."""
+    """View to list the user's chats, or the ones matching ``ChatFilterForm`` and with every tag given in ``?tag=``."""
 
     model = Chat
     template_name = "chatsnip/chat_list.html"
     context_object_name = "chats"
+    query_budget = 8
+
+    def get(self, request, *args, **kwargs):
+        self.selected_tags = request.GET.getlist("tag")
+        self.filter_form = ChatFilterForm(request.GET)
+        # Scoped like the API, so every filter is answered by one of the (user, ...) indexes and matches the suggested choices.
+        self.queryset = self.filter_form.filter(filter_chats_by_tags(Chat.objects.filter(user=request.user), request.user, self.selected_tags))
+        # Automatic tagging keeps the chat timestamps, so the tag counts are part of the ETag.
+        self.tag_cloud = tag_cloud(request.user)
+        tags_version = hashlib.md5(repr([(tag["slug"], tag["count"]) for tag in self.tag_cloud]).encode()).hexdigest()[:12]
+        validators = chat_list_validators(self.queryset, extra=tags_version)
+        return conditional_response(request, validators, lambda: super(ChatListView, self).get(request, *args, **kwargs))
+
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related("tags")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        filters = [(name, value) for name, value in self.request.GET.items() if name in self.filter_form.fields and value]
+        cloud = self.tag_cloud
+        for tag in cloud:
+            tag["selected"] = tag["slug"] in self.selected_tags
+            toggled = [slug for slug in self.selected_tags if slug != tag["slug"]] if tag["selected"] else [*self.selected_tags, tag["slug"]]
+            tag["query"] = urlencode([*filters, *(("tag", slug) for slug in toggled)])
+        context["tag_cloud"] = cloud
+        context["selected_tags"] = self.selected_tags
+        context["selected_tags_query"] = urlencode([("tag", slug) for slug in self.selected_tags])
+        context["filter_form"] = self.filter_form
+        context["filter_choices"] = chat_metadata_choices(self.request.user)
+        return context
 
 
 class ChatDetailView(LoginRequiredMixin, DetailView):
@@ -176,6 +318,11 @@ class ChatDetailView(LoginRequiredMixin, DetailView):
     model = Chat
     template_name = "chatsnip/chat_detail.html"
     context_object_name = "chat"
+    query_budget = 7
+
+    def get(self, request, *args, **kwargs):
+        validators = chat_validators(kwargs["pk"], self.get_queryset())
+        return conditional_response(request, validators, lambda: super(ChatDetailView, self).get(request, *args, **kwargs))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -184,6 +331,30 @@ class ChatDetailView(LoginRequiredMixin, DetailView):
         return context
 
 
+class ChatSourceCodeView(LoginRequiredMixin, DetailView):
+    """View to display every version of the source code files in a chat, or the files after the message given in ``?message=``."""
+
+    model = Chat
+    template_name = "chatsnip/chat_source_code.html"
+    context_object_name = "chat"
+    query_budget = 5
+
+    def get_queryset(self):
+        return Chat.objects.filter(user=self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        try:
+            message = int(self.request.GET["message"])
+        except (KeyError, ValueError):
+            context.update(compose_source_code_view(self.object))
+        else:
+            context.update(compose_project_state_view(self.object, message))
+            context["project_state"] = True
+        context["pygments_css"] = pygments_css
+        return context
+
+
 class ChatCreateView(LoginRequiredMixin, CreateView):
     """View to create a new chat."""
 
@@ -191,6 +362,7 @@ class ChatCreateView(LoginRequiredMixin, CreateView):
     template_name = "chatsnip/chat_form.html"
     fields = ["name", "content", "tags"]
     success_url = reverse_lazy("chatsnip:chat_list")
+    query_budget = {"get": 3}
 
     def form_valid(self, form):
         form.instance.user = self.request.user
@@ -209,6 +381,7 @@ class ChatUpdateView(LoginRequiredMixin, UpdateView):
     template_name = "chatsnip/chat_form.html"
     fields = ["name", "content", "tags"]
     success_url = reverse_lazy("chatsnip:chat_list")
+    query_budget = {"get": 4}
 
 
 class ChatDeleteView(LoginRequiredMixin, DeleteView):
@@ -217,6 +390,7 @@ class ChatDeleteView(LoginRequiredMixin, DeleteView):
     model = Chat
     template_name = "chatsnip/chat_confirm_delete.html"
     success_url = reverse_lazy("chatsnip:chat_list")
+    query_budget = {"get": 3, "post": 13}
 
 
 class CodeFragmentListView(LoginRequiredMixin, ListView):
@@ -225,6 +399,7 @@ class CodeFragmentListView(LoginRequiredMixin, ListView):
     model = CodeFragment
     template_name = "chatsnip/codefragment_list.html"
     context_object_name = "code_fragments"
+    query_budget = 3
 
 
 class CodeFragmentDetailView(LoginRequiredMixin, DetailView):
@@ -233,6 +408,7 @@ class CodeFragmentDetailView(LoginRequiredMixin, DetailView):
     model = CodeFragment
     template_name = "chatsnip/codefragment_detail.html"
     context_object_name = "code_fragment"
+    query_budget = 3
 
 
 class CodeFragmentCreateView(LoginRequiredMixin, CreateView):
@@ -242,6 +418,7 @@ class CodeFragmentCreateView(LoginRequiredMixin, CreateView):
     template_name = "chatsnip/codefragment_form.html"
     fields = ["chat", "filename", "programming_language", "source_code"]
     success_url = reverse_lazy("chatsnip:codefragment_list")
+    query_budget = {"get": 3, "post": 10}
 
     def form_valid(self, form):
         if check_duplicate_code_fragment(
@@ -259,6 +436,7 @@ class CodeFragmentUpdateView(LoginRequiredMixin, UpdateView):
     template_name = "chatsnip/codefragment_form.html"
     fields = ["filename", "programming_language", "source_code", "selected"]
     success_url = reverse_lazy("chatsnip:codefragment_list")
+    query_budget = {"get": 3, "post": 6}
 
 
 class CodeFragmentDeleteView(LoginRequiredMixin, DeleteView):
@@ -267,14 +445,32 @@ class CodeFragmentDeleteView(LoginRequiredMixin, DeleteView):
     model = CodeFragment
     template_name = "chatsnip/codefragment_confirm_delete.html"
     success_url = reverse_lazy("chatsnip:codefragment_list")
+    query_budget = {"get": 3, "post": 8}
+
+
+class StatsView(LoginRequiredMixin, TemplateView):
+    """View to display the statistics of the user's chats, from the daily rollups."""
+
+    template_name = "chatsnip/stats.html"
+    query_budget = 4
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        stats = user_stats(self.request.user)
+        context["stats"] = stats
+        context["breakdowns"] = [("Chatbots", stats["chatbots"]), ("LLM models", stats["llm_models"]), ("Languages", stats["languages"])]
+        context["activity_max"] = max(day["chats"] for day in stats["activity"]) or 1
+        return context
 
 
 class ExtensionDetailView(TemplateView):
     """View to display details and installation instructions for the Chrome extension."""
 
     template_name = "chatsnip/extension_detail.html"
+    query_budget = 0
 
 
+@with_query_budget(4)
 @login_required
 def regenerate_api_key(request):
     profile = request.user.chatsnipprofile
@@ -289,6 +485,7 @@ class ChatSnipProfileUpdateView(LoginRequiredMixin, UpdateView):
     form_class = ChatSnipProfileForm
     template_name = "chatsnip/profile_form.html"
     success_url = reverse_lazy("chatsnip:profile")
+    query_budget = {"get": 3, "post": 5}
 
     def get_object(self):
         return self.request.user.chatsnipprofile
@@ -297,6 +494,7 @@ class ChatSnipProfileUpdateView(LoginRequiredMixin, UpdateView):
         form.instance.user = self.request.user
         return super().form_valid(form)
 
+@with_query_budget(8)
 @login_required
 def delete_fragment(request):
     fragment_id = request.POST.get("fragment_id")
@@ -304,4 +502,113 @@ def delete_fragment(request):
         return JsonResponse({"status": False, "message": "No fragment ID provided."})
     code_fragment = get_object_or_404(CodeFragment, pk=fragment_id)
     code_fragment.delete()
-    return JsonResponse({"status": True, "message": "Code fragment deleted."})
\ No newline at end of file
+    return JsonResponse({"status": True, "message": "Code fragment deleted."})
+
+
+@with_query_budget(4)
+@login_required
+def highlighted_fragment(request, pk):
+    """Return the highlighted HTML of a single code fragment version."""
+    html = get_highlighted_fragment(pk, request.user)
+    if html is None:
+        raise Http404("No such code fragment.")
+    return JsonResponse({"id": pk, "html": html})
+
+
+@with_query_budget(4)
+@login_required
+def download_chat_sources(request, pk):
+    """Download the selected version of every file in a chat as a zip."""
+    chat = get_object_or_404(Chat.objects.only("pk", "name"), pk=pk, user=request.user)
+    return _source_archive_response(request, SourceArchive(Chat.objects.filter(pk=chat.pk)), archive_filename(chat.name))
+
+
+@with_query_budget(4)
+@login_required
+def download_tagged_sources(request):
+    """Download the selected version of every file in the chats with every tag given in ``?tag=``, a folder per chat."""
+    tags = request.GET.getlist("tag")
+    if not tags:
+        return HttpResponseBadRequest("Select at least one tag.")
+    chats = filter_chats_by_tags(Chat.objects.all(), request.user, tags)
+    return _source_archive_response(request, SourceArchive(chats, folders=True), archive_filename("-".join(tags)))
+
+
+def _source_archive_response(request, archive, filename):
+    """Answer from the ETag or the cache when possible, otherwise stream the zip while building it."""
+    etag = quote_etag(archive.digest)
+    if response := get_conditional_response(request, etag=etag):
+        return response
+    if (content := archive.cached()) is not None:
+        response = HttpResponse(content, content_type="application/zip")
+    else:
+        chunks = archive.astream() if isinstance(request, ASGIRequest) else archive.stream()
+        response = StreamingHttpResponse(chunks, content_type="application/zip")
+    response.headers["ETag"] = etag
+    response.headers["Content-Disposition"] = content_disposition_header(True, filename)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@with_query_budget(5)
+@login_required
+def fragment_diff(request, pk):
+    """Return the diff of a code fragment version against the previous version of its file, as ``?mode=unified`` or ``split`` HTML."""
+    mode = request.GET.get("mode", "unified")
+    if mode not in DIFF_MODES:
+        return HttpResponseBadRequest("Unknown diff mode.")
+    diff = get_fragment_diff(pk, request.user, mode)
+    if diff is None:
+        raise Http404("No such code fragment.")
+    return JsonResponse({"id": pk, **diff})
+
+
+@with_query_budget(3)
+@login_required
+def tag_autocomplete(request):
+    """Return the tags of the user starting with the ``q`` parameter, most used first."""
+    return JsonResponse({"tags": autocomplete_tags(request.user, request.GET.get("q", "").strip())})
+
+
+@with_query_budget(3)
+@login_required
+def chat_image_file(request, pk):
+    """Redirect to the storage URL of a chat image."""
+    chat_image = get_object_or_404(ChatImage.objects.only("image"), pk=pk, chat__user=request.user)
+    return _redirect_to_file(chat_image.image)
+
+
+@with_query_budget(3)
+@login_required
+def chat_image_variant_file(request, pk):
+    """Redirect to the storage URL of a resized chat image."""
+    own_checksums = ChatImage.objects.filter(chat__user=request.user).values("checksum")
+    variant = get_object_or_404(ChatImageVariant.objects.only("image"), pk=pk, checksum__in=own_checksums)
+    return _redirect_to_file(variant.image)
+
+
+def _redirect_to_file(file):
+    """Redirect to a file, which is a freshly signed URL on S3-compatible storage.
+
+    The redirect is cached for ``CHATSNIP_SIGNED_URL_CACHE_SECONDS``, which must stay
+    below the lifetime of the signatures.
+    """
+    response = redirect(file.url)
+    patch_cache_control(response, private=True, max_age=getattr(settings, "CHATSNIP_SIGNED_URL_CACHE_SECONDS", 300))
+    return response
+
+
+@with_query_budget(2)
+def metrics(request):
+    """Expose the process metrics in the Prometheus text format.
+
+    Staff users can read the metrics; scrapers authenticate with a bearer token
+    matching ``CHATSNIP_METRICS_TOKEN``.
+    """
+    token = getattr(settings, "CHATSNIP_METRICS_TOKEN", None)
+    authorized = request.user.is_staff or (
+        token and request.headers.get("Authorization") == f"Bearer {token}"
+    )
+    if not authorized:
+        return HttpResponse(status=403)
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4")
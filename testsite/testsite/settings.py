@@ -4,6 +4,8 @@ import os
 DEBUG = True
 from pathlib import Path
 
+from chatsnipserver.database import SQLITE_PRAGMAS, sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -38,6 +40,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "chatsnipserver.instrumentation.PerformanceMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -46,6 +49,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "chatsnipserver.querybudget.QueryBudgetMiddleware",
 ]
 
 ROOT_URLCONF = "testsite.urls"
@@ -73,11 +77,9 @@ WSGI_APPLICATION = "testsite.wsgi.application"
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
 DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-    }
+    "default": sqlite_database(BASE_DIR / "db.sqlite3"),
 }
+CHATSNIP_SQLITE_PRAGMAS = SQLITE_PRAGMAS
 
 
 # Password validation